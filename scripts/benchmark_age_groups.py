@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Cost of the disease and travel steps as the number of age groups grows, on the Texas network.
+The 5 age groups of the population file and the Mistry contact matrix are split into 16
+five-year groups or 85 single-year groups: each finer group takes an equal share of the people
+of its 5-group band, and the contacts with a band are shared equally among its finer groups,
+so every run describes the same epidemic. Every county has people in E, IA, IP and IS, so
+every node and travel source is active.
+
+    python scripts/benchmark_age_groups.py --age-groups 5 16 85 --days 5
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from types import SimpleNamespace
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+import pandas as pd
+from baseclasses.Group import Group
+from baseclasses.Network import Network
+from baseclasses.Node import Node
+from baseclasses.PopulationCompartments import PopulationCompartments
+from baseclasses.TravelFlow import TravelFlow
+from models.disease.DiseaseModel import DiseaseModel
+from models.disease.StochasticSEATIRD import Schedule
+from models.travel.TravelModel import TravelModel
+
+TEXAS = os.path.join(ROOT, 'data', 'Texas')
+BAND_START = [0, 5, 18, 50, 65]    # first age of the 5 groups of the population file
+SEIHRD_LABELS = ['S', 'E', 'IA', 'IP', 'IS', 'H', 'R', 'D']
+
+
+def fine_bands(number_of_age_groups:int) -> np.ndarray:
+    """
+    Band of the population file each finer age group falls in, by its first age
+    """
+    if number_of_age_groups == len(BAND_START):
+        return np.arange(len(BAND_START))
+    width = {16: 5, 85: 1}[number_of_age_groups]
+    return np.searchsorted(BAND_START, np.arange(number_of_age_groups) * width, side='right') - 1
+
+
+def make_inputs(number_of_age_groups:int):
+    bands = fine_bands(number_of_age_groups)
+    share = 1.0 / np.bincount(bands)[bands]          # share of its band each finer group takes
+    population = pd.read_csv(os.path.join(TEXAS, 'county_pop_by_age_Texas_2019-2023ACS.csv')).iloc[:, 1:].to_numpy()
+    contact = np.loadtxt(os.path.join(TEXAS, 'contact_matrix_Texas_Mistry2021_all.csv'), delimiter=',')
+    return population[:, bands] * share, contact[np.ix_(bands, bands)] * share[None, :], bands
+
+
+def make_network(population:np.ndarray, labels:list, travel:bool=True) -> Network:
+    network = Network(labels)
+    infected = [labels.index(c) for c in labels if c not in ('S', 'R', 'D', 'H')]
+    for index, by_age in enumerate(population):
+        compartments = PopulationCompartments(age_group_pops=by_age.tolist(), high_risk_ratios=[0.1] * len(by_age))
+        seeded = np.floor(compartments.compartment_data[:, :, 0, 0] * 0.001)
+        compartments.compartment_data[:, :, 0, 0] -= seeded * len(infected)
+        compartments.compartment_data[:, :, 0, infected] += seeded[..., None]
+        network._add_node(Node(index, index, index, compartments))
+    if travel:
+        flow = TravelFlow(network.get_number_of_nodes())
+        flow.load_travel_flow_file(os.path.join(TEXAS, 'Texas_Q1-2019_mobility-matrix.csv'))
+        network.add_travel_flow_data(flow.flow_data)
+    return network
+
+
+def make_parameters(contact:np.ndarray, bands:np.ndarray, identity:str):
+    by_band = lambda values: [values[b] for b in bands]
+    disease_parameters = {
+        'seihrd-stochastic': {
+            'compartments': SEIHRD_LABELS, 'R0': '2.2', 'E_to_IPandIA_days': '0.7', 'IP_to_IS_days': '0.9',
+            'IS_to_H_days': '3.74', 'H_to_D_days': '5.9', 'IS_to_R_days': '2.0', 'IA_to_R_days': '2.3',
+            'H_to_R_days': by_band(['4.7', '4.8', '6.2', '6.8', '6.55']),
+            'prop_E_to_IA': by_band(['0.25', '0.25', '0.3', '0.3', '0.3']),
+            'prop_IS_to_H_lowrisk': by_band(['0.0132', '0.0099', '0.0295', '0.0594', '0.0802']),
+            'prop_H_to_D': by_band(['0.00697', '0.00274', '0.00561', '0.0106', '0.0909']),
+            'highrisk_hosp_multiplier': '3.0', 'rel_inf_IP_to_IS': '0.45', 'rel_inf_IA_to_IS': '0.97'},
+        'seirs-deterministic': {
+            'compartments': ['S', 'E', 'I', 'R'], 'R0': '2.2', 'latent_period_days': '0.7',
+            'infectious_period_days': '2.0', 'immune_period_days': '0'},
+        'seatird-stochastic': {
+            'compartments': ['S', 'E', 'A', 'T', 'I', 'R', 'D'], 'R0': '3', 'beta_scale': '14', 'tau': '7',
+            'kappa': '2', 'gamma': '14.0281', 'chi': '3', 'nu': ['0.002'] * len(bands), 'sigma': ['1'] * len(bands)},
+    }[identity]
+    return SimpleNamespace(
+        number_of_age_groups=len(bands), np_contact_matrix=contact, disease_parameters=disease_parameters,
+        travel_parameters={'rho': '1', 'flow_reduction': ['1.0'] * len(bands), 'engine': 'vectorized',
+                           'traveling_compartments': {'IA': '0.97', 'IP': '0.45'},
+                           'transmitting_compartments': {'IA': '0.97', 'IP': '0.45', 'IS': '1.0'}})
+
+
+def make_disease_model(parameters, identity:str, network:Network, days:int):
+    parent = DiseaseModel.__new__(DiseaseModel)
+    parent.now, parent.parameters = 0, parameters
+    parent.npis_schedule = np.zeros((days + 1, network.get_number_of_nodes(), parameters.number_of_age_groups))
+    model = parent.get_child(identity)
+    if hasattr(model, 'set_seed'):
+        model.set_seed(np.random.SeedSequence(1))
+    return model
+
+
+def per_day(step, days:int) -> float:
+    """
+    Milliseconds per call of step(day), over days calls
+    """
+    if days == 0:
+        return float('nan')
+    start = time.perf_counter()
+    for day in range(1, days + 1):
+        step(day)
+    return (time.perf_counter() - start) / days * 1e3
+
+
+def benchmark(number_of_age_groups:int, days:int, pairwise_days:int) -> dict:
+    population, contact, bands = make_inputs(number_of_age_groups)
+    vaccine = SimpleNamespace(vaccine_effectiveness=[0.5] * len(bands), vaccine_effectiveness_hosp=[0.5] * len(bands))
+    results = {}
+
+    for identity in ('seihrd-stochastic', 'seirs-deterministic'):
+        parameters = make_parameters(contact, bands, identity)
+        network = make_network(population, parameters.disease_parameters['compartments'])
+        model = make_disease_model(parameters, identity, network, days)
+        results[identity] = per_day(lambda day: model.simulate_network(network, day, vaccine), days)
+
+    parameters = make_parameters(contact, bands, 'seihrd-stochastic')
+    network = make_network(population, SEIHRD_LABELS)
+    model = make_disease_model(parameters, 'seihrd-stochastic', network, days)
+    for engine, travel_days in (('vectorized', days), ('loop', pairwise_days)):
+        parameters.travel_parameters['engine'] = engine
+        travel_model = TravelModel(parameters).get_child('binomial')
+        travel_model.reset_active_sources(network)
+        results[f'travel {engine}'] = per_day(
+            lambda day: travel_model.travel(network, model, parameters, day, vaccine), travel_days)
+
+    # node output of the writer, every compartment by age for each subgroup
+    results['node output'] = per_day(lambda day: [node.return_dict() for node in network.nodes], days)
+
+    # the individual-based SEATIRD model schedules the contacts of each exposed person with every group
+    parameters = make_parameters(contact, bands, 'seatird-stochastic')
+    network = make_network(population[:1], parameters.disease_parameters['compartments'], travel=False)
+    model = make_disease_model(parameters, 'seatird-stochastic', network, days)
+    model._group_cache_per_node(network)
+    node, group = network.nodes[0], Group(0, 0, 0)
+    np.random.seed(1)    # the SEATIRD model draws from the global generator
+    schedules = [Schedule(model, 0.0, group) for _ in range(1000)]
+    elapsed = 0.0
+    for schedule in schedules:
+        node.events = []
+        start = time.perf_counter()
+        model._initialize_contact_events(node, group, schedule, node.group_cache, vaccine)
+        elapsed += time.perf_counter() - start
+    results['seatird contacts'] = elapsed / len(schedules) * 1e6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--age-groups', type=int, nargs='+', default=[5, 16, 85], choices=[5, 16, 85])
+    parser.add_argument('--days', type=int, default=5)
+    parser.add_argument('--pairwise-days', type=int, default=1, help='days of the pairwise loop travel engine, 0 skips it')
+    args = parser.parse_args()
+
+    columns = ('seihrd-stochastic', 'seirs-deterministic', 'travel vectorized', 'travel loop', 'node output')
+    print('milliseconds per day for the network, and microseconds per exposed person for the SEATIRD contacts')
+    print(f'{"age groups":>10}' + ''.join(f'{name:>20}' for name in (*columns, 'seatird contacts')))
+    for number_of_age_groups in args.age_groups:
+        results = benchmark(number_of_age_groups, args.days, args.pairwise_days)
+        print(f'{number_of_age_groups:>10}' + ''.join(f'{results[name]:>17.1f} ms' for name in columns)
+              + f'{results["seatird contacts"]:>17.1f} us')
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Accuracy / time tradeoff of the integrators of the deterministic SEIRS model on a synthetic
+network: one Euler step per day, node by node and for the whole network at once, classical
+RK4 with a few steps per day, and adaptive RK45. Errors are against RK4 with 256 steps a day.
+
+    python scripts/benchmark_ode.py --nodes 254 --days 120
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from baseclasses.Network import Network
+from baseclasses.Node import Node
+from baseclasses.PopulationCompartments import PopulationCompartments
+from models.disease.DiseaseModel import DiseaseModel
+
+NUMBER_OF_AGE_GROUPS = 5
+VACCINE = SimpleNamespace(vaccine_effectiveness=[0.0] * NUMBER_OF_AGE_GROUPS)
+
+
+def make_network(nodes, rng):
+    network = Network(['S', 'E', 'I', 'R'])
+    for index in range(nodes):
+        population = rng.lognormal(10, 1.2, NUMBER_OF_AGE_GROUPS).round() + 100
+        compartments = PopulationCompartments(age_group_pops=population.tolist(),
+                                              high_risk_ratios=[0.1] * NUMBER_OF_AGE_GROUPS)
+        seeded = min(10.0, compartments.compartment_data[2, 0, 0, 0])
+        compartments.compartment_data[2, 0, 0, 0] -= seeded
+        compartments.compartment_data[2, 0, 0, 2] += seeded
+        network._add_node(Node(index, index, index, compartments))
+    return network
+
+
+def make_model(days, **ode):
+    parameters = SimpleNamespace(
+        number_of_age_groups=NUMBER_OF_AGE_GROUPS,
+        np_contact_matrix=np.full((NUMBER_OF_AGE_GROUPS, NUMBER_OF_AGE_GROUPS), 0.5) + np.eye(NUMBER_OF_AGE_GROUPS),
+        disease_parameters={'compartments': ['S', 'E', 'I', 'R'], 'R0': '2.5', 'latent_period_days': '0.7',
+                            'infectious_period_days': '2.0', 'immune_period_days': '0', **ode})
+    parent = DiseaseModel.__new__(DiseaseModel)
+    parent.now, parent.parameters = 0, parameters
+    parent.npis_schedule = [[[]]] * (days + 1)
+    return parent.get_child('seirs-deterministic')
+
+
+def run(network, days, by_node=False, **ode):
+    """
+    Infectious people by [day][node]
+    """
+    model = make_model(days, **ode)
+    compartments = network.get_compartment_array()
+    population = network.get_population_array()
+    beta = np.full((compartments.shape[0], NUMBER_OF_AGE_GROUPS), model.beta)
+    infectious = []
+    start = time.perf_counter()
+    for day in range(1, days + 1):
+        model.now = day
+        if by_node:
+            compartments = np.stack([model._advance(compartments[i:i + 1], beta[i:i + 1], population[i:i + 1],
+                                                    VACCINE)[0] for i in range(compartments.shape[0])])
+        else:
+            compartments = model._advance(compartments, beta, population, VACCINE)
+        infectious.append(compartments[..., 2].sum(axis=(1, 2, 3)))
+    return np.array(infectious), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=254)
+    parser.add_argument('--days', type=int, default=120)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    network = make_network(args.nodes, np.random.default_rng(args.seed))
+
+    reference, _ = run(network, args.days, ode_integrator='rk4', ode_steps_per_day=256)
+    peak = reference.max(axis=0)
+    cases = [('euler, node by node', dict(by_node=True)),
+             ('euler, whole network', {}),
+             ('rk4, 1 step/day', dict(ode_integrator='rk4', ode_steps_per_day=1)),
+             ('rk4, 4 steps/day', dict(ode_integrator='rk4', ode_steps_per_day=4)),
+             ('rk45, rtol 1e-3', dict(ode_integrator='rk45', ode_rtol=1e-3)),
+             ('rk45, rtol 1e-4', dict(ode_integrator='rk45', ode_rtol=1e-4))]
+    for name, options in cases:
+        infectious, seconds = run(network, args.days, **options)
+        error = (np.abs(infectious - reference).max(axis=0) / peak).max()
+        peak_shift = np.abs(infectious.argmax(axis=0) - reference.argmax(axis=0)).max()
+        print(f'{name:<22} {seconds:7.3f}s  max |I - reference| / peak {error:9.2e}  peak day off by <= {peak_shift}')
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Accuracy / time tradeoff of the integrators of the stochastic models on a single well-mixed
+SEIR population: the exact stochastic simulation algorithm (Gillespie direct method, and the
+Gibson-Bruck next reaction method the models use), the daily Poisson leap of StochasticSEIRS,
+the daily chain binomial, and adaptive tau-leaping at a few error settings.
+Replicates run side by side as independent nodes.
+
+    python scripts/benchmark_tau_leap.py --replicates 400 --population 2000
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from models.disease.StochasticSEIRS import (SEIRS_model_vectorized, SEIRS_STOICHIOMETRY, SEIRS_SOURCE, SEIRS_ORDER,
+                                            SEIRS_TARGET)
+from models.disease.ChainBinomial import chain_binomial
+from models.disease.NextReaction import next_reaction
+from models.disease.TauLeaping import adaptive_tau_leap
+
+R0, LATENT_DAYS, INFECTIOUS_DAYS = 2.2, 0.7, 2.0
+SIGMA, GAMMA = 1 / LATENT_DAYS, 1 / INFECTIOUS_DAYS
+BETA = R0 * GAMMA
+
+
+def propensities(counts):
+    S, E, I, R = np.moveaxis(counts, -1, 0)
+    N = counts.sum(axis=-1)
+    return np.stack([BETA * S * I / N, SIGMA * E, GAMMA * I, 0.0 * R], axis=-1)
+
+
+def run_ssa(initial, days, rng):
+    """
+    Exact trajectories, one replicate at a time; returns the state at the end of each day
+    """
+    out = np.zeros((len(initial), days + 1, 4))
+    for r, y in enumerate(initial):
+        S, E, I, R = (int(x) for x in y)
+        N, t = S + E + I + R, 0.0
+        out[r, 0] = y
+        for day in range(1, days + 1):
+            while True:
+                infection, onset, recovery = BETA * S * I / N, SIGMA * E, GAMMA * I
+                total = infection + onset + recovery
+                if total == 0:
+                    break
+                t += rng.exponential(1 / total)
+                if t > day:
+                    break
+                pick = rng.random() * total
+                if pick < infection:
+                    S, E = S - 1, E + 1
+                elif pick < infection + onset:
+                    E, I = E - 1, I + 1
+                else:
+                    I, R = I - 1, R + 1
+            # exponential waiting times are memoryless, so the clock restarts at the day boundary
+            t = float(day)
+            out[r, day] = (S, E, I, R)
+    return out
+
+
+def run_next_reaction(initial, days, rng):
+    out = np.zeros((len(initial), days + 1, 4))
+    rates = np.array([1.0, SIGMA, GAMMA, 0.0])
+    infection = np.array([True, False, False, False])
+    infectious_weights = np.array([0.0, 0.0, 1.0, 0.0])
+    for r, y in enumerate(initial):
+        counts = y.reshape(1, 1, 1, 4)
+        force_matrix = np.full((1, 1, 1), BETA / y.sum())
+        out[r, 0] = y
+        for day in range(1, days + 1):
+            counts, _ = next_reaction(counts, rates, SEIRS_SOURCE, SEIRS_TARGET, infection, force_matrix,
+                                      infectious_weights, rng)
+            out[r, day] = counts.ravel()
+    return out
+
+
+def run_daily(initial, days, rng):
+    y = initial.copy()
+    out = [y.copy()]
+    for _ in range(days):
+        transmission_rate = BETA * y[:, 2] / y.sum(axis=1)
+        y = y + SEIRS_model_vectorized(y, transmission_rate, SIGMA, GAMMA, 0.0, rng)
+        out.append(y.copy())
+    return np.stack(out, axis=1)
+
+
+def run_chain_binomial(initial, days, rng, steps_per_day):
+    y = initial.copy()
+    out = [y.copy()]
+    for _ in range(days):
+        for _ in range(steps_per_day):
+            rates = np.stack(np.broadcast_arrays(BETA * y[:, 2] / y.sum(axis=1), SIGMA, GAMMA, 0.0), axis=-1)
+            y = y + chain_binomial(y, rates, SEIRS_SOURCE, rng, 1.0 / steps_per_day) @ SEIRS_STOICHIOMETRY
+        out.append(y.copy())
+    return np.stack(out, axis=1)
+
+
+def run_tau_leap(initial, days, rng, epsilon):
+    y = initial.copy()
+    out = [y.copy()]
+    substeps = 0
+    for _ in range(days):
+        y, steps = adaptive_tau_leap(y, propensities, SEIRS_STOICHIOMETRY, SEIRS_SOURCE, SEIRS_ORDER, rng, epsilon)
+        substeps += steps.mean()
+        out.append(y.copy())
+    return np.stack(out, axis=1), substeps / days
+
+
+def summarize(name, trajectories, seconds, reference=None, extra=''):
+    final_size = trajectories[:, -1, 3]
+    peak_day = trajectories[:, :, 2].argmax(axis=1)
+    line = (f'{name:<22} {seconds:8.2f}s  final size {final_size.mean():8.1f} +- {final_size.std():6.1f}  '
+            f'peak day {peak_day.mean():5.1f}')
+    if reference is not None:
+        mean_error = np.abs(trajectories[:, :, 2].mean(axis=0) - reference[:, :, 2].mean(axis=0)).max()
+        line += f'  max |mean I - SSA| {mean_error:7.1f}'
+    print(line + extra)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--replicates', type=int, default=400)
+    parser.add_argument('--population', type=int, default=2000)
+    parser.add_argument('--infected', type=int, default=5)
+    parser.add_argument('--days', type=int, default=80)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    initial = np.tile([args.population - args.infected, 0.0, args.infected, 0.0], (args.replicates, 1))
+    rng = np.random.default_rng(args.seed)
+
+    start = time.perf_counter()
+    exact = run_ssa(initial, args.days, rng)
+    summarize('exact SSA', exact, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    summarize('next reaction', run_next_reaction(initial, args.days, rng), time.perf_counter() - start, exact)
+
+    start = time.perf_counter()
+    daily = run_daily(initial, args.days, rng)
+    summarize('daily leap', daily, time.perf_counter() - start, exact)
+
+    for steps_per_day in (1, 4, 16):
+        start = time.perf_counter()
+        summarize(f'chain binomial x{steps_per_day}', run_chain_binomial(initial, args.days, rng, steps_per_day),
+                  time.perf_counter() - start, exact)
+
+    for epsilon in (0.1, 0.03, 0.01):
+        start = time.perf_counter()
+        leapt, substeps = run_tau_leap(initial, args.days, rng, epsilon)
+        summarize(f'tau leap eps={epsilon}', leapt, time.perf_counter() - start, exact,
+                  f'  {substeps:5.1f} sub-steps/day')
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import logging
+import numpy as np
+from collections import deque
+from typing import Type
+
+from .Network import Network
+
+logger = logging.getLogger(__name__)
+
+
+class Equilibrium:
+
+    def __init__(self, equilibrium_parameters:dict, total_population:float):
+        """
+        Detect when the network totals of a run settle into an endemic equilibrium or a stable
+        cycle, e.g. a SEIRS run with waning immunity, so the run can stop or fast-forward
+        instead of simulating the same days over and over. Parameters, all optional:
+            window_days: days the totals must hold still, or repeat, for (default 60)
+            tolerance: largest change of any compartment, as a fraction of the total
+                       population (default 1e-4)
+            max_period_days: longest cycle looked for, 1 detects a steady state only (default 1)
+            action: "stop" ends the run, "extrapolate" repeats the last cycle for the remaining
+                    days without simulating them (default "stop")
+
+        Args:
+            equilibrium_parameters (dict): the parameters above, from the input file
+            total_population (float): total population of the network
+        """
+        self.window_days     = int(equilibrium_parameters.get('window_days', 60))
+        self.tolerance       = float(equilibrium_parameters.get('tolerance', 1e-4))
+        self.max_period_days = int(equilibrium_parameters.get('max_period_days', 1))
+        self.action          = str(equilibrium_parameters.get('action', 'stop')).lower()
+        if self.window_days < 2:
+            raise ValueError(f'equilibrium window_days must be at least 2, got {self.window_days}')
+        if self.max_period_days < 1:
+            raise ValueError(f'equilibrium max_period_days must be at least 1, got {self.max_period_days}')
+        if self.action not in ('stop', 'extrapolate'):
+            raise ValueError(f'equilibrium action must be "stop" or "extrapolate", got "{self.action}"')
+        self.threshold = self.tolerance * total_population
+        self.reset()
+
+        logger.info(f'instantiated Equilibrium object, window_days={self.window_days}, tolerance={self.tolerance}, '
+                    f'max_period_days={self.max_period_days}, action={self.action}')
+        return
+
+
+    def __str__(self) -> str:
+        return(f'Equilibrium:window_days={self.window_days},tolerance={self.tolerance},'
+               f'max_period_days={self.max_period_days},action={self.action}')
+
+
+    def reset(self):
+        """
+        Forget the history of the previous realization
+        """
+        self.totals = deque(maxlen=self.window_days + self.max_period_days)
+        # network states of the last cycle, to repeat them when extrapolating
+        self.states = deque(maxlen=self.max_period_days)
+        self.day = None
+        self.period = None
+        return
+
+
+    def update(self, day:int, totals:np.ndarray, network:Type[Network]) -> bool:
+        """
+        Add the network totals of a day and check them for a steady state, where no compartment
+        moved by more than the tolerance over the window, or a cycle of period P, where every day
+        of the window is within the tolerance of the day P days before it and the last P days are
+        within the tolerance of the first whole period of the window. A cycle needs a window of at
+        least 2 P days.
+
+        Args:
+            day (int): simulation day
+            totals (np.ndarray): network total of each compartment on that day
+            network (Network): network object, whose state is kept for extrapolate
+
+        Returns:
+            bool: True once an equilibrium or cycle is detected, see day and period
+        """
+        self.totals.append(np.asarray(totals, dtype=float))
+        if self.action == 'extrapolate':
+            self.states.append(network.get_compartment_array())
+        if len(self.totals) < self.window_days:
+            return False
+
+        history = np.array(self.totals)
+        window = history[-self.window_days:]
+        if (window.max(axis=0) - window.min(axis=0)).max() <= self.threshold:
+            self.day, self.period = day, 1
+        else:
+            for period in range(2, min(self.max_period_days, len(history) - self.window_days) + 1):
+                previous = history[-self.window_days - period:-period]
+                if np.abs(window - previous).max() > self.threshold:
+                    continue
+                # a slow trend stays within the tolerance from one period to the next, so the last
+                # period must also match the first whole period of the window, without net drift
+                lag = (self.window_days // period - 1) * period
+                if lag >= period and np.abs(window[-period:] - window[-period - lag:-lag]).max() <= self.threshold:
+                    self.day, self.period = day, period
+                    break
+        if self.day is None:
+            return False
+
+        logger.info(f'detected a {"steady state" if self.period == 1 else f"cycle of {self.period} days"} '
+                    f'on day {self.day}, action={self.action}')
+        return True
+
+
+    def record(self, compartment_labels:list) -> dict:
+        """
+        Description of the detected state for the output: the day, kind, period and the network
+        totals of each compartment on that day
+        """
+        return {'day': self.day, 'kind': 'steady' if self.period == 1 else 'cycle', 'period_days': self.period,
+                'window_days': self.window_days, 'tolerance': self.tolerance, 'action': self.action,
+                **{str(label): float(total) for label, total in zip(compartment_labels, self.totals[-1])}}
+
+
+    def extrapolate(self, day:int, network:Type[Network]):
+        """
+        Set the network to its state on a day after the detection, by repeating the last cycle
+        """
+        offset = (day - self.day - 1) % self.period
+        network.set_compartment_array(self.states[len(self.states) - self.period + offset])
+        return
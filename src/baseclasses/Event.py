@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 from enum import Enum
+from itertools import count
 import logging
 from typing import Type
 
@@ -7,6 +8,9 @@ from .Group import Group
 
 logger = logging.getLogger(__name__)
 
+# creation order of events, which breaks ties between events at the same time
+_sequence = count()
+
 
 class EventType(Enum):
     EtoA=0    # exposed to asymptomatic
@@ -30,6 +34,7 @@ class Event:
         self.event_type = event_type
         self.origin = origin
         self.destination = destination
+        self.sequence = next(_sequence)
         return
 
 
@@ -41,8 +46,20 @@ class Event:
     def compare_event_time(self, other) -> bool:
         """
         Given an Event object (other), return True if self is greater than (happens after)
-        other
+        other, in the order of the node event queue
         """
-        return (True if self.time > other.time else False)
+        return self > other
+
 
+    def __lt__(self, other) -> bool:
+        """
+        Order of the node event queue: by time, then first created first, see Node.pop_event
+        """
+        return (self.time, self.sequence) < (other.time, other.sequence)
 
+
+    def __gt__(self, other) -> bool:
+        """
+        Reverse of __lt__, so a < b and b > a always agree
+        """
+        return (self.time, self.sequence) > (other.time, other.sequence)
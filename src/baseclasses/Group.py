@@ -28,6 +28,10 @@ def _make_enum_from_labels(labels):
         raise ValueError(f"Invalid labels (not identifiers): {bad}")
     return Enum("Compartments", {lbl: i for i, lbl in enumerate(labels)})
 
+def stage_label(label:str, stage:int) -> str:
+    # Sub-stage `stage` (from 1) of a compartment with an Erlang distributed duration: E, E_2, E_3, ...
+    return label if stage == 1 else f'{label}_{stage}'
+
 def set_compartments(labels):
     # Called once at startup to choose the active Compartments enum
     global _active_compartments
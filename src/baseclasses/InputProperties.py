@@ -50,10 +50,40 @@ class InputProperties:
         # legacy convenience: total number of realizations/simulations to do
         self.number_of_realizations = len(self.realization_indices)
 
+        # optional base seed; every realization draws from its own child of this seed so
+        # a run can be reproduced, otherwise a fresh seed is drawn
+        self.random_seed = int(input['random_seed']) if 'random_seed' in input else None
+
         # data files
+        # data.states composes several data/<State>/ folders into one network, in place of the
+        # population, high_risk_ratios and flow files, e.g.
+        # {"directory": "../data", "states": ["Texas", "Oklahoma"], "quarter": "4"}
+        self.states = input['data'].get('states', None)
+        if self.states is not None:
+            self.states = { 'directory' : self.states.get('directory', 'data'),
+                            'states'    : list(self.states['states']),
+                            'quarter'   : int(self.states.get('quarter', 4)),
+                            'coupling'  : list(self.states.get('coupling', [])) }
+            input['data'].setdefault('population', None)
+            input['data'].setdefault('high_risk_ratios', None)
+            input['data'].setdefault('flow', [])
         self.population_data_file         = input['data']['population']
         self.contact_data_file            = input['data']['contact']
-        self.flow_data_file               = input['data']['flow']
+        # flow is either one file for the whole run, a schedule of files by start day,
+        # e.g. [{"start_day": "0", "file": "Q1.csv"}, {"start_day": "90", "file": "Q2.csv"}],
+        # or a gravity/radiation model, e.g. {"model": "gravity", "coordinates": "centroids.csv"}
+        self.flow_model = input['data']['flow'] if isinstance(input['data']['flow'], dict) else None
+        if self.flow_model is not None:
+            if 'coordinates' not in self.flow_model:
+                raise ValueError('data.flow model requires a "coordinates" file.')
+            self.flow_schedule  = []
+            self.flow_data_file = None
+        elif self.states is not None:
+            self.flow_schedule  = []
+            self.flow_data_file = None
+        else:
+            self.flow_schedule  = self._parse_flow_schedule(input['data']['flow'])
+            self.flow_data_file = self.flow_schedule[0][1]
         self.high_risk_ratios_file        = input['data']['high_risk_ratios']
         
         # disease model
@@ -74,6 +104,9 @@ class InputProperties:
         #self.antiviral_model = input['antiviral_model']['identity']
         #self.antiviral_parameters = input['antiviral_model']['parameters']
         
+        # endemic equilibrium detection (optional), see Equilibrium
+        self.equilibrium = input.get('equilibrium', None)
+
         # vaccines (optional)
         vaccine_input = input.get('vaccine_model', {})  # returns {} if not present
         self.vaccine_model = vaccine_input.get('identity', None)
@@ -93,10 +126,13 @@ class InputProperties:
                 f'## SIMULATION CONTROL ##\n'
                 f'output_dir_path={self.output_dir_path}\n'
                 f'number_of_realizations={self.number_of_realizations}\n'
+                f'random_seed={self.random_seed}\n'
                 f'\n## DATA FILES ##\n'
                 f'population_data_file={self.population_data_file}\n'
                 f'contact_data_file={self.contact_data_file}\n'
-                f'flow_data_file={self.flow_data_file}\n'
+                f'flow_schedule={self.flow_schedule}\n'
+                f'flow_model={self.flow_model}\n'
+                f'states={self.states}\n'
                 f'high_risk_ratios_file={self.high_risk_ratios_file}\n'
                 f'\n## DISEASE MODEL ##\n'
                 f'disease_model={self.disease_model}\n'
@@ -125,10 +161,15 @@ class InputProperties:
             return False
         
         # verify that all input data files exist
-        for data_file in [self.population_data_file,
+        if self.states is not None:
+            data_files = [self.contact_data_file, *self.state_network().files()]
+        else:
+            data_files = [self.population_data_file,
                           self.contact_data_file,
-                          self.flow_data_file,
-                          self.high_risk_ratios_file]:
+                          *[flow_file for _, flow_file in self.flow_schedule],
+                          *([self.flow_model['coordinates']] if self.flow_model else []),
+                          self.high_risk_ratios_file]
+        for data_file in data_files:
             try:
                 with open(data_file, 'r') as f:
                     pass
@@ -139,4 +180,29 @@ class InputProperties:
         return True
 
 
-
+    def state_network(self):
+        """
+        Return the StateNetwork loader described by data.states
+        """
+        from .StateNetwork import StateNetwork
+        try:
+            return StateNetwork(self.states['directory'], self.states['states'],
+                                quarter=self.states['quarter'], coupling_files=self.states['coupling'])
+        except FileNotFoundError as e:
+            raise Exception(f'Could not find the files of data.states: {e}') from e
+
+
+    def _parse_flow_schedule(self, flow) -> List[tuple]:
+        """
+        Convert the data.flow input into a list of (start_day, filename) tuples sorted by day
+        """
+        if isinstance(flow, str):
+            return [(0, flow)]
+        if not isinstance(flow, list) or len(flow) == 0:
+            raise ValueError('data.flow must be a filename or a non-empty list of {"start_day", "file"} entries.')
+
+        schedule = sorted(((int(entry['start_day']), entry['file']) for entry in flow), key=lambda x: x[0])
+        start_days = [day for day, _ in schedule]
+        if len(set(start_days)) != len(start_days):
+            raise ValueError(f'data.flow start_day values must be unique, got {start_days}.')
+        return schedule
@@ -57,9 +57,13 @@ class ModelParameters:
         Read in simulation data that is stored in files, not including
         the population data file and the travel flow matrix.
         """
-        logger.info(f'opening file: {simulation_properties.high_risk_ratios_file}')
-        with open(simulation_properties.high_risk_ratios_file, 'r') as f:
-            self.high_risk_ratios = [ line.rstrip() for line in f ]
+        if simulation_properties.states is not None:
+            # county high risk ratios of every state, in node order
+            self.high_risk_ratios = simulation_properties.state_network().high_risk_ratio_lines()
+        else:
+            logger.info(f'opening file: {simulation_properties.high_risk_ratios_file}')
+            with open(simulation_properties.high_risk_ratios_file, 'r') as f:
+                self.high_risk_ratios = [ line.rstrip() for line in f ]
 
 
         logger.info(f'opening file: {simulation_properties.contact_data_file}')
@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 import logging
+import numpy as np
 import pandas as pd
+from scipy import sparse
 import sys
 from typing import Type
 from . import Group
 from .Group import RiskGroup, VaccineGroup, Compartments
 from .Node import Node
 from .PopulationCompartments import PopulationCompartments
-from .TravelFlow import TravelFlow
+from .TravelFlow import TravelFlow, TravelFlowSchedule, TravelKernels, SyntheticTravelFlow, LazyTravelKernels
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +19,9 @@ class Network:
     def __init__(self, compartment_labels:list):
         self.nodes = []
         self.travel_flow_data = None
+        self.travel_kernels = None
+        self.travel_flow_schedule = None
+        self.travel_flow_index = None
         self.total_population = 0
         self.df_county_age_matrix = []
 
@@ -26,8 +31,21 @@ class Network:
 
         # Get Compartments enumeration for simulator to check totals
         self.comp_index = {c.name: c.value for c in Compartments}
+        # indices of each compartment and its sub-stages, e.g. E, E_2, E_3 (see Group.stage_label)
+        self.comp_stages = {}
+        for label, index in self.comp_index.items():
+            stages, stage = [index], 2
+            while Group.stage_label(label, stage) in self.comp_index:
+                stages.append(self.comp_index[Group.stage_label(label, stage)])
+                stage += 1
+            self.comp_stages[label] = stages
 
         self.num_disease_compartments = len(self.compartment_labels)
+
+        # Activity index by [node]: a node is active while anyone is in a compartment people
+        # leave without infection pressure, see reset_activity(). None steps every node.
+        self.active = None
+        self.activity_compartments = None
         # Will be 0 nodes so may be a more useful logger statement here
         logger.info(f'instantiated Network object with {self.get_number_of_nodes()} nodes')
         return
@@ -54,6 +72,16 @@ class Network:
         logger.debug(f'{self.df_county_age_matrix}')
         return
 
+
+    def load_population_frame(self, df_county_age_matrix:pd.DataFrame):
+        """
+        Use an already loaded population table, laid out like the population file, e.g. the
+        stacked tables of several states from StateNetwork.population_frame()
+        """
+        self.df_county_age_matrix = df_county_age_matrix
+        logger.info(f'loaded population data for {len(df_county_age_matrix)} nodes into Network')
+        return
+
             
     def population_to_nodes(self, high_risk_ratios:list):
         """
@@ -107,17 +135,68 @@ class Network:
         return
 
 
-    def add_travel_flow_data(self, travel_flow_data:Type[TravelFlow]):
+    def add_travel_flow_data(self, travel_flow_data:Type[TravelFlow], travel_kernels:Type[TravelKernels]=None):
         """
-        Copy travel flow data onto Network object
+        Copy travel flow data onto Network object, stored as a CSR sparse matrix, and precompute
+        the population-normalized travel kernels unless they are given
         """
-        self.travel_flow_data = travel_flow_data
+        self.travel_flow_data = sparse.csr_matrix(travel_flow_data, dtype=float)
+        self.travel_kernels = travel_kernels
+        if self.travel_kernels is None and self.nodes:
+            self.travel_kernels = TravelKernels(self.travel_flow_data, self.get_population_array())
         logger.info(f'added travel flow data to Network object')
-        logger.debug(f'{self.travel_flow_data.shape}')
+        logger.debug(f'{self.travel_flow_data.shape}, stored entries={self.travel_flow_data.nnz}')
         logger.debug(f'{self.travel_flow_data}')
         return
 
 
+    def add_travel_flow_provider(self, provider:Type[SyntheticTravelFlow]):
+        """
+        Attach flows computed on demand, e.g. by a gravity or radiation model, instead of a matrix.
+        No NxN matrix is stored; the travel model asks for the rows and columns it needs.
+        """
+        self.travel_flow_data = None
+        self.travel_kernels = LazyTravelKernels(provider, self.get_population_array())
+        logger.info(f'added {provider.model} travel flow provider to Network object')
+        return
+
+
+    def add_travel_flow_schedule(self, travel_flow_schedule:Type[TravelFlowSchedule], day:int=0):
+        """
+        Attach a time-varying schedule of travel flow matrices and activate the one for the given day
+        """
+        self.travel_flow_schedule = travel_flow_schedule
+        self.travel_flow_index = None
+        self.update_travel_flow(day)
+        return
+
+
+    def update_travel_flow(self, day:int) -> bool:
+        """
+        Swap in the travel flow matrix scheduled for the given day. Returns True if the active
+        matrix changed, False if there is no schedule or the matrix is unchanged.
+        """
+        if self.travel_flow_schedule is None:
+            return False
+        index = self.travel_flow_schedule.index_for_day(day)
+        if index == self.travel_flow_index:
+            return False
+        kernels = self.travel_flow_schedule.kernels_for_day(day, self.get_population_array()) if self.nodes else None
+        self.add_travel_flow_data(self.travel_flow_schedule.flow_for_day(day), kernels)
+        self.travel_flow_index = index
+        return True
+
+
+    def get_travel_kernels(self) -> TravelKernels:
+        """
+        Return the travel kernels of the active flow matrix, building them if nodes were added
+        after the flow data
+        """
+        if self.travel_kernels is None:
+            self.travel_kernels = TravelKernels(self.travel_flow_data, self.get_population_array())
+        return self.travel_kernels
+
+
     def get_number_of_nodes(self) -> int:
         """
         Return number of Nodes
@@ -137,6 +216,89 @@ class Network:
         return self.total_population
 
 
+    def get_compartment_array(self, node_indices:np.ndarray=None) -> np.ndarray:
+        """
+        Return a stacked copy of every Node's compartment data, or of the nodes at
+        node_indices, ordered like self.nodes, with shape [node][age][risk][vaccine][compartment]
+        """
+        nodes = self.nodes if node_indices is None else [self.nodes[i] for i in node_indices]
+        return np.stack([node.compartments.compartment_data for node in nodes])
+
+
+    def set_compartment_array(self, compartment_array:np.ndarray, node_indices:np.ndarray=None):
+        """
+        Copy a stacked [node][age][risk][vaccine][compartment] array, as returned by
+        get_compartment_array, back into the compartment data of every Node, or of the
+        nodes at node_indices, one per row
+        """
+        nodes = self.nodes if node_indices is None else [self.nodes[i] for i in node_indices]
+        for node, node_data in zip(nodes, compartment_array):
+            node.compartments.compartment_data[...] = node_data
+        return
+
+
+    def get_population_array(self, node_indices:np.ndarray=None) -> np.ndarray:
+        """
+        Return a length-[node] vector with the total population of each Node, or of the
+        nodes at node_indices
+        """
+        nodes = self.nodes if node_indices is None else [self.nodes[i] for i in node_indices]
+        return np.array([node.total_population() for node in nodes], dtype=float)
+
+
+    def reset_activity(self, activity_compartments:list):
+        """
+        Rebuild the activity index from scratch, e.g. at the start of a realization. A node is
+        active while anyone is in one of activity_compartments; the others are quiescent, their
+        disease step changes nothing, until travel exposes someone there.
+
+        Args:
+            activity_compartments (list): indices of the compartments that keep a node active
+        """
+        self.activity_compartments = np.asarray(activity_compartments, dtype=int)
+        self.active = np.zeros(self.get_number_of_nodes(), dtype=bool)
+        self.update_activity()
+        logger.debug(f'reset activity index: {int(self.active.sum())} of {self.get_number_of_nodes()} nodes active')
+        return
+
+
+    def update_activity(self, node_indices:np.ndarray=None, compartment_array:np.ndarray=None):
+        """
+        Refresh the activity of every node, or of the nodes at node_indices, after their disease
+        step. compartment_array, one row per node, saves reading the nodes again.
+        """
+        if self.active is None:
+            return
+        if node_indices is None:
+            node_indices = np.arange(self.get_number_of_nodes())
+        if len(node_indices) == 0:
+            return
+        if compartment_array is None:
+            compartment_array = self.get_compartment_array(node_indices)
+        in_activity_compartments = compartment_array[..., self.activity_compartments]
+        self.active[node_indices] = in_activity_compartments.reshape(len(node_indices), -1).any(axis=1)
+        return
+
+
+    def mark_active(self, node_indices:np.ndarray):
+        """
+        Wake the nodes at node_indices, e.g. after travel exposed people there
+        """
+        if self.active is not None:
+            self.active[node_indices] = True
+        return
+
+
+    def get_active_node_indices(self) -> np.ndarray:
+        """
+        Return the indices of the nodes the disease step has to advance, all of them if there
+        is no activity index
+        """
+        if self.active is None:
+            return np.arange(self.get_number_of_nodes())
+        return np.flatnonzero(self.active)
+
+
     def get_number_of_age_groups(self) -> int:
         """
         Return number of age groups
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import heapq
 import json
 import logging
 import numpy as np
@@ -21,7 +22,8 @@ class Node:
         self.vaccine_stockpile = 0.
         self.antiviral_stockpile = 0.
         self.stochastic = True
-        self.events = []    # list of event objects
+        self.events = []    # event objects, a heap ordered by time, see pop_event
+        self.travel_exposure = np.zeros(self.compartments.number_of_age_groups)  # exposed by travel today, by age
         
         # the contact counter struct is a 3-dimensional array of ints
         # the fields are [number of age groups][risk group size][vaccinated group size]
@@ -65,9 +67,9 @@ class Node:
             group_origin (Group): group originating the event
             group_destination (Group): group destination for the event
         """
-        self.events.insert(0, Event(init_time, time, event_type, group_origin, group_destination))
+        heapq.heappush(self.events, Event(init_time, time, event_type, group_origin, group_destination))
         self.contact_counter[group_origin.age][group_origin.risk][group_origin.vaccine] += 1
-        logger.debug(f'added EventType={event_type} to queue; length={len(self.events)}')
+        logger.debug('added EventType=%s to queue; length=%s', event_type, len(self.events))
         return
 
 
@@ -82,11 +84,26 @@ class Node:
             event_type (EventType): type of event from a list of possible events
             group (Group): group where event happened
         """
-        self.events.insert(0, Event(init_time, time, event_type, group, group))
-        logger.debug(f'added EventType={event_type} to queue; length={len(self.events)}')
+        heapq.heappush(self.events, Event(init_time, time, event_type, group, group))
+        logger.debug('added EventType=%s to queue; length=%s', event_type, len(self.events))
         return
 
 
+    def next_event_time(self) -> float:
+        """
+        Time of the earliest event in the queue, inf if the queue is empty
+        """
+        return self.events[0].time if self.events else float('inf')
+
+
+    def pop_event(self) -> Type[Event]:
+        """
+        Remove and return the earliest event in the queue; events at the same time come out in
+        the order they were added
+        """
+        return heapq.heappop(self.events)
+
+
     def return_dict(self) -> dict:
         """
         Return dictionary representation of node object for easier printing
@@ -96,8 +113,7 @@ class Node:
         data['node_id']    = str(self.node_id)
         data['fips_id']    = str(self.fips_id)
 
-        # TODO collect travel exposure data for the output
-        data['travel_exposure']             = []
+        data['travel_exposure']             = [float(x) for x in self.travel_exposure]
         data['compartment_summary']         = {}
         data['compartment_summary_percent'] = {}
         data['compartment_subgroups']       = {}
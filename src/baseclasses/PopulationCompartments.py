@@ -57,10 +57,7 @@ class PopulationCompartments:
             risk (int): risk group key
             vac (int): vacccine status key
         """
-        age_list = []
-        for i in range(self.number_of_age_groups):
-            age_list.append(self.compartment_data[i][risk][vac][comp])
-        return age_list
+        return self.compartment_data[:, risk, vac, comp].tolist()
 
 
     def expose_number_of_people_bulk(self, group:Type[Group], num_to_expose:float):
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+import glob
+import logging
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from .TravelFlow import TravelFlow
+
+logger = logging.getLogger(__name__)
+
+
+class StateNetwork:
+
+    def __init__(self, data_dir:str, states:list, quarter:int=4, coupling_files:list=None):
+        """
+        Compose several self-contained data/<State>/ folders into one network. Nodes are ordered
+        state by state, in the order given, and within a state as in its population file.
+
+        Args:
+            data_dir (str): directory holding one folder per state, e.g. ../data
+            states (list): state folder names, e.g. ["Texas", "Oklahoma", "Louisiana"]
+            quarter (int): 2019 quarter (1-4) of the mobility matrices and long-format flows
+            coupling_files (list): extra long-format mobility files, e.g. a national file, read
+                                   together with each state's *_quarterly-2019_mobility.csv
+        """
+        if not states:
+            raise ValueError('data.states must list at least one state')
+        if len(set(states)) != len(states):
+            raise ValueError(f'data.states has duplicate states: {states}')
+        self.data_dir = data_dir
+        self.states = list(states)
+        self.quarter = int(quarter)
+        if self.quarter not in (1, 2, 3, 4):
+            raise ValueError(f'quarter must be 1-4, got {quarter}')
+
+        self.population_files      = [self._find(state, f'county_pop_by_age_{state}_*.csv') for state in self.states]
+        self.high_risk_ratio_files = [self._find(state, f'county_{state}_high-risk-ratios*.csv') for state in self.states]
+        self.flow_files            = [self._find(state, f'{state}_Q{self.quarter}-*_mobility-matrix.csv')
+                                      for state in self.states]
+        self.coupling_files = [path for state in self.states
+                               for path in glob.glob(os.path.join(self.data_dir, state, f'{state}_quarterly-*_mobility.csv'))]
+        self.coupling_files += list(coupling_files or [])
+
+        self._population = None
+        logger.info(f'instantiated StateNetwork for {self.states}, quarter {self.quarter}')
+        return
+
+
+    def files(self) -> list:
+        """
+        Return every input file, for validation
+        """
+        return [*self.population_files, *self.high_risk_ratio_files, *self.flow_files, *self.coupling_files]
+
+
+    def population_frame(self) -> pd.DataFrame:
+        """
+        Return the population files of all states stacked into one table, fips first
+        """
+        if self._population is None:
+            frames = [pd.read_csv(path) for path in self.population_files]
+            columns = list(frames[0].columns[1:])
+            for state, frame in zip(self.states, frames):
+                if list(frame.columns[1:]) != columns:
+                    raise ValueError(f'age groups of {state} {list(frame.columns[1:])} do not match {columns}')
+            self._population = pd.concat(frames, ignore_index=True)
+            fips = self._population.iloc[:, 0]
+            if fips.duplicated().any():
+                raise ValueError(f'duplicate fips across states: {fips[fips.duplicated()].tolist()[:10]}')
+            self.node_state = np.repeat(np.arange(len(frames)), [len(frame) for frame in frames])
+        return self._population
+
+
+    def high_risk_ratio_lines(self) -> list:
+        """
+        Return the county high risk ratio files of all states in the multidimensional format read
+        by Network.population_to_nodes: a header line, then one line per node in node order
+        """
+        population = self.population_frame()
+        frames = [pd.read_csv(path) for path in self.high_risk_ratio_files]
+        ratios = pd.concat(frames, ignore_index=True).set_index(frames[0].columns[0])
+        fips = population.iloc[:, 0]
+        missing = [f for f in fips if f not in ratios.index]
+        if missing:
+            raise ValueError(f'no high risk ratios for fips {missing[:10]}')
+        ratios = ratios.loc[fips]
+        lines = [','.join(['fips', *[str(c) for c in ratios.columns]])]
+        lines += [','.join([str(f), *[repr(float(x)) for x in row]]) for f, row in zip(fips, ratios.to_numpy())]
+        return lines
+
+
+    def flow_matrix(self, **pruning) -> sparse.csr_matrix:
+        """
+        Return the NxN flow of all states: block diagonal within-state mobility matrices, plus
+        the cross-state entries found in the long-format mobility files
+
+        Args:
+            pruning: threshold / top_k / mass_fraction passed to TravelFlow.load_travel_flow_file
+        """
+        population = self.population_frame()
+        blocks = []
+        for state, path, size in zip(self.states, self.flow_files, np.bincount(self.node_state)):
+            travel_flow = TravelFlow(int(size))
+            travel_flow.load_travel_flow_file(path, **pruning)
+            if travel_flow.flow_data.shape != (size, size):
+                raise ValueError(f'{path} has shape {travel_flow.flow_data.shape}, expected {size}x{size} for {state}')
+            blocks.append(travel_flow.flow_data)
+        flow = sparse.block_diag(blocks, format='csr')
+
+        coupling = self.coupling_matrix(population.iloc[:, 0].to_numpy())
+        logger.info(f'composed flow for {len(self.states)} states: {flow.nnz} within-state and '
+                    f'{coupling.nnz} cross-state entries')
+        return (flow + coupling).tocsr()
+
+
+    def coupling_matrix(self, fips:np.ndarray, chunk_size:int=200000) -> sparse.csr_matrix:
+        """
+        Build the cross-state part of the flow from long-format files with columns geoid_o,
+        geoid_d, quarter and mean_max_norm_prop_flow. Rows within one state, or with a county
+        outside the network, are ignored. A pair listed in several files is counted once.
+        """
+        self.population_frame()
+        index = pd.Series(np.arange(len(fips)), index=fips)
+        rows, cols, values = [], [], []
+        for path in self.coupling_files:
+            reader = pd.read_csv(path, usecols=['geoid_o', 'geoid_d', 'quarter', 'mean_max_norm_prop_flow'],
+                                 chunksize=chunk_size)
+            for chunk in reader:
+                chunk = chunk[(chunk['quarter'].astype(int) == self.quarter)
+                              & chunk['geoid_o'].isin(index.index) & chunk['geoid_d'].isin(index.index)]
+                origin = index.loc[chunk['geoid_o']].to_numpy()
+                destination = index.loc[chunk['geoid_d']].to_numpy()
+                cross = self.node_state[origin] != self.node_state[destination]
+                rows.append(origin[cross])
+                cols.append(destination[cross])
+                values.append(chunk['mean_max_norm_prop_flow'].to_numpy(dtype=float)[cross])
+
+        size = len(fips)
+        if not rows or sum(len(r) for r in rows) == 0:
+            if len(self.states) > 1:
+                logger.warning(f'no cross-state flows found in {len(self.coupling_files)} long-format files; '
+                               f'the states are not coupled')
+            return sparse.csr_matrix((size, size))
+        # a pair listed in several files (e.g. both states' files) is counted once
+        entries = pd.DataFrame({'row': np.concatenate(rows), 'col': np.concatenate(cols),
+                                'value': np.concatenate(values)}).drop_duplicates(['row', 'col'])
+        return sparse.csr_matrix((entries['value'], (entries['row'], entries['col'])), shape=(size, size))
+
+
+    def _find(self, state:str, pattern:str) -> str:
+        matches = sorted(glob.glob(os.path.join(self.data_dir, state, pattern)))
+        if not matches:
+            raise FileNotFoundError(f'no file matching {pattern} in {os.path.join(self.data_dir, state)}')
+        return matches[0]
@@ -1,6 +1,11 @@
 #!/usr/bin/env python3
+import hashlib
 import logging
+import os
+from collections import OrderedDict
 import numpy as np
+import pandas as pd
+from scipy import sparse
 import sys
 
 logger = logging.getLogger(__name__)
@@ -9,21 +14,534 @@ logger = logging.getLogger(__name__)
 class TravelFlow:
 
     def __init__(self, number_of_nodes:int):
-        self.flow_data = np.zeros((number_of_nodes, number_of_nodes))
+        self.flow_data = sparse.csr_matrix((number_of_nodes, number_of_nodes))
+        self.total_mass = 0.0        # sum of off-diagonal flow before pruning
+        self.discarded_mass = 0.0    # sum of off-diagonal flow removed by pruning
         logger.info(f'instantiated TravelFlow object for {number_of_nodes} nodes')
         logger.debug(f'{self.flow_data.shape}')
         return
 
 
-    def load_travel_flow_file(self, filename:str):
+    def load_travel_flow_file(self, filename:str, threshold:float=None, top_k:int=None,
+                              mass_fraction:float=None, chunk_size:int=1000):
         """
-        The file work_matrix_rel.csv contains 254 rows and 254 columns, each 
+        The file work_matrix_rel.csv contains 254 rows and 254 columns, each
         representing a county from the population file data
         Beware some numbers are in scientific format, e.g. 1.48929938393e-05
+
+        The matrix is read in row chunks and stored in compressed sparse row (CSR) format
+        so a dense NxN copy is never held in memory. Optional pruning is applied to the
+        off-diagonal entries of each chunk, see prune_flow().
+
+        Args:
+            filename (str): path to a headerless NxN csv of flow fractions
+            threshold (float): drop off-diagonal entries smaller than this value
+            top_k (int): keep only the k largest off-diagonal entries of each row
+            mass_fraction (float): keep the largest off-diagonal entries of each row that
+                                   together hold at least this share of the row's flow
+            chunk_size (int): number of rows parsed at a time
         """
+        blocks = []
         try:
-            self.flow_data = np.genfromtxt(filename, delimiter=',')
+            reader = pd.read_csv(filename, header=None, dtype=float, chunksize=chunk_size)
+            first_row = 0
+            for chunk in reader:
+                block = sparse.csr_matrix(np.nan_to_num(chunk.to_numpy()))
+                block, total, discarded = prune_flow(block, first_row, threshold, top_k, mass_fraction)
+                self.total_mass += total
+                self.discarded_mass += discarded
+                blocks.append(block)
+                first_row += block.shape[0]
         except FileNotFoundError as e:
             raise Exception(f'Could not open {filename}') from e
             sys.exit(1)
+
+        self.flow_data = sparse.vstack(blocks, format='csr')
+        self.flow_data.eliminate_zeros()
+
+        logger.info(f'loaded travel flow data from {filename}: shape={self.flow_data.shape}, '
+                    f'stored entries={self.flow_data.nnz}')
+        if threshold is not None or top_k is not None or mass_fraction is not None:
+            percent = 100.0 * self.discarded_mass / self.total_mass if self.total_mass > 0 else 0.0
+            logger.info(f'pruning (threshold={threshold}, top_k={top_k}, mass_fraction={mass_fraction}) '
+                        f'discarded {self.discarded_mass:.6g} of {self.total_mass:.6g} off-diagonal '
+                        f'flow mass ({percent:.3f}%)')
         return
+
+
+class TravelKernels:
+
+    def __init__(self, flow_data:sparse.csr_matrix, population:np.ndarray):
+        """
+        Static, population-normalized travel kernels of one flow matrix, built once when the flow
+        is attached to the Network and shared by every realization. With pop the node populations
+        and F the flow matrix without its diagonal (people do not travel from a node to itself):
+
+            inward[i][j]  = F[i][j] / pop[j]   residents of sink i visiting source j
+            outward[i][j] = F[j][i] / pop[i]   residents of source j visiting sink i
+
+        Both are indexed [sink][source]. Only F is stored, once by row and once by column, with
+        the inverse populations; the columns of inward and outward for the active sources, and
+        their products with a vector, are computed from it on demand. This keeps two copies of
+        the flow in memory rather than four.
+
+        Args:
+            flow_data (csr_matrix): NxN travel flow matrix
+            population (np.ndarray): length-N vector of node populations
+        """
+        flow_data = sparse.csr_matrix(flow_data, dtype=float)
+        off_diagonal = (flow_data - sparse.diags(flow_data.diagonal())).tocsr()
+        off_diagonal.eliminate_zeros()
+        inverse_population = np.divide(1.0, population, out=np.zeros(len(population)), where=population > 0)
+
+        self.flow_by_row    = off_diagonal
+        self.flow_by_column = off_diagonal.tocsc()
+        self.inverse_population = inverse_population
+        logger.debug(f'built travel kernels with {off_diagonal.nnz} off-diagonal entries')
+        return
+
+
+    def __deepcopy__(self, memo):
+        # The kernels are read-only and shared by every realization
+        return self
+
+
+    @property
+    def inward(self) -> sparse.csc_matrix:
+        """
+        The whole inward kernel, built on each call and not kept
+        """
+        return (self.flow_by_row @ sparse.diags(self.inverse_population)).tocsc()
+
+
+    @property
+    def outward(self) -> sparse.csc_matrix:
+        """
+        The whole outward kernel, built on each call and not kept
+        """
+        return (sparse.diags(self.inverse_population) @ self.flow_by_row.T).tocsc()
+
+
+    def inward_columns(self, sources:np.ndarray) -> sparse.csc_matrix:
+        """
+        Return inward[:, sources], the sink x source kernel of sink residents visiting the sources
+        """
+        return (self.flow_by_column[:, sources] @ sparse.diags(self.inverse_population[sources])).tocsc()
+
+
+    def outward_columns(self, sources:np.ndarray) -> sparse.csc_matrix:
+        """
+        Return outward[:, sources], the sink x source kernel of source residents visiting the sinks
+        """
+        return (sparse.diags(self.inverse_population) @ self.flow_by_row[sources].T).tocsc()
+
+
+    def inward_product(self, terms:np.ndarray) -> np.ndarray:
+        """
+        Return inward @ terms for terms by [source][...], without building inward
+        """
+        return self.flow_by_row @ (self.inverse_population[:, None] * terms)
+
+
+    def outward_product(self, terms:np.ndarray) -> np.ndarray:
+        """
+        Return outward @ terms for terms by [source][...], without building outward
+        """
+        return self.inverse_population[:, None] * (self.flow_by_column.T @ terms)
+
+
+class SyntheticTravelFlow:
+
+    def __init__(self, population:np.ndarray, coordinates:np.ndarray, model:str='gravity',
+                 travel_fraction:float=0.1, distance_exponent:float=2.0, destination_exponent:float=1.0,
+                 cutoff_km:float=None, min_flow:float=0.0, block_size:int=256, max_blocks:int=32):
+        """
+        Travel flows computed on demand from node populations and centroid coordinates, for
+        geographies without a mobility matrix. A share travel_fraction of each node's residents
+        travels; it is spread over the other nodes by
+
+            gravity:   flow[i][j] proportional to pop[j]^destination_exponent / distance[i][j]^distance_exponent
+            radiation: flow[i][j] proportional to pop[i] pop[j] / ((pop[i] + s) (pop[i] + pop[j] + s)),
+                       s the population closer to i than j is, excluding i and j
+
+        Rows and columns are computed in blocks of block_size nodes and kept in two LRU caches of
+        at most max_blocks blocks each, so memory scales with the nodes being asked about rather
+        than N^2. The diagonal (residents staying home) is not stored.
+
+        Args:
+            population (np.ndarray): length-N vector of node populations
+            coordinates (np.ndarray): Nx2 array of centroid (latitude, longitude) in degrees
+            model (str): 'gravity' or 'radiation'
+            travel_fraction (float): share of each node's residents who travel
+            distance_exponent (float): gravity model distance decay
+            destination_exponent (float): gravity model destination population exponent
+            cutoff_km (float): no travel between nodes further apart than this
+            min_flow (float): drop flows smaller than this value
+            block_size (int): number of rows / columns computed at a time
+            max_blocks (int): number of row blocks and column blocks kept in memory
+        """
+        self.model = str(model).lower()
+        if self.model not in ('gravity', 'radiation'):
+            raise ValueError(f'flow model "{model}" not recognized, use "gravity" or "radiation"')
+        self.population  = np.asarray(population, dtype=float)
+        self.coordinates = np.radians(np.asarray(coordinates, dtype=float))
+        if self.coordinates.shape != (len(self.population), 2):
+            raise ValueError(f'expected {len(self.population)}x2 coordinates, got {self.coordinates.shape}')
+        self.number_of_nodes      = len(self.population)
+        self.travel_fraction      = float(travel_fraction)
+        self.distance_exponent    = float(distance_exponent)
+        self.destination_exponent = float(destination_exponent)
+        self.cutoff_km            = cutoff_km
+        self.min_flow             = float(min_flow)
+        self.block_size           = int(block_size)
+        self.max_blocks           = int(max_blocks)
+
+        self._row_blocks = OrderedDict()
+        self._column_blocks = OrderedDict()
+        self._row_totals = None   # gravity normalization of every row, needed for columns
+
+        logger.info(f'instantiated SyntheticTravelFlow ({self.model}) for {self.number_of_nodes} nodes')
+        return
+
+
+    def __deepcopy__(self, memo):
+        # The caches are shared by every realization
+        return self
+
+
+    def rows(self, indices:np.ndarray) -> sparse.csr_matrix:
+        """
+        Return flow[indices, :] as a CSR matrix
+        """
+        blocks = self._gather(self._row_blocks, self._row_block, indices)
+        return sparse.vstack([blocks[i // self.block_size][i % self.block_size] for i in indices],
+                             format='csr') if len(indices) else sparse.csr_matrix((0, self.number_of_nodes))
+
+
+    def columns(self, indices:np.ndarray) -> sparse.csc_matrix:
+        """
+        Return flow[:, indices] as a CSC matrix
+        """
+        blocks = self._gather(self._column_blocks, self._column_block, indices)
+        return sparse.hstack([blocks[j // self.block_size][:, j % self.block_size] for j in indices],
+                             format='csc') if len(indices) else sparse.csc_matrix((self.number_of_nodes, 0))
+
+
+    def to_csr(self) -> sparse.csr_matrix:
+        """
+        Materialize the whole flow matrix, one row block at a time
+        """
+        number_of_blocks = -(-self.number_of_nodes // self.block_size)
+        return sparse.vstack([self._row_block(b) for b in range(number_of_blocks)], format='csr')
+
+
+    def _gather(self, cache:OrderedDict, build, indices:np.ndarray) -> dict:
+        """
+        Return {block number: block} for every block holding one of the indices, computing missing
+        blocks and evicting the least recently used ones beyond max_blocks
+        """
+        found = {}
+        for block in np.unique(np.asarray(indices, dtype=int) // self.block_size):
+            block = int(block)
+            if block in cache:
+                cache.move_to_end(block)
+            else:
+                cache[block] = build(block)
+                if len(cache) > self.max_blocks:
+                    cache.popitem(last=False)
+            found[block] = cache[block]
+        return found
+
+
+    def _distances(self, origins:np.ndarray) -> np.ndarray:
+        """
+        Great-circle distance in km from each origin to every node, shape [origin][node]
+        """
+        lat1, lon1 = self.coordinates[origins, 0][:, None], self.coordinates[origins, 1][:, None]
+        lat2, lon2 = self.coordinates[:, 0][None, :], self.coordinates[:, 1][None, :]
+        a = np.sin((lat2 - lat1) / 2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0)**2
+        return 2.0 * 6371.0 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+    def _dense_rows(self, origins:np.ndarray) -> np.ndarray:
+        """
+        Dense flow[origins, :], before min_flow pruning
+        """
+        distance = self._distances(origins)
+        home = origins[:, None] == np.arange(self.number_of_nodes)[None, :]
+        reachable = ~home
+        if self.cutoff_km is not None:
+            reachable &= distance <= float(self.cutoff_km)
+
+        if self.model == 'gravity':
+            with np.errstate(divide='ignore'):
+                weight = self.population[None, :]**self.destination_exponent \
+                         / np.maximum(distance, 1e-3)**self.distance_exponent
+        else:
+            m = self.population[origins][:, None]
+            n = self.population[None, :]
+            # population strictly closer to the origin than each destination, minus the origin itself
+            order = np.argsort(distance, axis=1, kind='stable')
+            closer = np.cumsum(self.population[order], axis=1) - self.population[order]
+            s = np.empty_like(distance)
+            np.put_along_axis(s, order, closer, axis=1)
+            s = np.maximum(s - m, 0.0)
+            weight = m * n / ((m + s) * (m + n + s))
+        weight = np.where(reachable, weight, 0.0)
+
+        totals = weight.sum(axis=1, keepdims=True)
+        return self.travel_fraction * np.divide(weight, totals, out=np.zeros_like(weight), where=totals > 0)
+
+
+    def _prune(self, block:np.ndarray) -> np.ndarray:
+        if self.min_flow > 0:
+            block = np.where(block >= self.min_flow, block, 0.0)
+        return block
+
+
+    def _row_block(self, block:int) -> sparse.csr_matrix:
+        origins = np.arange(block * self.block_size, min((block + 1) * self.block_size, self.number_of_nodes))
+        logger.debug(f'computing {self.model} flow rows {origins[0]}-{origins[-1]}')
+        return sparse.csr_matrix(self._prune(self._dense_rows(origins)))
+
+
+    def _column_block(self, block:int) -> sparse.csc_matrix:
+        """
+        Columns need every row's normalization, so the rows are swept once in blocks and only the
+        requested columns are kept
+        """
+        destinations = np.arange(block * self.block_size, min((block + 1) * self.block_size, self.number_of_nodes))
+        logger.debug(f'computing {self.model} flow columns {destinations[0]}-{destinations[-1]}')
+        columns = np.zeros((self.number_of_nodes, len(destinations)))
+        for start in range(0, self.number_of_nodes, self.block_size):
+            origins = np.arange(start, min(start + self.block_size, self.number_of_nodes))
+            columns[origins] = self._dense_rows(origins)[:, destinations]
+        return sparse.csc_matrix(self._prune(columns))
+
+
+class LazyTravelKernels:
+
+    def __init__(self, provider:SyntheticTravelFlow, population:np.ndarray):
+        """
+        Same interface as TravelKernels, for flows computed on demand by a SyntheticTravelFlow.
+        Only the columns of the requested sources are computed.
+        """
+        self.provider = provider
+        population = np.asarray(population, dtype=float)
+        self.inverse_population = np.divide(1.0, population, out=np.zeros(len(population)), where=population > 0)
+        self._full = None
+        return
+
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+    def inward_columns(self, sources:np.ndarray) -> sparse.csc_matrix:
+        return (self.provider.columns(sources) @ sparse.diags(self.inverse_population[sources])).tocsc()
+
+
+    def outward_columns(self, sources:np.ndarray) -> sparse.csc_matrix:
+        return (sparse.diags(self.inverse_population) @ self.provider.rows(sources).T).tocsc()
+
+
+    def inward_product(self, terms:np.ndarray) -> np.ndarray:
+        return self.flow_by_row @ (self.inverse_population[:, None] * terms)
+
+
+    def outward_product(self, terms:np.ndarray) -> np.ndarray:
+        return self.inverse_population[:, None] * (self.flow_by_column.T @ terms)
+
+
+    @property
+    def flow_by_row(self) -> sparse.csr_matrix:
+        return self._materialize()[0]
+
+
+    @property
+    def flow_by_column(self) -> sparse.csc_matrix:
+        return self._materialize()[1]
+
+
+    def _materialize(self) -> tuple:
+        """
+        The pairwise loop engine and the commuter model need the whole matrix
+        """
+        if self._full is None:
+            logger.warning(f'materializing the full {self.provider.model} flow matrix '
+                           f'({self.provider.number_of_nodes} nodes)')
+            flow = self.provider.to_csr()
+            self._full = (flow, flow.tocsc())
+        return self._full
+
+
+def load_coordinates(filename:str, node_ids:list) -> np.ndarray:
+    """
+    Read a csv with columns fips, latitude, longitude and return the (latitude, longitude) of
+    each node id, in the given order
+    """
+    try:
+        table = pd.read_csv(filename)
+    except FileNotFoundError as e:
+        raise Exception(f'Could not open {filename}') from e
+    table = table.set_index(table.columns[0])
+    missing = [node_id for node_id in node_ids if node_id not in table.index]
+    if missing:
+        raise ValueError(f'{filename} has no coordinates for nodes {missing[:10]}')
+    return table.loc[list(node_ids), ['latitude', 'longitude']].to_numpy(dtype=float)
+
+
+class TravelFlowSchedule:
+
+    def __init__(self, number_of_nodes:int, schedule:list, cache_dir:str, **pruning):
+        """
+        A sequence of travel flow matrices, each active from its start day until the start day
+        of the next entry (the first entry also covers any earlier days). Every matrix is parsed
+        once into a binary CSR cache under cache_dir, then memory-mapped on demand so only the
+        active matrix is resident. Its TravelKernels hold two in-memory copies of the matrix
+        without its diagonal, by row and by column, which are the bulk of the resident memory.
+
+        Args:
+            number_of_nodes (int): number of Nodes in the Network
+            schedule (list): list of (start_day, filename) tuples, see InputProperties.flow_schedule
+            cache_dir (str): directory for the binary cache
+            pruning: threshold / top_k / mass_fraction passed to TravelFlow.load_travel_flow_file
+        """
+        self.number_of_nodes = number_of_nodes
+        self.schedule = sorted(((int(day), filename) for day, filename in schedule), key=lambda x: x[0])
+        if not self.schedule:
+            raise ValueError('travel flow schedule must contain at least one matrix')
+        self.start_days = [day for day, _ in self.schedule]
+        if len(set(self.start_days)) != len(self.start_days):
+            raise ValueError(f'travel flow schedule has duplicate start days: {self.start_days}')
+
+        self.cache_dir = cache_dir
+        self.pruning = pruning
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.cache_paths = [self._build_cache(filename) for _, filename in self.schedule]
+
+        self._resident_index = None
+        self._resident_flow = None
+        self._kernels = {}
+        logger.info(f'instantiated TravelFlowSchedule with {len(self.schedule)} matrices starting on days '
+                    f'{self.start_days}')
+        return
+
+
+    def __deepcopy__(self, memo):
+        # The cache is read-only and shared by every realization
+        return self
+
+
+    def index_for_day(self, day:int) -> int:
+        """
+        Return the schedule index of the matrix active on the given day
+        """
+        return max(int(np.searchsorted(self.start_days, day, side='right')) - 1, 0)
+
+
+    def flow_for_day(self, day:int) -> sparse.csr_matrix:
+        """
+        Return the CSR flow matrix active on the given day, memory-mapped from the cache.
+        The previously active matrix is released when the schedule switches.
+        """
+        index = self.index_for_day(day)
+        if index != self._resident_index:
+            path = self.cache_paths[index]
+            data    = np.load(os.path.join(path, 'data.npy'), mmap_mode='r')
+            indices = np.load(os.path.join(path, 'indices.npy'), mmap_mode='r')
+            indptr  = np.load(os.path.join(path, 'indptr.npy'), mmap_mode='r')
+            self._resident_flow = sparse.csr_matrix((data, indices, indptr),
+                                                    shape=(self.number_of_nodes, self.number_of_nodes), copy=False)
+            self._resident_index = index
+            logger.info(f'day {day}: travel flow switched to {self.schedule[index][1]}')
+        return self._resident_flow
+
+
+    def kernels_for_day(self, day:int, population:np.ndarray) -> TravelKernels:
+        """
+        Return the TravelKernels of the matrix active on the given day, built on first use.
+        Only the kernels of the active matrix are kept; those of the previous one are released.
+        """
+        index = self.index_for_day(day)
+        if index not in self._kernels:
+            self._kernels = {index: TravelKernels(self.flow_for_day(day), population)}
+        return self._kernels[index]
+
+
+    def _build_cache(self, filename:str) -> str:
+        """
+        Parse a flow csv into data/indices/indptr .npy files, unless an up to date cache exists.
+        The cache key covers the file path, size, modification time, and pruning options.
+        """
+        stat = os.stat(filename)
+        key = f'{os.path.abspath(filename)}|{stat.st_size}|{stat.st_mtime_ns}|{sorted(self.pruning.items())}'
+        digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        path = os.path.join(self.cache_dir, f'{stem}-{digest}')
+
+        if os.path.isfile(os.path.join(path, 'indptr.npy')):
+            logger.info(f'using cached travel flow {path}')
+            return path
+
+        travel_flow = TravelFlow(self.number_of_nodes)
+        travel_flow.load_travel_flow_file(filename, **self.pruning)
+        if travel_flow.flow_data.shape != (self.number_of_nodes, self.number_of_nodes):
+            raise ValueError(f'{filename} has shape {travel_flow.flow_data.shape}, '
+                             f'expected {self.number_of_nodes}x{self.number_of_nodes}')
+        os.makedirs(path, exist_ok=True)
+        # indptr written last so a partially written cache is rebuilt next time
+        np.save(os.path.join(path, 'data.npy'), travel_flow.flow_data.data)
+        np.save(os.path.join(path, 'indices.npy'), travel_flow.flow_data.indices)
+        np.save(os.path.join(path, 'indptr.npy'), travel_flow.flow_data.indptr)
+        logger.info(f'cached travel flow {filename} to {path}')
+        return path
+
+
+def prune_flow(block:sparse.csr_matrix, first_row:int=0, threshold:float=None, top_k:int=None,
+               mass_fraction:float=None) -> tuple:
+    """
+    Prune off-diagonal entries from a block of rows of a CSR flow matrix. The diagonal (people
+    staying in their own node) is always kept. When several rules are given they are applied
+    in order: threshold, then top_k, then mass_fraction.
+
+    Args:
+        block (csr_matrix): rows [first_row, first_row + block.shape[0]) of the flow matrix
+        first_row (int): global index of the first row in the block, used to find the diagonal
+        threshold (float): drop entries smaller than this value
+        top_k (int): keep only the k largest entries of each row
+        mass_fraction (float): keep the fewest largest entries holding this share of each row
+
+    Returns:
+        tuple: (pruned csr_matrix, off-diagonal mass before pruning, off-diagonal mass discarded)
+    """
+    block = sparse.csr_matrix(block, dtype=float, copy=True)
+    block.sort_indices()
+    rows = np.repeat(np.arange(block.shape[0]), np.diff(block.indptr))
+    off_diagonal = block.indices != rows + first_row
+    keep = np.ones(block.nnz, dtype=bool)
+
+    if threshold is not None:
+        keep &= ~off_diagonal | (block.data >= float(threshold))
+
+    if top_k is not None or mass_fraction is not None:
+        for row in range(block.shape[0]):
+            start, end = block.indptr[row], block.indptr[row+1]
+            candidates = np.flatnonzero(off_diagonal[start:end] & keep[start:end]) + start
+            if candidates.size == 0:
+                continue
+            ranked = candidates[np.argsort(block.data[candidates])[::-1]]
+            if top_k is not None:
+                keep[ranked[int(top_k):]] = False
+                ranked = ranked[:int(top_k)]
+            if mass_fraction is not None:
+                row_mass = block.data[start:end][off_diagonal[start:end]].sum()
+                cumulative = np.cumsum(block.data[ranked])
+                num_to_keep = int(np.searchsorted(cumulative, float(mass_fraction) * row_mass)) + 1
+                keep[ranked[num_to_keep:]] = False
+
+    total = float(block.data[off_diagonal].sum())
+    discarded = float(block.data[off_diagonal & ~keep].sum())
+    block.data[~keep] = 0.0
+    block.eliminate_zeros()
+    return block, total, discarded
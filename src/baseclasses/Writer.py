@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 import sys, os, csv, json
+import numpy as np
+import pandas as pd
 from typing import Any, Dict, List, Type
 from .Network import Network
 
@@ -126,3 +128,57 @@ class Writer:
         return
 
 
+    def write_equilibrium(self, record:Dict[str, Any]) -> None:
+        """
+        Append the endemic equilibrium or cycle detected in this realization, see Equilibrium.record
+        """
+        _write_dict_row(os.path.join(self.output_dir, f"equilibrium_batch-{self.batch_num}.csv"),
+                        {"sim_id": self.sim_id, **record})
+        return
+
+
+    def write_travel_attribution(self, day:np.ndarray, source:np.ndarray, sink:np.ndarray,
+                                 pressure:np.ndarray, network:Type[Network]) -> None:
+        """
+        Append a block of source -> sink travel infection pressure to the attribution file. Blocks
+        are appended as consecutive binary .npy records, formatting text for every pair would cost
+        more than the simulation step; see read_travel_attribution() to load them back.
+
+        Args:
+            day (np.ndarray): simulation day of each entry
+            source (np.ndarray): node index of the source of each entry
+            sink (np.ndarray): node index of the sink of each entry
+            pressure (np.ndarray): infection pressure by [entry][age of sink residents]
+            network (Network): Network object with list of nodes, used to look up FIPS codes
+        """
+        fips = np.array([int(node.fips_id) for node in network.nodes], dtype=np.int64)
+        block = np.zeros(len(day), dtype=[('sim_id', np.int32), ('day', np.int32),
+                                          ('source_fips', np.int64), ('sink_fips', np.int64),
+                                          ('pressure', np.float64, (pressure.shape[1],))])
+        block['sim_id']      = self.sim_id
+        block['day']         = day
+        block['source_fips'] = fips[source]
+        block['sink_fips']   = fips[sink]
+        block['pressure']    = pressure
+
+        path = os.path.join(self.output_dir, f'travel_attribution_batch-{self.batch_num}.npy')
+        with open(path, 'ab') as fp:
+            np.save(fp, block)
+        logger.debug(f'wrote {len(block)} travel attribution rows to {path}')
+        return
+
+
+def read_travel_attribution(path:str) -> pd.DataFrame:
+    """
+    Load every block of a travel attribution file written by Writer.write_travel_attribution
+    into one table with columns sim_id, day, source_fips, sink_fips, pressure_age0, ...
+    """
+    blocks = []
+    with open(path, 'rb') as fp:
+        while fp.peek(1):
+            blocks.append(np.load(fp))
+    data = np.concatenate(blocks)
+    table = pd.DataFrame({name: data[name] for name in ('sim_id', 'day', 'source_fips', 'sink_fips')})
+    for age in range(data['pressure'].shape[1]):
+        table[f'pressure_age{age}'] = data['pressure'][:, age]
+    return table
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+import numpy as np
+import logging
+from numpy.random import Generator
+
+logger = logging.getLogger(__name__)
+
+
+def exit_channels(source:np.ndarray) -> list:
+    """
+    Group the channels by the compartment they remove people from
+
+    Args:
+        source (np.ndarray): source compartment of each channel
+
+    Returns:
+        list: (compartment, indices of its channels) for every source compartment, in order
+    """
+    source = np.asarray(source)
+    return [(int(c), np.flatnonzero(source == c)) for c in dict.fromkeys(source.tolist())]
+
+
+def chain_binomial(counts:np.ndarray, rates:np.ndarray, source:np.ndarray, rng:Generator,
+                   dt:float=1.0) -> np.ndarray:
+    """
+    Firings of every channel over a step of dt days, drawn as a chain binomial with exact
+    competing risks: the people of each compartment leave it with probability
+    1 - exp(-total rate * dt) and pick one of its channels in proportion to their rates. That is
+    one multinomial draw per compartment (a binomial when it has a single exit) for all groups
+    and nodes at once, and no compartment can lose more people than it holds.
+
+    Args:
+        counts (np.ndarray): people by [..., compartment], whole numbers
+        rates (np.ndarray): rate per person of each channel by [..., channel]
+        source (np.ndarray): compartment each channel removes people from
+        rng (Generator): random number generator
+        dt (float): length of the step in days
+
+    Returns:
+        np.ndarray: firings by [..., channel]
+    """
+    counts = np.asarray(counts).astype(np.int64)
+    rates = np.maximum(np.asarray(rates, dtype=float), 0.0)
+    firings = np.zeros(rates.shape)
+    for c, channels in exit_channels(source):
+        total_rate = rates[..., channels].sum(axis=-1)
+        leave = -np.expm1(-total_rate * dt)
+        if len(channels) == 1:
+            firings[..., channels[0]] = rng.binomial(counts[..., c], leave)
+            continue
+        share = np.divide(rates[..., channels], total_rate[..., None], out=np.zeros(rates[..., channels].shape),
+                          where=total_rate[..., None] > 0)
+        # the last category of the multinomial is staying in the compartment
+        pvals = np.concatenate([share * leave[..., None], (1.0 - leave)[..., None]], axis=-1)
+        firings[..., channels] = rng.multinomial(counts[..., c], pvals)[..., :-1]
+    return firings
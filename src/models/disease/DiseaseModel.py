@@ -8,7 +8,7 @@ from numpy.random import default_rng, SeedSequence, Generator
 from baseclasses.ModelParameters import ModelParameters
 from baseclasses.Network import Network
 from baseclasses.Node import Node
-from baseclasses.Group import Group, RiskGroup, VaccineGroup
+from baseclasses.Group import Group, RiskGroup, VaccineGroup, Compartments
 from models.treatments.NonPharmaInterventions import NonPharmaInterventions
 from models.treatments.Vaccination import Vaccination
 
@@ -17,6 +17,30 @@ logger = logging.getLogger(__name__)
 
 class DiseaseModel:
 
+    # models that advance a stacked [..., age, risk, vaccine, compartment] array in one pass
+    # implement _advance and set this to True, see simulate_network
+    batched_step = False
+
+    # deterministic models integrating with rk4 / rk45 may take travel into their right-hand
+    # side instead of the daily travel step, see _read_ode_integrator and couple_travel;
+    # travel_in_step is set whenever the disease step applies travel itself, in its right-hand
+    # side or in place of its local force, and the daily travel step is skipped
+    travel_in_rhs = False
+    travel_in_step = False
+    travel_model = None
+    _travel_force = None
+
+    # stochastic models that describe their transitions as channels implement _ssa_channels
+    # and set this to True; the "ssa" and "chain-binomial" integrators need it, see _read_integrator
+    provides_ssa_channels = False
+
+    # kernels derived from beta with NPIs kept before the memo is dropped, see _kernel_memo
+    kernel_memo_size = 4096
+
+    # labels of the compartments holding nobody infected: susceptible, recovered and deceased;
+    # models with other labels override it, see activity_compartments and HybridModel
+    uninfected_compartments = ('S', 'R', 'D')
+
     def __init__(self, parameters:Type[ModelParameters], npis:Type[NonPharmaInterventions], now:float = 0.0):
         self.disease_model = 'parent'
         self.parameters = parameters
@@ -58,6 +82,21 @@ class DiseaseModel:
         elif self.disease_model == 'seihrd-stochastic':
             from .StochasticSEIHRD import StochasticSEIHRD
             return StochasticSEIHRD(self)
+        elif self.disease_model == 'graph-deterministic':
+            from .TransitionGraphModel import TransitionGraphModel
+            return TransitionGraphModel(self, stochastic=False)
+        elif self.disease_model == 'graph-stochastic':
+            from .TransitionGraphModel import TransitionGraphModel
+            return TransitionGraphModel(self, stochastic=True)
+        elif self.disease_model == 'seatird-hybrid':
+            from .HybridModel import HybridModel
+            return HybridModel(self, 'seatird-deterministic', 'seatird-stochastic')
+        elif self.disease_model == 'seirs-hybrid':
+            from .HybridModel import HybridModel
+            return HybridModel(self, 'seirs-deterministic', 'seirs-stochastic')
+        elif self.disease_model == 'graph-hybrid':
+            from .HybridModel import HybridModel
+            return HybridModel(self, 'graph-deterministic', 'graph-stochastic')
         else:
             raise Exception(f'Disease model "{self.disease_model}" not recognized')
         return
@@ -91,6 +130,27 @@ class DiseaseModel:
         
         return
 
+    def expose_network(self, network: Type[Network], node_indices: npt.ArrayLike, exposures: np.ndarray,
+                       vaccine_model: Type[Vaccination]):
+        """
+        Move people from Susceptible to Exposed in bulk across many nodes at once, e.g. after
+        travel. Models that track individual events override this.
+
+        Args:
+            network (Network): network object with list of nodes
+            node_indices (ArrayLike): indices of the nodes in network.nodes, one per row of exposures
+            exposures (np.ndarray): number to expose by [node][age][risk][vaccine]
+            vaccine_model (Vaccination): vaccine model
+        """
+        S = Compartments.S.value
+        E = Compartments.E.value
+        for row, node_index in enumerate(node_indices):
+            data = network.nodes[node_index].compartments.compartment_data
+            actual = np.minimum(exposures[row], data[..., S])
+            data[..., S] -= actual
+            data[..., E] += actual
+        return
+
     def _group_cache_per_node(self, network: Type[Network]):
         for node in network.nodes:
             group_cache = np.zeros((self.parameters.number_of_age_groups,
@@ -104,33 +164,400 @@ class DiseaseModel:
         Given a node, calculate demographic percentages and fill a given cache
         """
         this_population = node.total_population()
-        for i in range(self.parameters.number_of_age_groups):
-            for j in range(len(RiskGroup)):
-                for k in range(len(VaccineGroup)):
-                    group = Group(i, j, k)
-                    group_cache[i][j][k] = node.compartments.demographic_population(group) / this_population
+        group_cache[...] = node.compartments.compartment_data.sum(axis=-1) / this_population
         return group_cache
 
-    def _calculate_beta_w_npi(self, node_index: int, node_id: int) -> list:
+    def _calculate_beta_w_npi(self, node_index: int, node_id: int) -> np.ndarray:
+        """
+        Calculate the change in beta given non-pharmaceutical interventions, by [age]
+        """
+        this_day = 0 if self.now == 0 else self.now - 1
+        logging.debug('day = %s; node_id = %s; node_index = %s', this_day, node_id, node_index)
+        beta = self._beta_by_day(this_day, len(self.npis_schedule[this_day]))[node_index]
+        logging.debug('beta_baseline = %s, beta = %s', self.beta, beta)
+        return beta
+
+    def _calculate_beta_w_npi_network(self, number_of_nodes:int) -> np.ndarray:
         """
-        Calculate the change in beta given non-pharmaceutical interventions
+        Calculate the change in beta given non-pharmaceutical interventions for every node at
+        once, with shape [node][age]
         """
         this_day = 0 if self.now == 0 else self.now - 1
-        logging.debug(f'day = {this_day}; node_id = {node_id}; node_index = {node_index}')
+        return self._beta_by_day(this_day, number_of_nodes)
 
-        npi_effectiveness = self.npis_schedule[this_day][node_index]
-        logging.debug(f'npi_effectiveness = {npi_effectiveness}')
+    def _beta_by_day(self, day:int, number_of_nodes:int) -> np.ndarray:
+        """
+        Beta with the NPIs of the schedule applied on one day, by [node][age]. Computed on demand
+        and memoized for the day, so the per-node calls of a day only index it; a node whose
+        schedule entry for the day does not have one effectiveness per age group keeps the
+        baseline beta that day.
+        """
+        self._check_npi_schedule()
+        key = (day, number_of_nodes)
+        if self._beta_day[0] == key:
+            return self._beta_day[1]
 
-        beta_baseline  = self.beta
-        age_group_size = self.parameters.number_of_age_groups
-        beta = [beta_baseline] * age_group_size
+        number_of_ages = self.parameters.number_of_age_groups
+        by_node = self.npis_schedule[day]
+        npi_effectiveness = np.zeros((number_of_nodes, number_of_ages))
+        if isinstance(by_node, np.ndarray) and by_node.shape == npi_effectiveness.shape:
+            npi_effectiveness[:] = by_node
+        else:
+            # schedules given as lists, e.g. with empty entries for nodes without NPIs
+            for node_index, by_age in enumerate(by_node[:number_of_nodes]):
+                if len(by_age) == number_of_ages:
+                    npi_effectiveness[node_index] = by_age
 
-        if (len(npi_effectiveness) == age_group_size):
-            for ag in range(age_group_size):
-                beta[ag] = beta_baseline * (1.0 - npi_effectiveness[ag])
+        self._beta_day = (key, float(self.beta) * (1.0 - npi_effectiveness))
+        return self._beta_day[1]
 
-        logging.debug(f'beta_baseline = {beta_baseline}, beta = {beta}')
-        return beta
+    def _check_npi_schedule(self):
+        """
+        Drop beta of the memoized day and the kernels derived from it when the NPI schedule
+        object or the baseline beta changed. The schedule itself is held, not its id, which
+        could be reused by a new schedule after the old one is collected.
+        """
+        state = getattr(self, '_npi_schedule_state', None)
+        if state is None or state[0] is not self.npis_schedule or state[1] != float(self.beta):
+            self._npi_schedule_state = (self.npis_schedule, float(self.beta))
+            self._beta_day = (None, None)
+            self._kernels = {}
+            logger.debug('NPI schedule changed, dropped the memoized beta and kernels')
+        return
+
+    def _kernel_memo(self) -> dict:
+        """
+        Memo of the kernels derived from beta with NPIs, see _npi_kernel. Kernels are keyed by
+        the beta vector, i.e. the NPI state, so nodes under the same NPIs share them on any day.
+        The memo is dropped when the NPI schedule changes, see _check_npi_schedule, or when it
+        grows past kernel_memo_size kernels, e.g. with county NPIs that change every day.
+        """
+        self._check_npi_schedule()
+        if len(self._kernels) > self.kernel_memo_size:
+            self._kernels = {}
+        return self._kernels
+
+    def _npi_kernel(self, beta:np.ndarray, vaccine_model:Type[Vaccination]) -> np.ndarray:
+        """
+        Force of infection kernel of one NPI state: the transmission rate of (age, vaccine) per
+        weighted infectious person of each contacted age, by [age][vaccine][contacted age], with
+        beta, the contact matrix, relative susceptibility and VE against infection folded in.
+        The force on a node is this kernel times its infectious by age over its population.
+
+        Args:
+            beta (np.ndarray): beta with NPIs applied, by [age] of the contacted group
+            vaccine_model (Vaccination): provides VE against infection
+        """
+        beta = np.asarray(beta, dtype=float)
+        vaccine_effectiveness = np.asarray(vaccine_model.vaccine_effectiveness, dtype=float)
+        memo = self._kernel_memo()
+        key = ('force', beta.tobytes(), vaccine_effectiveness.tobytes())
+        if key not in memo:
+            vaccinated = np.arange(len(VaccineGroup)) == VaccineGroup.V.value
+            contact = np.asarray(self.parameters.np_contact_matrix, dtype=float)
+            by_age = contact * beta[None, :] * np.asarray(self.relative_susceptibility, dtype=float)[:, None]
+            memo[key] = by_age[:, None, :] * (1.0 - vaccine_effectiveness[:, None] * vaccinated)[:, :, None]
+        return memo[key]
+
+    def _force_of_infection(self, compartments_today:np.ndarray, beta:np.ndarray, population:np.ndarray,
+                            infectious_weights:np.ndarray, vaccine_model:Type[Vaccination]) -> np.ndarray:
+        """
+        Transmission rate S => E of every (age, risk, vaccine) group, for any number of nodes
+
+        Args:
+            compartments_today (np.ndarray): compartments by [..., age, risk, vaccine, compartment]
+            beta (np.ndarray): beta with NPIs applied by [..., age] of the contacted group
+            population (np.ndarray): total population by [...]
+            infectious_weights (np.ndarray): weight of each compartment in the infectious population
+            vaccine_model (Vaccination): provides VE against infection
+
+        Returns:
+            np.ndarray: transmission rate by [..., age, 1, vaccine], broadcasting over risk
+        """
+        vaccinated = np.arange(compartments_today.shape[-2]) == VaccineGroup.V.value
+        vaccine_effectiveness = np.asarray(vaccine_model.vaccine_effectiveness, dtype=float)[:, None] * vaccinated
+        if self._travel_force is not None and self.travel_model.replaces_local_force:
+            # the travel model gives the whole force of infection by [node][age], local mixing
+            # included, with beta and relative susceptibility applied, see couple_travel
+            force_by_age = self._travel_force(compartments_today)
+            return np.maximum(force_by_age[..., None, None] * (1.0 - vaccine_effectiveness)[:, None, :], 0.0)
+
+        # infectious_by_age[..., a2] sums the weighted infectious over the risk and vaccine groups of age a2
+        # NOTE: Maybe an under-weighting if we should be doing age group specific: infectious_age/total_age_pop
+        infectious_by_age = compartments_today.sum(axis=(-3, -2)) @ infectious_weights
+        contact = np.asarray(self.parameters.np_contact_matrix, dtype=float)
+        inverse_population = np.divide(1.0, population, out=np.zeros_like(population, dtype=float),
+                                       where=population > 0)
+        force_by_age = ((beta * infectious_by_age) @ contact.T) * inverse_population[..., None] \
+                       * np.asarray(self.relative_susceptibility, dtype=float)
+
+        # Apply VE to the susceptible group (focal group); can't have negative transmission_rate
+        return np.maximum(force_by_age[..., None, None] * (1.0 - vaccine_effectiveness)[:, None, :], 0.0)
+
+    def _read_integrator(self):
+        """
+        Read the integrator of the stochastic models from the disease parameters: "daily" takes
+        one Poisson leap per day, "tau-leap" takes adaptive sub-steps, see TauLeaping,
+        "chain-binomial" draws the exits of each compartment from one multinomial in
+        chain_binomial_steps_per_day steps, see ChainBinomial, and "ssa" simulates every event
+        exactly, see NextReaction. Nodes with fewer people than ssa_population_below are
+        simulated exactly whatever the integrator.
+        """
+        disease_parameters = self.parameters.disease_parameters
+        self.integrator   = str(disease_parameters.get('integrator', 'daily')).lower()
+        self.tau_epsilon  = float(disease_parameters.get('tau_epsilon', 0.03))
+        self.max_substeps = int(disease_parameters.get('max_substeps', 64))
+        self.chain_binomial_steps_per_day = int(disease_parameters.get('chain_binomial_steps_per_day', 1))
+        self.ssa_population_below = float(disease_parameters.get('ssa_population_below', 0))
+        if self.integrator not in ('daily', 'tau-leap', 'chain-binomial', 'ssa'):
+            raise ValueError(f'integrator must be "daily", "tau-leap", "chain-binomial" or "ssa", '
+                             f'got "{self.integrator}"')
+        if not self.provides_ssa_channels and (self.integrator in ('chain-binomial', 'ssa')
+                                               or self.ssa_population_below > 0):
+            raise ValueError(f'integrator "{self.integrator}" and ssa_population_below are not supported '
+                             f'by the {type(self).__name__} model')
+        logger.info(f'integrator={self.integrator}, tau_epsilon={self.tau_epsilon}, max_substeps={self.max_substeps}, '
+                    f'chain_binomial_steps_per_day={self.chain_binomial_steps_per_day}, '
+                    f'ssa_population_below={self.ssa_population_below}')
+        return
+
+    def _exact_nodes(self, population:np.ndarray) -> np.ndarray:
+        """
+        Return which nodes the stochastic models simulate exactly, by [node]
+        """
+        if self.integrator == 'ssa':
+            return np.ones(population.shape, dtype=bool)
+        return population < self.ssa_population_below
+
+    def _advance_exact_split(self, exact:np.ndarray, compartments_today:np.ndarray, beta:np.ndarray,
+                             population:np.ndarray, vaccine_model:Type[Vaccination]) -> np.ndarray:
+        """
+        Step the exact nodes with the next reaction method and the others with _advance
+        """
+        from .NextReaction import next_reaction
+        rates, source, target, infection, infectious_weights = self._ssa_channels(
+            compartments_today[exact], beta[exact], population[exact], vaccine_model)
+        force_matrix = self._force_of_infection_matrix(beta[exact], population[exact], vaccine_model)
+
+        # ensure integer state for stochastic model
+        counts = np.trunc(compartments_today[exact])
+        counts_tomorrow = np.empty_like(counts)
+        events = 0
+        for row in range(counts.shape[0]):
+            counts_tomorrow[row], fired = next_reaction(counts[row], rates[row], source, target, infection,
+                                                        force_matrix[row], infectious_weights, self.rng)
+            events += fired
+        logger.debug(f'next reaction method fired {events} events in {counts.shape[0]} nodes on day {self.now}')
+
+        compartments_tomorrow = np.array(compartments_today, dtype=float)
+        compartments_tomorrow[exact] += counts_tomorrow - counts
+        if not exact.all():
+            rest = ~exact
+            compartments_tomorrow[rest] = self._advance(compartments_today[rest], beta[rest], population[rest],
+                                                        vaccine_model)
+        return compartments_tomorrow
+
+    def _chain_binomial_step(self, compartments_today:np.ndarray, beta:np.ndarray, population:np.ndarray,
+                             vaccine_model:Type[Vaccination]) -> np.ndarray:
+        """
+        Step any number of nodes by one day with the chain binomial over the channels of
+        _ssa_channels, the force of infection held at its value at the start of each step
+        """
+        from .ChainBinomial import chain_binomial
+        rates, source, target, infection, infectious_weights = self._ssa_channels(
+            compartments_today, beta, population, vaccine_model)
+
+        stoichiometry = np.zeros((len(source), compartments_today.shape[-1]))
+        stoichiometry[np.arange(len(source)), source] -= 1
+        stoichiometry[np.arange(len(source)), target] += 1
+
+        # ensure integer state for stochastic model
+        counts = np.trunc(compartments_today)
+        start = counts
+        dt = 1.0 / self.chain_binomial_steps_per_day
+        for _ in range(self.chain_binomial_steps_per_day):
+            force = self._force_of_infection(counts, beta, population, infectious_weights, vaccine_model)
+            step_rates = np.where(infection, rates * force[..., None], rates)
+            counts = counts + chain_binomial(counts, step_rates, source, self.rng, dt) @ stoichiometry
+        return compartments_today + (counts - start)
+
+    def _ssa_channels(self, compartments_today:np.ndarray, beta:np.ndarray, population:np.ndarray,
+                      vaccine_model:Type[Vaccination]) -> tuple:
+        """
+        Describe the transitions of the model for the next reaction method and the chain
+        binomial. Implemented by the models with provides_ssa_channels, the only ones
+        _read_integrator lets use them
+
+        Returns:
+            tuple: (rate per person by [node][age][risk][vaccine][channel], source compartment,
+                    target compartment and infection flag of each channel, infectious weights)
+        """
+        pass
+
+    def _force_of_infection_matrix(self, beta:np.ndarray, population:np.ndarray,
+                                   vaccine_model:Type[Vaccination]) -> np.ndarray:
+        """
+        Linear form of _force_of_infection: the transmission rate of (age, vaccine) per weighted
+        infectious person of each contacted age, by [..., age, vaccine, contacted age]; built from
+        the kernel of each distinct NPI state among the nodes, see _npi_kernel
+        """
+        inverse_population = np.divide(1.0, population, out=np.zeros_like(population, dtype=float),
+                                       where=population > 0)
+        states, state_of_node = np.unique(beta.reshape(-1, beta.shape[-1]), axis=0, return_inverse=True)
+        kernels = np.stack([self._npi_kernel(state, vaccine_model) for state in states])
+        return kernels[state_of_node.reshape(beta.shape[:-1])] * inverse_population[..., None, None, None]
+
+    def _read_ode_integrator(self):
+        """
+        Read the integrator of the deterministic models from the disease parameters: "euler" takes
+        one step per day, "rk4" takes ode_steps_per_day classical Runge-Kutta steps, and "rk45"
+        takes adaptive Dormand-Prince steps within ode_rtol / ode_atol, see ODEIntegration.
+        With "ode_travel": "rhs" the travel model adds its force of infection to the right-hand
+        side, so travel is integrated with the disease instead of applied once after it.
+        """
+        disease_parameters = self.parameters.disease_parameters
+        self.ode_integrator    = str(disease_parameters.get('ode_integrator', 'euler')).lower()
+        self.ode_steps_per_day = int(disease_parameters.get('ode_steps_per_day', 4))
+        self.ode_rtol          = float(disease_parameters.get('ode_rtol', 1e-4))
+        self.ode_atol          = float(disease_parameters.get('ode_atol', 1e-2))
+        self.travel_in_rhs     = str(disease_parameters.get('ode_travel', 'daily')).lower() == 'rhs'
+        if self.ode_integrator not in ('euler', 'rk4', 'rk45'):
+            raise ValueError(f'ode_integrator must be "euler", "rk4" or "rk45", got "{self.ode_integrator}"')
+        if self.travel_in_rhs and self.ode_integrator == 'euler':
+            raise ValueError('ode_travel "rhs" needs ode_integrator "rk4" or "rk45"')
+        self._ode_step = None    # last step of rk45, tried first the next day
+        logger.info(f'ode_integrator={self.ode_integrator}, ode_travel={"rhs" if self.travel_in_rhs else "daily"}')
+        return
+
+    def couple_travel(self, travel_model):
+        """
+        Give the model the travel model whose force of infection it integrates, if travel_in_rhs,
+        or uses in place of its local force, if the travel model has replaces_local_force. The
+        latter works with every integrator of the batched step that evaluates the force of
+        infection for the whole network at once; the next reaction method and the event-driven
+        and hybrid models step node by node, so they are rejected here.
+        """
+        self.travel_model = travel_model
+        if self.travel_in_rhs and not travel_model.provides_coupled_force:
+            raise ValueError(f'ode_travel "rhs" is not supported by the {type(travel_model).__name__} travel model')
+        if travel_model.replaces_local_force:
+            if not self.batched_step:
+                raise ValueError(f'the {type(travel_model).__name__} travel model is not supported by the '
+                                 f'{type(self).__name__} model, which does not step the network in one pass')
+            if getattr(self, 'integrator', None) == 'ssa' or getattr(self, 'ssa_population_below', 0) > 0:
+                raise ValueError(f'the {type(travel_model).__name__} travel model is not supported by the "ssa" '
+                                 f'integrator or ssa_population_below')
+        self.travel_in_step = self.travel_in_rhs or travel_model.replaces_local_force
+        return
+
+    def _ode_transmission_rate(self, compartments:np.ndarray, beta:np.ndarray, population:np.ndarray,
+                               infectious_weights:np.ndarray, vaccine_model:Type[Vaccination]) -> np.ndarray:
+        """
+        Transmission rate of _force_of_infection, plus the force of infection from travel when it
+        is part of the right-hand side. A travel model with replaces_local_force already gives the
+        whole force of infection through _force_of_infection.
+        """
+        rate = self._force_of_infection(compartments, beta, population, infectious_weights, vaccine_model)
+        if self._travel_force is None or self.travel_model.replaces_local_force:
+            return rate
+        vaccinated = np.arange(compartments.shape[-2]) == VaccineGroup.V.value
+        protection = 1.0 - np.asarray(vaccine_model.vaccine_effectiveness, dtype=float)[:, None] * vaccinated
+        return rate + self._travel_force(compartments)[..., None, None] * protection[:, None, :]
+
+    def _integrate_ode(self, derivatives, compartments_today:np.ndarray) -> np.ndarray:
+        """
+        Advance the compartments by one day with the rk4 or rk45 integrator
+        """
+        from .ODEIntegration import rk4, rk45
+        if self.ode_integrator == 'rk4':
+            return rk4(derivatives, compartments_today, self.ode_steps_per_day)
+        compartments, self._ode_step, steps = rk45(derivatives, compartments_today, self.ode_rtol, self.ode_atol,
+                                                   self._ode_step)
+        logger.debug(f'rk45 took {steps} steps on day {self.now}, next step {self._ode_step:.3f}')
+        return compartments
+
+    def _simulate_node_batched(self, node:Type[Node], time:int, vaccine_model:Type[Vaccination]):
+        """
+        Step a single node with the batched step of the model, as a network of one node
+        """
+        logger.debug(f'node={node}, time={time}')
+
+        # Need to update the node sense of time to get NPIs to take effect
+        self.now = time
+        if node.total_population() == 0:
+            return
+        beta = np.asarray(self._calculate_beta_w_npi(node.node_index, node.node_id), dtype=float)
+        self._travel_force = None   # travel needs the whole network
+        data = node.compartments.compartment_data
+        data[...] = self._advance(data[None], beta[None], np.array([node.total_population()], dtype=float),
+                                  vaccine_model)[0]
+        return
+
+    def simulate_network(self, network:Type[Network], time:int, vaccine_model:Type[Vaccination]):
+        """
+        Advance every active node of the network by one day, see Network.reset_activity; a
+        quiescent node has nothing to step. Models with a batched step advance the stacked
+        [node][age][risk][vaccine][compartment] array in one pass, so each transition is drawn
+        once per day for the whole network; the others step node by node.
+
+        Args:
+            network (Network): network object with list of nodes
+            time (int): the current day
+            vaccine_model (Vaccination): vaccine model
+
+        Returns:
+            np.ndarray: indices of the nodes advanced, the only ones whose compartments changed
+        """
+        # travel in the step can infect any node during the step
+        node_indices = np.arange(network.get_number_of_nodes()) if self.travel_in_step \
+                       else network.get_active_node_indices()
+        if not self.batched_step:
+            for node_index in node_indices:
+                self.simulate(network.nodes[node_index], time, vaccine_model)
+            network.update_activity(node_indices)
+            return node_indices
+
+        # Need to update the sense of time to get NPIs to take effect
+        self.now = time
+        if node_indices.size == 0:
+            return node_indices
+        beta = self._calculate_beta_w_npi_network(network.get_number_of_nodes())
+        if self.travel_in_step:
+            self._travel_force = self.travel_model.coupled_force(network, time, self)
+        if node_indices.size == network.get_number_of_nodes():
+            compartments_tomorrow = self._advance(network.get_compartment_array(), beta,
+                                                  network.get_population_array(), vaccine_model)
+        else:
+            compartments_tomorrow = self._advance(network.get_compartment_array(node_indices), beta[node_indices],
+                                                  network.get_population_array(node_indices), vaccine_model)
+        network.set_compartment_array(compartments_tomorrow, node_indices)
+        network.update_activity(node_indices, compartments_tomorrow)
+        return node_indices
+
+    def activity_compartments(self, network:Type[Network]) -> list:
+        """
+        Indices of the compartments people leave without infection pressure, which keep a node
+        active: every compartment but the uninfected ones, and R too when immunity wanes (R => S)
+        """
+        quiescent = set(self.uninfected_compartments)
+        if getattr(self, 'omega', 0):
+            quiescent.discard('R')
+        return [index for index, label in enumerate(network.compartment_labels)
+                if str(label).strip().upper() not in quiescent]
+
+    def _advance(self, compartments_today:np.ndarray, beta:np.ndarray, population:np.ndarray,
+                 vaccine_model:Type[Vaccination]) -> np.ndarray:
+        """
+        Return the compartments one day later. Implemented by the models with batched_step,
+        the only ones simulate_network calls it for
+
+        Args:
+            compartments_today (np.ndarray): compartments by [node][age][risk][vaccine][compartment]
+            beta (np.ndarray): beta with NPIs applied by [node][age]
+            population (np.ndarray): total population by [node]
+            vaccine_model (Vaccination): vaccine model
+        """
+        pass
 
     @staticmethod
     def spectral_radius(K: np.ndarray) -> float:
@@ -145,9 +572,35 @@ class DiseaseModel:
         # Numerical noise can introduce tiny imaginary parts; take real component.
         return float(np.max(eigvals.real))
 
+    @staticmethod
+    def compartment_labels(disease_parameters:dict) -> list:
+        """
+        Labels of the last axis of the compartment data: the declared compartments, with the
+        sub-stages of the compartments a declared transition graph gives an Erlang distributed
+        duration, see TransitionGraph
+        """
+        if 'transitions' not in disease_parameters:
+            return list(disease_parameters['compartments'])
+        from .TransitionGraphModel import staged_compartments
+        return staged_compartments(disease_parameters['compartments'], disease_parameters['transitions'])
+
     def simulate(self):
         pass
 
-    def reinitialize_events(self):
+    def reinitialize_events(self, node:Type[Node], vaccine_model:Type[Vaccination]):
+        """
+        Rebuild the event queue of a node from its compartments, for models that track
+        individual events, e.g. when the node switches from deterministic to stochastic
+        """
         pass
 
+    def clear_events(self, node:Type[Node]):
+        """
+        Drop the event queue and event counters of a node
+        """
+        node.events = []
+        node.contact_counter[...] = 0
+        node.unqueued_contact_counter[...] = 0
+        node.unqueued_event_counter[...] = 0
+        return
+
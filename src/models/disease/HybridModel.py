@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+import numpy as np
+import numpy.typing as npt
+import logging
+from typing import Type
+from numpy.random import SeedSequence, default_rng
+
+from baseclasses.Group import Group, Compartments, stage_label
+from baseclasses.Network import Network
+from baseclasses.Node import Node
+from models.disease.DiseaseModel import DiseaseModel
+from models.treatments.Vaccination import Vaccination
+
+logger = logging.getLogger(__name__)
+
+
+class HybridModel(DiseaseModel):
+
+    def __init__(self, disease_model:Type[DiseaseModel], deterministic:str, stochastic:str):
+        """
+        Run each node with the deterministic or the stochastic version of one model. A node
+        steps stochastically while few people are infected, e.g. near introduction or fade-out,
+        and deterministically once the outbreak there is large. Node.stochastic holds the mode;
+        thresholds on the number of infected people, with a gap between them, keep nodes from
+        flipping back and forth:
+            hybrid_deterministic_above: a stochastic node switches to deterministic at this count
+            hybrid_stochastic_below: a deterministic node switches back below this count
+            hybrid_compartments: compartments counted as infected, by default all but S, R and D
+
+        Args:
+            disease_model (DiseaseModel): parent disease model
+            deterministic (str): identity of the deterministic model, e.g. seirs-deterministic
+            stochastic (str): identity of the stochastic model, e.g. seirs-stochastic
+        """
+        identity = disease_model.disease_model
+        self.now = disease_model.now
+        self.parameters = disease_model.parameters
+        self.deterministic_model = disease_model.get_child(deterministic)
+        self.stochastic_model    = disease_model.get_child(stochastic)
+        disease_model.disease_model = identity
+        if self.deterministic_model.travel_in_rhs:
+            raise ValueError('ode_travel "rhs" is not supported by the hybrid models, travel is applied daily')
+
+        # beta and relative susceptibility are shared by both models and used by the travel model
+        self.beta = self.stochastic_model.beta
+        self.relative_susceptibility = self.stochastic_model.relative_susceptibility
+        self.npis_schedule = disease_model.npis_schedule
+
+        disease_parameters = self.parameters.disease_parameters
+        self.deterministic_above = float(disease_parameters.get('hybrid_deterministic_above', 1000))
+        self.stochastic_below    = float(disease_parameters.get('hybrid_stochastic_below', 100))
+        if self.stochastic_below > self.deterministic_above:
+            raise ValueError(f'hybrid_stochastic_below ({self.stochastic_below}) must not be above '
+                             f'hybrid_deterministic_above ({self.deterministic_above})')
+        labels = [str(c).strip().upper() for c in DiseaseModel.compartment_labels(disease_parameters)]
+        infected = disease_parameters.get('hybrid_compartments',
+                                          [c for c in labels if c not in self.stochastic_model.uninfected_compartments])
+        # a compartment counts with its sub-stages, if any
+        infected_compartments = set()
+        for c in infected:
+            label, stage = str(c).strip().upper(), 1
+            infected_compartments.add(labels.index(label))
+            while stage_label(label, stage + 1) in labels:
+                stage += 1
+                infected_compartments.add(labels.index(stage_label(label, stage)))
+        self.infected_compartments = np.array(sorted(infected_compartments))
+
+        logger.info(f'instantiated HybridModel of {deterministic} and {stochastic}; deterministic above '
+                    f'{self.deterministic_above}, stochastic below {self.stochastic_below} infected')
+        return
+
+    def set_seed(self, sim_seed:SeedSequence):
+        # both models draw from one stream
+        self._rng = default_rng(sim_seed)
+        self.deterministic_model._rng = self._rng
+        self.stochastic_model._rng = self._rng
+        return self._rng
+
+    def expose_number_of_people(self, node:Type[Node], group:Type[Group], num_to_expose:int, vaccine_model:Type[Vaccination]):
+        model = self.stochastic_model if node.stochastic else self.deterministic_model
+        model.now = self.now
+        model.expose_number_of_people(node, group, num_to_expose, vaccine_model)
+        return
+
+    def expose_network(self, network:Type[Network], node_indices:npt.ArrayLike, exposures:np.ndarray,
+                       vaccine_model:Type[Vaccination]):
+        """
+        Expose each node with the model it currently runs
+        """
+        node_indices = np.asarray(node_indices)
+        stochastic = np.array([network.nodes[i].stochastic for i in node_indices], dtype=bool)
+        for model, rows in ((self.stochastic_model, stochastic), (self.deterministic_model, ~stochastic)):
+            if rows.any():
+                model.now = self.now
+                model.expose_network(network, node_indices[rows], exposures[rows], vaccine_model)
+        return
+
+    def simulate(self, node:Type[Node], time:int, vaccine_model:Type[Vaccination]):
+        """
+        Update the mode of the node, then step it with the matching model
+        """
+        self.now = time
+        self._update_mode(node, vaccine_model)
+        model = self.stochastic_model if node.stochastic else self.deterministic_model
+        model.simulate(node, time, vaccine_model)
+        return
+
+    def simulate_network(self, network:Type[Network], time:int, vaccine_model:Type[Vaccination]):
+        """
+        Update the mode of every active node, then step the deterministic and the stochastic
+        nodes, each group in one pass when its model has a batched step. Returns the indices
+        of the nodes advanced.
+        """
+        self.now = time
+        active = network.get_active_node_indices()
+        for node_index in active:
+            self._update_mode(network.nodes[node_index], vaccine_model)
+        stochastic = np.array([network.nodes[i].stochastic for i in active], dtype=bool)
+
+        compartments_today = None
+        for model, selected in ((self.deterministic_model, ~stochastic), (self.stochastic_model, stochastic)):
+            if not selected.any():
+                continue
+            node_indices = active[selected]
+            if not model.batched_step:
+                for node_index in node_indices:
+                    model.simulate(network.nodes[node_index], time, vaccine_model)
+                continue
+            if compartments_today is None:
+                compartments_today = network.get_compartment_array(active)
+                population = network.get_population_array(active)
+            model.now = time
+            beta = model._calculate_beta_w_npi_network(network.get_number_of_nodes())
+            network.set_compartment_array(model._advance(compartments_today[selected], beta[node_indices],
+                                                         population[selected], vaccine_model),
+                                          node_indices)
+        network.update_activity(active)
+        return active
+
+    def activity_compartments(self, network:Type[Network]) -> list:
+        """
+        Compartments that keep a node active under either model
+        """
+        return sorted(set(self.deterministic_model.activity_compartments(network))
+                      | set(self.stochastic_model.activity_compartments(network)))
+
+    def _update_mode(self, node:Type[Node], vaccine_model:Type[Vaccination]):
+        """
+        Switch a node between deterministic and stochastic stepping, with hysteresis
+        """
+        infected = node.compartments.compartment_data[..., self.infected_compartments].sum()
+        if node.stochastic and infected >= self.deterministic_above:
+            node.stochastic = False
+            self.stochastic_model.clear_events(node)
+            logger.debug(f'node {node.node_id} switched to deterministic with {infected:.0f} infected on day {self.now}')
+        elif not node.stochastic and infected < self.stochastic_below:
+            node.stochastic = True
+            self._round_compartments(node)
+            self.stochastic_model.now = self.now
+            self.stochastic_model.reinitialize_events(node, vaccine_model)
+            logger.debug(f'node {node.node_id} switched to stochastic with {infected:.0f} infected on day {self.now}')
+        return
+
+    def _round_compartments(self, node:Type[Node]):
+        """
+        Deterministic steps leave fractions of people; round every compartment but S to whole
+        people, stochastically so the expected count is unchanged, and keep each group's total by
+        absorbing the difference in S. S is never left negative: a group without enough
+        susceptibles is rounded down, and any remaining deficit is taken from its largest other
+        compartment.
+        """
+        data = node.compartments.compartment_data
+        S = Compartments.S.value
+        others = np.arange(data.shape[-1]) != S
+        np.maximum(data, 0.0, out=data)   # round-off of the deterministic step
+
+        fractional = data[..., others]
+        rounded = np.floor(fractional + self.rng.random(fractional.shape))
+        # a group with almost no susceptibles left cannot absorb a rounding up, so round it down
+        short = data[..., S] + (fractional - rounded).sum(axis=-1) < 0
+        rounded[short] = np.floor(fractional[short])
+        susceptible = data[..., S] + (fractional - rounded).sum(axis=-1)
+
+        deficit = np.maximum(-susceptible, 0.0)
+        if deficit.any():
+            largest = rounded.argmax(axis=-1)[..., None]
+            np.put_along_axis(rounded, largest, np.take_along_axis(rounded, largest, axis=-1) - deficit[..., None],
+                              axis=-1)
+        data[..., S] = np.maximum(susceptible, 0.0)
+        data[..., others] = rounded
+        return
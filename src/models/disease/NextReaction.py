@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+import math
+import numpy as np
+import logging
+from numpy.random import Generator
+
+logger = logging.getLogger(__name__)
+
+
+class IndexedPriorityQueue:
+
+    def __init__(self, times:list):
+        """
+        Binary min-heap of the putative times of every reaction, with the heap position of each
+        reaction indexed so the time of any reaction can be changed in O(log n)
+
+        Args:
+            times (list): putative time of each reaction, math.inf if it cannot fire
+        """
+        self.times = list(times)
+        self.heap = sorted(range(len(self.times)), key=self.times.__getitem__)   # a sorted list is a heap
+        self.position = [0] * len(self.times)
+        for index, reaction in enumerate(self.heap):
+            self.position[reaction] = index
+        return
+
+    def top(self) -> tuple:
+        """
+        Return (reaction, time) of the next reaction
+        """
+        reaction = self.heap[0]
+        return reaction, self.times[reaction]
+
+    def update(self, reaction:int, time:float):
+        """
+        Change the time of a reaction and restore the heap order around it
+        """
+        old = self.times[reaction]
+        self.times[reaction] = time
+        if time < old:
+            self._sift_up(self.position[reaction])
+        elif time > old:
+            self._sift_down(self.position[reaction])
+        return
+
+    def _swap(self, i:int, j:int):
+        heap, position = self.heap, self.position
+        heap[i], heap[j] = heap[j], heap[i]
+        position[heap[i]] = i
+        position[heap[j]] = j
+        return
+
+    def _sift_up(self, i:int):
+        times, heap = self.times, self.heap
+        while i > 0:
+            parent = (i - 1) // 2
+            if times[heap[i]] >= times[heap[parent]]:
+                break
+            self._swap(i, parent)
+            i = parent
+        return
+
+    def _sift_down(self, i:int):
+        times, heap = self.times, self.heap
+        size = len(heap)
+        while True:
+            smallest, left, right = i, 2 * i + 1, 2 * i + 2
+            if left < size and times[heap[left]] < times[heap[smallest]]:
+                smallest = left
+            if right < size and times[heap[right]] < times[heap[smallest]]:
+                smallest = right
+            if smallest == i:
+                return
+            self._swap(i, smallest)
+            i = smallest
+
+
+def next_reaction(counts:np.ndarray, rates:np.ndarray, source:np.ndarray, target:np.ndarray,
+                  infection:np.ndarray, force_matrix:np.ndarray, infectious_weights:np.ndarray,
+                  rng:Generator, duration:float=1.0) -> tuple:
+    """
+    Exact stochastic simulation of one node with the Gibson-Bruck next reaction method. Every
+    channel of every (age, risk, vaccine) group is a reaction moving one person from its source
+    to its target compartment, with propensity
+        rate * count of the source compartment                    for the other channels
+        rate * count of the source compartment * force of infection   for infection channels
+    where the force of infection of group (age, vaccine) is linear in the infectious people by
+    age. The putative firing times sit in an indexed priority queue, and after each event only
+    the reactions in its dependency graph, those reading a compartment the event changed, get
+    new propensities and times.
+
+    Args:
+        counts (np.ndarray): whole people by [age][risk][vaccine][compartment]
+        rates (np.ndarray): rate per person of each channel by [age][risk][vaccine][channel],
+                            1 for infection channels scales the force of infection
+        source (np.ndarray): compartment each channel removes a person from
+        target (np.ndarray): compartment each channel adds the person to
+        infection (np.ndarray): True for channels driven by the force of infection
+        force_matrix (np.ndarray): force of infection on (age, vaccine) per weighted infectious
+                                   person of each age, by [age][vaccine][infectious age]
+        infectious_weights (np.ndarray): weight of each compartment in the infectious population
+        rng (Generator): random number generator
+        duration (float): days to simulate
+
+    Returns:
+        tuple: (counts after duration, number of events)
+    """
+    number_of_ages, number_of_risks, number_of_vaccines, number_of_compartments = counts.shape
+    number_of_channels = len(source)
+    shape = (number_of_ages, number_of_risks, number_of_vaccines)
+    number_of_groups = int(np.prod(shape))
+    group_age, _, group_vaccine = (index.ravel().tolist() for index in np.indices(shape))
+
+    x = np.rint(counts).reshape(number_of_groups, number_of_compartments).astype(np.int64).tolist()
+    rate = np.broadcast_to(rates, (*shape, number_of_channels)).reshape(number_of_groups, number_of_channels).tolist()
+    source, target = [int(c) for c in source], [int(c) for c in target]
+    infection = [bool(i) for i in infection]
+    weights = [float(w) for w in infectious_weights]
+    coupling = np.asarray(force_matrix, dtype=float)
+    force = (coupling @ (np.rint(counts).sum(axis=(1, 2)) @ np.asarray(infectious_weights, dtype=float))).tolist()
+    coupling = coupling.tolist()
+
+    def propensity(reaction:int) -> float:
+        g, k = divmod(reaction, number_of_channels)
+        a = rate[g][k] * x[g][source[k]]
+        if infection[k]:
+            a *= force[group_age[g]][group_vaccine[g]]
+        return max(a, 0.0)
+
+    # Dependency graph: within its group a channel changes its source and target compartments,
+    # and when either is infectious every infection channel of the node is affected. A channel
+    # always depends on itself, so the fired reaction is redrawn with the others.
+    infection_reactions = {g * number_of_channels + j for g in range(number_of_groups)
+                           for j in range(number_of_channels) if infection[j]}
+    dependencies = []
+    for g in range(number_of_groups):
+        for k in range(number_of_channels):
+            affected = {g * number_of_channels + j for j in range(number_of_channels)
+                        if source[j] in (source[k], target[k])}
+            if weights[source[k]] != 0.0 or weights[target[k]] != 0.0:
+                affected |= infection_reactions
+            dependencies.append(tuple(sorted(affected)))
+    force_change = [weights[target[k]] - weights[source[k]] for k in range(number_of_channels)]
+
+    # exponential draws in blocks, one numpy call per block instead of one per event
+    block = []
+    def exponential() -> float:
+        if not block:
+            block.extend(rng.exponential(size=1024).tolist())
+        return block.pop()
+
+    number_of_reactions = number_of_groups * number_of_channels
+    propensities = [propensity(r) for r in range(number_of_reactions)]
+    queue = IndexedPriorityQueue([exponential() / a if a > 0 else math.inf for a in propensities])
+
+    events = 0
+    while True:
+        fired, now = queue.top()
+        if now > duration:
+            break
+        g, k = divmod(fired, number_of_channels)
+        x[g][source[k]] -= 1
+        x[g][target[k]] += 1
+        events += 1
+
+        delta = force_change[k]
+        if delta != 0.0:
+            a2 = group_age[g]
+            for a in range(number_of_ages):
+                for v in range(number_of_vaccines):
+                    force[a][v] += coupling[a][v][a2] * delta
+
+        for reaction in dependencies[fired]:
+            old, new = propensities[reaction], propensity(reaction)
+            propensities[reaction] = new
+            if reaction == fired or old <= 0.0:
+                time = now + exponential() / new if new > 0 else math.inf
+            elif new > 0:
+                # reuse the unspent part of the exponential draw, rescaled to the new propensity
+                time = now + (old / new) * (queue.times[reaction] - now)
+            else:
+                time = math.inf
+            queue.update(reaction, time)
+
+    return np.array(x, dtype=float).reshape(counts.shape), events
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import numpy as np
+import logging
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# Dormand-Prince 5(4) tableau
+DP_C = np.array([0.0, 1/5, 3/10, 4/5, 8/9, 1.0, 1.0])
+DP_A = [[],
+        [1/5],
+        [3/40, 9/40],
+        [44/45, -56/15, 32/9],
+        [19372/6561, -25360/2187, 64448/6561, -212/729],
+        [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+        [35/384, 0.0, 500/1113, 125/192, -2187/6784, 11/84]]
+DP_B = np.array([35/384, 0.0, 500/1113, 125/192, -2187/6784, 11/84, 0.0])
+DP_E = DP_B - np.array([5179/57600, 0.0, 7571/16695, 393/640, -92097/339200, 187/2100, 1/40])
+
+
+def rk4(derivatives:Callable, y:np.ndarray, steps:int=4) -> np.ndarray:
+    """
+    Advance y by one day with the classical fourth order Runge-Kutta method
+
+    Args:
+        derivatives (Callable): maps the state to its derivative per day, same shape as y
+        y (np.ndarray): state, e.g. compartments by [node][age][risk][vaccine][compartment]
+        steps (int): number of equal steps per day
+    """
+    h = 1.0 / steps
+    for _ in range(steps):
+        k1 = derivatives(y)
+        k2 = derivatives(y + h / 2 * k1)
+        k3 = derivatives(y + h / 2 * k2)
+        k4 = derivatives(y + h * k3)
+        y = y + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+    return y
+
+
+def rk45(derivatives:Callable, y:np.ndarray, rtol:float=1e-4, atol:float=1e-2, h:float=None,
+         max_steps:int=1000) -> tuple:
+    """
+    Advance y by one day with the adaptive Dormand-Prince 5(4) method. The whole state is one
+    system: every node and group takes the same steps, sized so the local error of every entry
+    stays within atol + rtol * |y|. The last step is shortened to end exactly on the day.
+
+    Args:
+        derivatives (Callable): maps the state to its derivative per day, same shape as y
+        y (np.ndarray): state, e.g. compartments by [node][age][risk][vaccine][compartment]
+        rtol (float): relative tolerance
+        atol (float): absolute tolerance, in people
+        h (float): first step to try, e.g. the step returned for the previous day
+        max_steps (int): give up after this many accepted and rejected steps
+
+    Returns:
+        tuple: (y one day later, step to try next, number of accepted steps)
+    """
+    t, accepted = 0.0, 0
+    h = 1.0 if h is None else min(h, 1.0)
+    k_first = derivatives(y)
+    for _ in range(max_steps):
+        if t >= 1.0 - 1e-12:
+            return y, h, accepted
+        step = min(h, 1.0 - t)
+        k = [k_first]
+        for stage in range(1, 7):
+            k.append(derivatives(y + step * sum(a * k_j for a, k_j in zip(DP_A[stage], k) if a != 0.0)))
+        y_new = y + step * sum(b * k_j for b, k_j in zip(DP_B, k) if b != 0.0)
+        error = step * sum(e * k_j for e, k_j in zip(DP_E, k) if e != 0.0)
+
+        scale = atol + rtol * np.maximum(np.abs(y), np.abs(y_new))
+        error_norm = float(np.max(np.abs(error) / scale)) if error.size else 0.0
+        if error_norm <= 1.0:
+            t += step
+            y = y_new
+            k_first = k[6]    # first same as last
+            accepted += 1
+        if error_norm <= 1.0 and step < h:
+            # the step was cut short by the end of the day, keep h for the next day
+            continue
+        h = step * (5.0 if error_norm == 0.0 else min(5.0, max(0.2, 0.9 * error_norm ** -0.2)))
+    raise RuntimeError(f'rk45 did not finish the day in {max_steps} steps (t={t:.4f}, h={h:.2e})')
@@ -8,6 +8,7 @@ from typing import Type
 from .DiseaseModel import DiseaseModel
 from baseclasses.Event import EventType
 from baseclasses.Group import Group, RiskGroup, VaccineGroup, Compartments
+from baseclasses.Network import Network
 from baseclasses.Node import Node
 from baseclasses.PopulationCompartments import PopulationCompartments
 from models.treatments.Vaccination import Vaccination
@@ -65,7 +66,7 @@ class Schedule:
         self._Ti    = (self._Tt + disease_model.chi) if compartment_num < 4 else self._Tt
         self._Td_a  = (rand_exp_min1(disease_model.nu_values[group.age][group.risk])) + self._Ta if compartment_num < 3 else float('inf')
         self._Td_ti = rand_exp_min1(disease_model.nu_values[group.age][group.risk]) + self._Tt
-        self._Tr_a  = (rand_exp_min1(disease_model.gamma)) if compartment_num < 3 else float('inf')
+        self._Tr_a  = (rand_exp_min1(disease_model.gamma)) + self._Ta if compartment_num < 3 else float('inf')
         self._Tr_ti = rand_exp_min1(disease_model.gamma) + self._Tt
         
         self.exit_asymptomatic_time = min(self._Td_a, self._Tr_a)
@@ -148,14 +149,13 @@ class StochasticSEATIRD(DiseaseModel):
         group_cache = node.group_cache
         initial_compartments = deepcopy(node.compartments)
 
-        node.events.sort(key=lambda x: x.time, reverse=True)
-
         #if node.node_id == 1:
         #    logging.debug(f'PRE EVENT LENGTH = {len(node.events)}, t_max = {t_max}')
         #    for item in node.events:
         #        logging.debug(f'EVENT: init_time={item.init_time}, time={item.time}')
 
-        while (len(node.events)) > 0 and (node.events[-1].time < t_max):
+        # the event queue is a heap, so events queued today before t_max also run today
+        while node.next_event_time() < t_max:
             self._next_event(node, group_cache, initial_compartments, vaccine_model)
 
         self.now = t_max
@@ -185,11 +185,43 @@ class StochasticSEATIRD(DiseaseModel):
         return
 
 
-    def reinitialize_events(self, node:Type[Node]):
+    def expose_network(self, network:Type[Network], node_indices:npt.ArrayLike, exposures:np.ndarray,
+                       vaccine_model:Type[Vaccination]):
+        """
+        Every exposed individual needs its own schedule of events, so the bulk exposures are
+        applied group by group through expose_number_of_people
+        """
+        for row, node_index in enumerate(node_indices):
+            node = network.nodes[node_index]
+            for ag, rg, vg in zip(*np.nonzero(exposures[row])):
+                group = Group(int(ag), int(rg), int(vg))
+                self.expose_number_of_people(node, group, int(exposures[row][ag][rg][vg]), vaccine_model)
+        return
+
+
+    def reinitialize_events(self, node:Type[Node], vaccine_model:Type[Vaccination]):
         """
-        Used for transition from deterministic to stochastic computation. Not currently implemented
+        Used for transition from deterministic to stochastic computation. The compartments of the
+        node must hold whole people; everyone in E, A, T or I is drawn the rest of a schedule
+        starting from their current compartment, with the contacts they still have to make
         """
-        pass
+        self.clear_events(node)
+        group_cache = node.group_cache
+        initialize = {Compartments.E.value: self._initialize_exposed_transitions,
+                      Compartments.A.value: self._initialize_asymptomatic_transitions,
+                      Compartments.T.value: self._initialize_treatable_transitions,
+                      Compartments.I.value: self._initialize_infectious_transitions}
+        data = node.compartments.compartment_data
+        for compartment, initialize_transitions in initialize.items():
+            for ag, rg, vg in zip(*np.nonzero(data[..., compartment])):
+                group = Group(int(ag), int(rg), int(vg))
+                for _ in range(int(round(data[ag][rg][vg][compartment]))):
+                    schedule = Schedule(self, self.now, group)
+                    schedule.update(self, self.now, group, compartment)
+                    initialize_transitions(node, group, schedule)
+                    self._initialize_contact_events(node, group, schedule, group_cache, vaccine_model)
+        logger.debug(f'reinitialized {len(node.events)} events for node {node.node_id} on day {self.now}')
+        return
 
 
     ###### Private Methods ######
@@ -284,49 +316,52 @@ class StochasticSEATIRD(DiseaseModel):
         """
         beta = self._calculate_beta_w_npi(node.node_index, node.node_id)
 
-        for ag in range(self.parameters.number_of_age_groups):
-            sigma = float(self.relative_susceptibility[ag])
-
-            for rg in range(len(RiskGroup)):
-                for vg in range(len(VaccineGroup)):
-                    to = Group(ag, rg, vg)
-                    contact_rate = float(self.parameters.np_contact_matrix[group.age][to.age])
-
-                    # If no one is vaccinated, then the transmission rate for vaccine group is 0 and
-                    # causes runtime warning divide by zero error in the rand_exp step
-                    # TODO dig in to what is expected behavior of this method when group size is 0
-                    if (group_cache[ag][rg][vg] == 0): continue
-                    
-                    # TODO we should really only be using vaccine_effectiveness[] in this 
-                    # Cannot have vaccine effectiveness hitting beta unless in vaccinated group
-                    if vg == 1:  # vaccinated then get effectiveness by age group
-                        vaccine_effectiveness =  vaccine_model.vaccine_effectiveness[ag]
-                    else:  # if you're not vaccinated, it has no effectiveness
-                        vaccine_effectiveness = 0
-                    # group_cache is weighting the force of infection
-                    transmission_rate = (1.0 - vaccine_effectiveness) * beta[ag] * contact_rate \
-                                        * sigma * group_cache[ag][rg][vg]
-                    # if the rate is zero (VE=1 or other reasons), do not schedule contacts
-                    if transmission_rate <= 0.0:
-                        continue
-
-                    Tc_init = schedule.Ta()
-                    Tc = rand_exp_min1(transmission_rate) + Tc_init
-
-                    while (Tc < schedule.Trd_ati()):
-                        node.add_contact_event(Tc_init, Tc, EventType.CONTACT, group, to)
-                        Tc_init = Tc
-                        Tc = rand_exp_min1(transmission_rate) + Tc_init
+        # group_cache is weighting the force of infection
+        transmission_rates = self._contact_kernel(beta, vaccine_model)[group.age] * group_cache
+
+        # Groups of size 0 would divide by zero in the rand_exp step, and if the rate is zero
+        # (VE=1 or other reasons), do not schedule contacts
+        for ag, rg, vg in zip(*np.nonzero(transmission_rates > 0.0)):
+            to = Group(int(ag), int(rg), int(vg))
+            transmission_rate = float(transmission_rates[ag, rg, vg])
+
+            Tc_init = schedule.Ta()
+            Tc = rand_exp_min1(transmission_rate) + Tc_init
+
+            while (Tc < schedule.Trd_ati()):
+                node.add_contact_event(Tc_init, Tc, EventType.CONTACT, group, to)
+                Tc_init = Tc
+                Tc = rand_exp_min1(transmission_rate) + Tc_init
         return
 
+    def _contact_kernel(self, beta:np.ndarray, vaccine_model:Type[Vaccination]) -> np.ndarray:
+        """
+        Transmission rate from an exposed person of each age to every contacted (age, risk, vaccine)
+        group before weighting by group_cache, by [exposed age][age][risk][vaccine]. It depends on
+        the node only through its NPI state, so it is memoized by beta and shared by every exposed
+        person of every node under the same NPIs, see DiseaseModel._kernel_memo
+        """
+        beta = np.asarray(beta, dtype=float)
+        vaccine_effectiveness = np.asarray(vaccine_model.vaccine_effectiveness, dtype=float)
+        memo = self._kernel_memo()
+        key = ('contact', beta.tobytes(), vaccine_effectiveness.tobytes())
+        if key not in memo:
+            # Cannot have vaccine effectiveness hitting beta unless in vaccinated group
+            vaccinated = np.arange(len(VaccineGroup)) == VaccineGroup.V.value
+            contact = np.asarray(self.parameters.np_contact_matrix, dtype=float)
+            by_age = contact * (beta * np.asarray(self.relative_susceptibility, dtype=float))[None, :]
+            memo[key] = by_age[:, :, None, None] * (1.0 - vaccine_effectiveness[:, None] * vaccinated)[None, :, None, :]
+        return memo[key]
+
+
     def _next_event(self, node:Type[Node], group_cache:npt.ArrayLike, initial_compartments:Type[PopulationCompartments],
                     vaccine_model:Type[Vaccination]):
         """
-        Grab the next event from the queue (last thing in the list) and act on it
+        Grab the next event from the queue (the earliest) and act on it
         """
         if not node.events: return # if list of events is empty, return from this method
 
-        this_event = deepcopy(node.events.pop())
+        this_event = node.pop_event()
         this_type = this_event.event_type
 
         if this_type == 'EtoA':
@@ -6,6 +6,7 @@ from typing import Type
 from baseclasses.Group import Group, RiskGroup, VaccineGroup
 from baseclasses.Node import Node
 from models.disease.DiseaseModel import DiseaseModel
+from models.disease.TauLeaping import adaptive_tau_leap
 from models.treatments.Vaccination import Vaccination
 
 logger = logging.getLogger(__name__)
@@ -230,8 +231,69 @@ def SEIHRD_model(y,
 
     return np.array([dS_dt, dE_dt, dIA_dt, dIP_dt, dIS_dt, dH_dt, dR_dt, dD_dt])
 
+def SEIHRD_model_vectorized(y,
+                            transmission_rate, E_out_rate, prop_E_to_IA, IP_to_IS_rate,
+                            IS_to_H_rate, IS_to_R_rate, H_to_D_rate, H_to_R_rate, IA_to_R_rate,
+                            rng):
+    """
+    SEIHRD_model for many groups at once, e.g. every [age][risk][vaccine] group of a node. Each
+    transition is a single Poisson draw over all groups, capped the same way as SEIHRD_model,
+    so every group follows the same distribution as a scalar call.
+    Parameters:
+        y (np.ndarray): compartments [S, E, IA, IP, IS, H, R, D] on the last axis
+        transmission_rate ... IA_to_R_rate: as in SEIHRD_model, scalars or arrays that
+                                            broadcast against y[..., 0]
+        rng (Generator): random number generator
+    Returns:
+        np.ndarray: derivatives with the shape of y
+    """
+    # ensure integer state for stochastic model
+    S, E, IA, IP, IS, H, R, D = np.moveaxis(np.trunc(np.asarray(y, dtype=float)), -1, 0)
+
+    def draw(rate, count):
+        # Prevent compartments from going negative by only removing as many people remain in the compartment
+        return np.minimum(rng.poisson(np.maximum(rate, 0.0) * count), count)
+
+    max_new_infections = draw(transmission_rate, S)
+    total_e_out = draw(E_out_rate, E)
+    e_to_ia     = np.floor(prop_E_to_IA * total_e_out)
+    e_to_ip     = total_e_out - e_to_ia
+    ip_to_is    = draw(IP_to_IS_rate, IP)
+    ia_to_r     = draw(IA_to_R_rate, IA)
+
+    # IS split: draw target first (IS→H), then compete from remaining (IS→R)
+    is_to_h = draw(IS_to_H_rate, IS)
+    is_to_r = draw(IS_to_R_rate, IS - is_to_h)
+
+    # H split: draw target first (H→D), then compete from remaining (H→R)
+    h_to_d = draw(H_to_D_rate, H)
+    h_to_r = draw(H_to_R_rate, H - h_to_d)
+
+    return np.stack([
+        -max_new_infections,                          # dS_dt
+        max_new_infections - e_to_ia - e_to_ip,       # dE_dt
+        e_to_ia - ia_to_r,                            # dIA_dt
+        e_to_ip - ip_to_is,                           # dIP_dt
+        ip_to_is - is_to_h - is_to_r,                 # dIS_dt
+        is_to_h - h_to_d - h_to_r,                    # dH_dt
+        is_to_r + h_to_r + ia_to_r,                   # dR_dt
+        h_to_d,                                       # dD_dt
+    ], axis=-1)
+
+# SEIHRD channels for tau-leaping: source and target compartment of each, in the order of
+# StochasticSEIHRD._tau_leap; S and the infectious compartments enter the force of infection
+SEIHRD_SOURCE = np.array([0, 1, 1, 3, 4, 4, 5, 5, 2])
+SEIHRD_TARGET = np.array([1, 2, 3, 4, 5, 6, 7, 6, 6])
+SEIHRD_STOICHIOMETRY = np.zeros((9, 8))
+SEIHRD_STOICHIOMETRY[np.arange(9), SEIHRD_SOURCE] = -1
+SEIHRD_STOICHIOMETRY[np.arange(9), SEIHRD_TARGET] = 1
+SEIHRD_ORDER = np.array([2, 1, 2, 2, 2, 1, 1, 1])
+
 class StochasticSEIHRD(DiseaseModel):
 
+    batched_step = True
+    provides_ssa_channels = True
+
     def __init__(self, disease_model:Type[DiseaseModel]): # add antiviral_model
         self.now = disease_model.now
         self.parameters = disease_model.parameters
@@ -308,6 +370,24 @@ class StochasticSEIHRD(DiseaseModel):
             self.prop_E_to_IA, self.rel_inf_IP_to_IS, self.rel_inf_IA_to_IS)
         logger.info(f'Estimated mean generation time is {gen_time}')
 
+        # Array forms of the per group parameters used by the vectorized step
+        self._prop_E_to_IA            = np.asarray(self.prop_E_to_IA, dtype=float)
+        self._prop_IS_to_H            = np.asarray(self.prop_IS_to_H, dtype=float).T   # [age][risk]
+        self._prop_H_to_D             = np.asarray(self.prop_H_to_D, dtype=float)
+        self._H_to_R_rates            = np.asarray(self.H_to_R_rates, dtype=float)
+        # Static rate tables by [age][risk][vaccine], broadcasting where a rate doesn't depend on the group
+        self._IS_to_H_base = (self._prop_IS_to_H * self.IS_to_H_rate)[:, :, None]
+        self._IS_to_R_rate = ((1 - self._prop_IS_to_H) * self.IS_to_R_rate)[:, :, None]
+        self._H_to_D_rate  = (self._prop_H_to_D * self.H_to_D_rate)[:, None, None]
+        self._H_to_R_rate  = ((1 - self._prop_H_to_D) * self._H_to_R_rates)[:, None, None]
+        self._E_to_IA_prop = self._prop_E_to_IA[:, None, None]
+        self._IS_to_H_by_VE = {}   # IS => H with VE against hospitalization, keyed by the VE by age
+        # weight of each compartment [S, E, IA, IP, IS, H, R, D] in the infectious population
+        self._infectious_weights = np.array([0.0, 0.0, self.rel_inf_IA_to_IS, self.rel_inf_IP_to_IS, 1.0, 0.0, 0.0, 0.0])
+
+        # one Poisson leap per day, adaptive tau-leaping, or the chain binomial
+        self._read_integrator()
+
         # this isn't used in this file, but _calculate_beta_w_npi inherits from this init
         self.npis_schedule = disease_model.npis_schedule
 
@@ -323,98 +403,125 @@ class StochasticSEIHRD(DiseaseModel):
     def simulate(self, node:Type[Node], time: int, vaccine_model:Type[Vaccination]):
         """
         Main simulation logic for stochastic SEIHRD model.
-        Each group (age, risk, vaccine) is simulated separately via ODE.
+        All groups (age, risk, vaccine) of the node step forward together: the force of infection
+        by age is one contact matrix product, and each transition is one Poisson draw over the
+        [age][risk][vaccine] array, with the same rates and caps as SEIHRD_model.
 
         S = Susceptible, E = Exposed, IA = Infectious Asymptomatic
         IP = Infectious Pre-symptomatic, IS = Infectious Symptomatic
         H = Hospitalized, R = Recovered, D = Deceased
         """
-
-        logger.debug(f'node={node}, time={time}')
-
-        # Need to update the node sense of time to get NPIs to take effect
-        self.now = time
-
-        # Snapshot: all compartments at start of the day so we don't call the updated subgroups
-        compartments_today = {
-            (group.age, group.risk, group.vaccine): np.array(node.compartments.get_compartment_vector_for(group))
-            for group in node.compartments.get_all_groups()
-        }
-
-        # Get the total population of node
-        total_node_pop = node.total_population()
-
-        # beta is set for all age groups by node and day, so calc before loop over groups in node
-        # the baseline beta is only one value, not age specific then NPIs modify it to be age specific
-        beta_vector = self._calculate_beta_w_npi(node.node_index, node.node_id)
-
-        # focal_group is the group we are simulating forward in time
-        # contacted_group is the group causing disease spread interaction
-        for focal_group in node.compartments.get_all_groups():
-            # print(focal_group)  # e.g. Group object: age=0, risk=0, vaccine=0
-            focal_group_compartments_today = np.array(node.compartments.get_compartment_vector_for(focal_group))
-            if sum(focal_group_compartments_today) == 0:
-                continue  # skip empty groups
-
-            # Determine vaccine effect on focal group susceptibility
-            # 1 is vaccinated subgroup, 0 unvaccinated subgroup
-            if focal_group.vaccine == 1:
-                vaccine_effectiveness_inf  = vaccine_model.vaccine_effectiveness[focal_group.age]
-                vaccine_effectiveness_hosp = vaccine_model.vaccine_effectiveness_hosp[focal_group.age]
-            else:
-                vaccine_effectiveness_inf  = 0.0
-                vaccine_effectiveness_hosp = 0.0
-
-            #### Get focal group specific rate params ####
-            IS_to_H_rate =      self.prop_IS_to_H[focal_group.risk][focal_group.age] * self.IS_to_H_rate \
-                            * (1 - vaccine_effectiveness_hosp)
-            IS_to_R_rate = (1 - self.prop_IS_to_H[focal_group.risk][focal_group.age]) * self.IS_to_R_rate
-            H_to_D_rate  = self.prop_H_to_D[focal_group.age] * self.H_to_D_rate
-            H_to_R_rate  = (1 - self.prop_H_to_D[focal_group.age]) * self.H_to_R_rates[focal_group.age]
-
-            #### Get force of infection from each interaction subgroup ####
-            # This is constant in time if we don't have an NPI schedule hitting beta each day
-            transmission_rate = 0
-            for contacted_group in node.compartments.get_all_groups():
-                contact_rate = float(self.parameters.np_contact_matrix[focal_group.age][contacted_group.age])
-                if contact_rate== 0:
-                    continue
-
-                # contacted_group_compartments_today
-                S, E, IA, IP, IS, H, R, D = \
-                    compartments_today[(contacted_group.age, contacted_group.risk, contacted_group.vaccine)]
-                infectious_contacted = self.rel_inf_IP_to_IS * IP + \
-                                       self.rel_inf_IA_to_IS * IA + \
-                                       IS # `IS` is base compartment so rel inf = 1
-
-                # infectious_contacted/total_node_pop this captures the fraction of population we need to move from S -> E
-                # NOTE: Maybe an under-weighting if we should be doing age group specific: infectious_age/total_age_pop
-                transmission_rate += beta_vector[contacted_group.age] * contact_rate \
-                                     * (infectious_contacted/total_node_pop)
-            # Apply VE to the susceptible group (focal group)
-            transmission_rate *= (1.0 - vaccine_effectiveness_inf) * self.relative_susceptibility[focal_group.age]
-            #print(f"{node.node_id}, {focal_group}, transmission_rate: {transmission_rate}")
-            transmission_rate = max(transmission_rate, 0) # Can't have negative transmission_rate
-            #transmission_prob = 1.0 - np.exp(-transmission_rate)
-            #print(f"transmission probability: {transmission_prob}")
-
-            model_parameters = (
-                transmission_rate,     # S => E
-                self.E_out_rate,       # E => IA & IP, goes in Poisson then split by prop
-                self.prop_E_to_IA[focal_group.age], #
-                self.IP_to_IS_rate,    # IP => IS
-                IS_to_H_rate,          # IS => H, rate * (1 - VE_hosp) * proportion hospitalized
-                IS_to_R_rate,          # IS => R, rate * (1 - proportion hospitalized)
-                H_to_D_rate,           # H => D, rate * (1 -
-                H_to_R_rate,           # H => R,
-                self.IA_to_R_rate      # IA => R,
-            )
-
-            # Euler's Method solve of the system, can't do integer people
-            daily_change = SEIHRD_model(focal_group_compartments_today, *model_parameters, rng=self.rng)
-            compartments_tomorrow = focal_group_compartments_today + daily_change
-            node.compartments.set_compartment_vector_for(focal_group, compartments_tomorrow)
-
+        self._simulate_node_batched(node, time, vaccine_model)
         return
 
-
+    def _advance(self, compartments_today:np.ndarray, beta:np.ndarray, population:np.ndarray,
+                 vaccine_model:Type[Vaccination]) -> np.ndarray:
+        """
+        Step any number of nodes at once, see DiseaseModel.simulate_network
+        """
+        exact = self._exact_nodes(population)
+        if exact.any():
+            return self._advance_exact_split(exact, compartments_today, beta, population, vaccine_model)
+        if self.integrator == 'tau-leap':
+            return self._tau_leap(compartments_today, beta, population, vaccine_model)
+        if self.integrator == 'chain-binomial':
+            return self._chain_binomial_step(compartments_today, beta, population, vaccine_model)
+
+        model_parameters = self._group_rates(compartments_today, beta, population, vaccine_model)
+
+        # Euler's Method solve of the system, can't do integer people
+        daily_change = SEIHRD_model_vectorized(compartments_today, *model_parameters, rng=self.rng)
+        return compartments_today + daily_change
+
+    def _tau_leap(self, compartments_today:np.ndarray, beta:np.ndarray, population:np.ndarray,
+                  vaccine_model:Type[Vaccination]) -> np.ndarray:
+        """
+        Step any number of nodes by one day with adaptive tau-leaping over the SEIHRD channels
+        """
+        def propensities(counts):
+            (transmission_rate, E_out_rate, prop_E_to_IA, IP_to_IS_rate, IS_to_H_rate, IS_to_R_rate,
+             H_to_D_rate, H_to_R_rate, IA_to_R_rate) = self._group_rates(counts, beta, population, vaccine_model)
+            S, E, IA, IP, IS, H, R, D = np.moveaxis(counts, -1, 0)
+            return np.stack([
+                transmission_rate * S,                # S => E
+                E_out_rate * prop_E_to_IA * E,        # E => IA
+                E_out_rate * (1 - prop_E_to_IA) * E,  # E => IP
+                IP_to_IS_rate * IP,                   # IP => IS
+                IS_to_H_rate * IS,                    # IS => H
+                IS_to_R_rate * IS,                    # IS => R
+                H_to_D_rate * H,                      # H => D
+                H_to_R_rate * H,                      # H => R
+                IA_to_R_rate * IA,                    # IA => R
+            ], axis=-1)
+
+        # ensure integer state for stochastic model
+        counts = np.trunc(compartments_today)
+        counts_tomorrow, _ = adaptive_tau_leap(counts, propensities, SEIHRD_STOICHIOMETRY, SEIHRD_SOURCE,
+                                               SEIHRD_ORDER, self.rng, self.tau_epsilon, self.max_substeps)
+        return compartments_today + (counts_tomorrow - counts)
+
+    def _ssa_channels(self, compartments_today:np.ndarray, beta:np.ndarray, population:np.ndarray,
+                      vaccine_model:Type[Vaccination]) -> tuple:
+        """
+        The SEIHRD channels for the next reaction method, in the order of SEIHRD_SOURCE, see
+        DiseaseModel._ssa_channels
+        """
+        (_, E_out_rate, prop_E_to_IA, IP_to_IS_rate, IS_to_H_rate, IS_to_R_rate,
+         H_to_D_rate, H_to_R_rate, IA_to_R_rate) = self._group_rates(compartments_today, beta, population, vaccine_model)
+        shape = compartments_today.shape[:-1]
+        rates = np.stack([np.broadcast_to(rate, shape).astype(float) for rate in (
+            1.0,                                   # S => E, times the force of infection
+            E_out_rate * prop_E_to_IA,             # E => IA
+            E_out_rate * (1 - prop_E_to_IA),       # E => IP
+            IP_to_IS_rate,                         # IP => IS
+            IS_to_H_rate,                          # IS => H
+            IS_to_R_rate,                          # IS => R
+            H_to_D_rate,                           # H => D
+            H_to_R_rate,                           # H => R
+            IA_to_R_rate,                          # IA => R
+        )], axis=-1)
+        infection = np.arange(len(SEIHRD_SOURCE)) == 0
+        return rates, SEIHRD_SOURCE, SEIHRD_TARGET, infection, self._infectious_weights
+
+    def _group_rates(self, compartments_today:np.ndarray, beta:np.ndarray, population:np.ndarray,
+                     vaccine_model:Type[Vaccination]) -> tuple:
+        """
+        Rates of every transition for every (age, risk, vaccine) group, each broadcasting against
+        [..., age, risk, vaccine], in the argument order of SEIHRD_model_vectorized
+
+        Args:
+            compartments_today (np.ndarray): compartments by [..., age, risk, vaccine, compartment]
+            beta (np.ndarray): beta with NPIs applied, by [..., age] of the contacted group
+            population (np.ndarray): total population by [...]
+            vaccine_model (Vaccination): provides VE against infection and hospitalization
+        """
+        #### Force of infection on each focal group from every contacted age ####
+        transmission_rate = self._force_of_infection(compartments_today, beta, population,
+                                                     self._infectious_weights, vaccine_model)
+
+        #### Focal group specific rate params, compiled at initialization ####
+        IS_to_H_rate = self._IS_to_H_rate(vaccine_model, compartments_today.shape[-2])
+
+        return (
+            transmission_rate,                              # S => E
+            self.E_out_rate,                                # E => IA & IP, goes in Poisson then split by prop
+            self._E_to_IA_prop,
+            self.IP_to_IS_rate,                             # IP => IS
+            IS_to_H_rate,                                   # IS => H, rate * (1 - VE_hosp) * proportion hospitalized
+            self._IS_to_R_rate,                             # IS => R, rate * (1 - proportion hospitalized)
+            self._H_to_D_rate,                              # H => D
+            self._H_to_R_rate,                              # H => R
+            self.IA_to_R_rate                               # IA => R
+        )
+
+    def _IS_to_H_rate(self, vaccine_model:Type[Vaccination], number_of_vaccines:int) -> np.ndarray:
+        """
+        IS => H rate by [age][risk][vaccine], with the vaccine effect on hospitalization of the
+        focal group; compiled once per VE against hospitalization
+        """
+        key = (tuple(float(x) for x in vaccine_model.vaccine_effectiveness_hosp), number_of_vaccines)
+        if key not in self._IS_to_H_by_VE:
+            vaccinated = np.arange(number_of_vaccines) == VaccineGroup.V.value  # [vaccine]
+            vaccine_effectiveness_hosp = np.asarray(key[0])[:, None] * vaccinated
+            self._IS_to_H_by_VE[key] = self._IS_to_H_base * (1 - vaccine_effectiveness_hosp)[:, None, :]
+        return self._IS_to_H_by_VE[key]
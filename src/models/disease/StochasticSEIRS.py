@@ -6,6 +6,7 @@ from typing import Type
 from baseclasses.Group import Group, RiskGroup, VaccineGroup
 from baseclasses.Node import Node
 from models.disease.DiseaseModel import DiseaseModel
+from models.disease.TauLeaping import adaptive_tau_leap
 from models.treatments.Vaccination import Vaccination
 
 logger = logging.getLogger(__name__)
@@ -47,8 +48,45 @@ def SEIRS_model(y, transmission_rate, sigma, gamma, omega, rng):
 
     return np.array([dS_dt, dE_dt, dI_dt, dR_dt])
 
+def SEIRS_model_vectorized(y, transmission_rate, sigma, gamma, omega, rng):
+    """
+    SEIRS_model for many groups at once, e.g. every [node][age][risk][vaccine] group. Each
+    transition is a single Poisson draw over all groups, capped the same way as SEIRS_model.
+    Parameters:
+        y (np.ndarray): compartments [S, E, I, R] on the last axis
+        transmission_rate, sigma, gamma, omega: as in SEIRS_model, scalars or arrays that
+                                                broadcast against y[..., 0]
+        rng (Generator): random number generator
+    Returns:
+        np.ndarray: derivatives with the shape of y
+    """
+    # ensure integer state for stochastic model
+    S, E, I, R = np.moveaxis(np.trunc(np.asarray(y, dtype=float)), -1, 0)
+
+    # Prevent compartments from going negative by only removing as many people remain in the compartment
+    max_new_infections = np.minimum(rng.poisson(np.maximum(transmission_rate, 0.0) * S), S)
+    e_to_i  = np.minimum(rng.poisson(max(sigma, 0.0) * E), E)
+    i_to_r  = np.minimum(rng.poisson(max(gamma, 0.0) * I), I)
+    r_to_s  = np.minimum(rng.poisson(max(omega, 0.0) * R), R)
+
+    return np.stack([
+        -max_new_infections + r_to_s,     # dS_dt
+        max_new_infections - e_to_i,      # dE_dt
+        e_to_i - i_to_r,                  # dI_dt
+        i_to_r - r_to_s,                  # dR_dt
+    ], axis=-1)
+
+# SEIRS channels for tau-leaping: S => E, E => I, I => R, R => S
+SEIRS_SOURCE = np.array([0, 1, 2, 3])
+SEIRS_STOICHIOMETRY = np.roll(np.eye(4), 1, axis=1) - np.eye(4)
+SEIRS_ORDER = np.array([2, 1, 2, 1])
+SEIRS_TARGET = np.array([1, 2, 3, 0])
+
 class StochasticSEIRS(DiseaseModel):
 
+    batched_step = True
+    provides_ssa_channels = True
+
     def __init__(self, disease_model:Type[DiseaseModel]): # add antiviral_model
         self.now = disease_model.now
         self.parameters = disease_model.parameters
@@ -73,6 +111,9 @@ class StochasticSEIRS(DiseaseModel):
                 "relative_susceptibility", [1.0] * num_age_grps
             )]
 
+        # one Poisson leap per day, adaptive tau-leaping, or the chain binomial
+        self._read_integrator()
+
         # this isn't used, bc _calculate_beta_w_npi uses the schedule, but has to be initialized
         self.npis_schedule = disease_model.npis_schedule
 
@@ -88,78 +129,58 @@ class StochasticSEIRS(DiseaseModel):
     def simulate(self, node:Type[Node], time: int, vaccine_model:Type[Vaccination]):
         """
         Main simulation logic for stochastic SEIR model.
-        Each group (age, risk, vaccine) is simulated separately via ODE.
+        All groups (age, risk, vaccine) of the node step forward together, one Poisson draw per
+        transition over the [age][risk][vaccine] array.
 
         S = Susceptible, E = Exposed, I = Infectious, R = Recovered
         """
-
-        logger.debug(f'node={node}, time={time}')
-
-        # Need to update the node sense of time to get NPIs to take effect
-        self.now = time
-
-        # Snapshot: all compartments at start of the day so we don't call the updated subgroups
-        compartments_today = {
-            (group.age, group.risk, group.vaccine): np.array(node.compartments.get_compartment_vector_for(group))
-            for group in node.compartments.get_all_groups()
-        }
-
-        # Get the total population of node
-        total_node_pop = node.total_population()
-
-        # beta is set for all age groups by node and day, so calc before loop over groups in node
-        beta_vector = self._calculate_beta_w_npi(node.node_index, node.node_id)
-
-        # focal_group is the group we are simulating forward in time
-        # contacted_group is the group causing disease spread interaction
-        for focal_group in node.compartments.get_all_groups():
-            # print(focal_group)  # e.g. Group object: age=0, risk=0, vaccine=0
-            focal_group_compartments_today = np.array(node.compartments.get_compartment_vector_for(focal_group))
-            if sum(focal_group_compartments_today) == 0:
-                continue  # skip empty groups
-
-            # Determine vaccine effect on focal group susceptibility
-            # 1 is vaccinated subgroup, 0 unvaccinated subgroup
-            if focal_group.vaccine == 1:
-                vaccine_effectiveness = vaccine_model.vaccine_effectiveness[focal_group.age]
-            else:
-                vaccine_effectiveness = 0.0
-
-            #### Get force of infection from each interaction subgroup ####
-            # This is constant in time if we don't have an NPI schedule hitting beta each day
-            transmission_rate = 0
-            for contacted_group in node.compartments.get_all_groups():
-                contact_rate = float(self.parameters.np_contact_matrix[focal_group.age][contacted_group.age])
-                if contact_rate== 0:
-                    continue
-
-                # contacted_group_compartments_today
-                S, E, I, R = compartments_today[(contacted_group.age, contacted_group.risk, contacted_group.vaccine)]
-                infectious_contacted = I
-
-                # infectious_contacted/total_node_pop this captures the fraction of population we need to move from S -> E
-                # NOTE: Maybe an under-weighting if we should be doing age group specific: infectious_age/total_age_pop
-                transmission_rate += beta_vector[contacted_group.age] * contact_rate \
-                                     * (infectious_contacted/total_node_pop)
-            # Apply VE to the susceptible group (focal group)
-            transmission_rate *= (1.0 - vaccine_effectiveness) * self.relative_susceptibility[focal_group.age]
-            #print(f"{node.node_id}, {focal_group}, transmission_rate: {transmission_rate}")
-            transmission_rate = max(transmission_rate, 0) # Can't have negative transmission_rate
-            #transmission_prob = 1.0 - np.exp(-transmission_rate)
-            #print(f"transmission probability: {transmission_prob}")
-
-            model_parameters = (
-                transmission_rate,     # S => E
-                self.sigma,            # E => I
-                self.gamma,            # I => R
-                self.omega             # R => S
-            )
-
-            # Euler's Method solve of the system, can't do integer people
-            daily_change = SEIRS_model(focal_group_compartments_today, *model_parameters, rng=self.rng)
-            compartments_tomorrow = focal_group_compartments_today + daily_change
-            node.compartments.set_compartment_vector_for(focal_group, compartments_tomorrow)
-
+        self._simulate_node_batched(node, time, vaccine_model)
         return
 
-
+    def _advance(self, compartments_today:np.ndarray, beta:np.ndarray, population:np.ndarray,
+                 vaccine_model:Type[Vaccination]) -> np.ndarray:
+        """
+        Step any number of nodes at once, see DiseaseModel.simulate_network
+        """
+        exact = self._exact_nodes(population)
+        if exact.any():
+            return self._advance_exact_split(exact, compartments_today, beta, population, vaccine_model)
+        if self.integrator == 'chain-binomial':
+            return self._chain_binomial_step(compartments_today, beta, population, vaccine_model)
+
+        # the infectious population of each contacted group is I
+        infectious_weights = np.array([0.0, 0.0, 1.0, 0.0])
+        model_parameters = (
+            self._force_of_infection(compartments_today, beta, population, infectious_weights,
+                                     vaccine_model),  # S => E
+            self.sigma,                                # E => I
+            self.gamma,                                # I => R
+            self.omega                                 # R => S
+        )
+
+        if self.integrator == 'tau-leap':
+            def propensities(counts):
+                S, E, I, R = np.moveaxis(counts, -1, 0)
+                transmission_rate = self._force_of_infection(counts, beta, population, infectious_weights,
+                                                             vaccine_model)
+                return np.stack([transmission_rate * S, self.sigma * E, self.gamma * I, self.omega * R], axis=-1)
+
+            # ensure integer state for stochastic model
+            counts = np.trunc(compartments_today)
+            counts_tomorrow, _ = adaptive_tau_leap(counts, propensities, SEIRS_STOICHIOMETRY, SEIRS_SOURCE,
+                                                   SEIRS_ORDER, self.rng, self.tau_epsilon, self.max_substeps)
+            return compartments_today + (counts_tomorrow - counts)
+
+        # Euler's Method solve of the system, can't do integer people
+        daily_change = SEIRS_model_vectorized(compartments_today, *model_parameters, rng=self.rng)
+        return compartments_today + daily_change
+
+    def _ssa_channels(self, compartments_today:np.ndarray, beta:np.ndarray, population:np.ndarray,
+                      vaccine_model:Type[Vaccination]) -> tuple:
+        """
+        The SEIRS channels for the next reaction method, see DiseaseModel._ssa_channels
+        """
+        rates = np.broadcast_to(np.array([1.0, self.sigma, self.gamma, self.omega]),
+                                (*compartments_today.shape[:-1], len(SEIRS_SOURCE)))
+        infection = np.array([True, False, False, False])
+        return rates, SEIRS_SOURCE, SEIRS_TARGET, infection, np.array([0.0, 0.0, 1.0, 0.0])
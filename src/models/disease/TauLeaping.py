@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+import numpy as np
+import logging
+from typing import Callable
+from numpy.random import Generator
+
+logger = logging.getLogger(__name__)
+
+
+def cap_firings(firings:np.ndarray, counts:np.ndarray, source:np.ndarray) -> np.ndarray:
+    """
+    Cap the firings of each channel so no compartment loses more people than it holds.
+    Channels leaving the same compartment are served in order, as in the daily models
+    (e.g. IS -> H first, then IS -> R from the remaining).
+
+    Args:
+        firings (np.ndarray): firings by [..., channel]
+        counts (np.ndarray): people by [..., compartment]
+        source (np.ndarray): source compartment of each channel
+    """
+    firings = firings.copy()
+    remaining = counts.copy()
+    for k, c in enumerate(source):
+        firings[..., k] = np.minimum(firings[..., k], remaining[..., c])
+        remaining[..., c] -= firings[..., k]
+    return firings
+
+
+def select_tau(counts:np.ndarray, propensities:np.ndarray, stoichiometry:np.ndarray, order:np.ndarray,
+               epsilon:float) -> np.ndarray:
+    """
+    Cao-Gillespie-Petzold (2006) step size: the largest tau for which the expected change and
+    standard deviation of every reactant compartment stay within epsilon * count / order of it
+
+    Args:
+        counts (np.ndarray): people by [node, ..., compartment]
+        propensities (np.ndarray): firing rate of each channel by [node, ..., channel]
+        stoichiometry (np.ndarray): change of each compartment per firing by [channel][compartment]
+        order (np.ndarray): highest order of the channels each compartment is a reactant of,
+                            2 for compartments in the force of infection and 1 otherwise
+        epsilon (float): error control parameter, 0.03 is the usual choice
+
+    Returns:
+        np.ndarray: tau of each node, the minimum over its groups and compartments
+    """
+    # only compartments that some channel removes people from limit the step
+    reactant = (stoichiometry < 0).any(axis=0)
+    mean_change = (propensities @ stoichiometry)[..., reactant]
+    variance    = (propensities @ stoichiometry**2)[..., reactant]
+    bound = np.maximum(epsilon * counts[..., reactant] / order[reactant], 1.0)
+    with np.errstate(divide='ignore'):
+        tau = np.minimum(np.where(mean_change != 0, bound / np.abs(mean_change), np.inf),
+                         np.where(variance > 0, bound**2 / variance, np.inf))
+    return tau.reshape(tau.shape[0], -1).min(axis=1)
+
+
+def adaptive_tau_leap(counts:np.ndarray, propensity_function:Callable, stoichiometry:np.ndarray,
+                      source:np.ndarray, order:np.ndarray, rng:Generator, epsilon:float=0.03,
+                      max_substeps:int=64) -> tuple:
+    """
+    Advance integer compartments by one day with adaptive tau-leaping. Every node takes its
+    own steps: several on days with high propensities, a single one on quiet days. All groups
+    and nodes are leapt together, one Poisson draw per channel and sub-step. A node whose leap
+    would empty a compartment below zero retries with half the step, down to 1 / max_substeps,
+    where the firings are capped as in the daily models instead.
+
+    Args:
+        counts (np.ndarray): people by [node, ..., compartment]
+        propensity_function (Callable): maps counts to the firing rate of each channel by
+                                        [node, ..., channel]
+        stoichiometry (np.ndarray): change of each compartment per firing by [channel][compartment]
+        source (np.ndarray): compartment each channel removes people from
+        order (np.ndarray): see select_tau
+        rng (Generator): random number generator
+        epsilon (float): error control parameter of the step selection
+        max_substeps (int): the shortest step is 1 / max_substeps days
+
+    Returns:
+        tuple: (counts one day later, number of accepted sub-steps per node)
+    """
+    counts = np.array(counts, dtype=float)
+    number_of_nodes = counts.shape[0]
+    shortest = 1.0 / max_substeps
+    elapsed   = np.zeros(number_of_nodes)
+    substeps  = np.zeros(number_of_nodes, dtype=int)
+    tau_limit = np.ones(number_of_nodes)   # halved for a node after a rejected leap
+    expand = (slice(None),) + (None,) * (counts.ndim - 1)
+
+    while np.any(elapsed < 1.0 - 1e-12):
+        active = elapsed < 1.0 - 1e-12
+        propensities = propensity_function(counts)
+        tau = select_tau(counts, propensities, stoichiometry, order, epsilon)
+        tau = np.clip(np.minimum(tau, tau_limit), shortest, None)
+        tau = np.where(active, np.minimum(tau, 1.0 - elapsed), 0.0)
+
+        firings = rng.poisson(propensities * tau[expand])
+        leapt = counts + firings @ stoichiometry
+        negative = (leapt < 0).reshape(number_of_nodes, -1).any(axis=1)
+
+        # retry the nodes that overshot with a shorter step, unless already at the shortest
+        retry = negative & (tau > shortest * (1 + 1e-9))
+        capped = negative & ~retry
+        if capped.any():
+            firings[capped] = cap_firings(firings[capped], counts[capped], source)
+            leapt[capped] = counts[capped] + firings[capped] @ stoichiometry
+        accept = active & ~retry
+        counts[accept] = leapt[accept]
+        elapsed[accept] += tau[accept]
+        substeps[accept] += 1
+        tau_limit = np.where(retry, tau / 2, 1.0)
+
+    logger.debug(f'tau leaping took {substeps.mean():.2f} sub-steps per node, at most {substeps.max()}')
+    return counts, substeps
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+import numpy as np
+import logging
+from typing import Type
+
+from baseclasses.Group import Group, RiskGroup, VaccineGroup, stage_label
+from baseclasses.Network import Network
+from baseclasses.Node import Node
+from models.disease.ChainBinomial import chain_binomial
+from models.disease.DiseaseModel import DiseaseModel
+from models.disease.StochasticSEIHRD import estimate_baseline_beta
+from models.treatments.Vaccination import Vaccination
+
+logger = logging.getLogger(__name__)
+
+# rate keyword of transitions driven by the force of infection
+INFECTION = 'infection'
+
+
+def group_array(value, number_of_age_groups:int) -> np.ndarray:
+    """
+    Broadcast a parameter from the input file to [age][risk][vaccine]
+
+    Args:
+        value: a scalar, a list with one value per age group, or a list with one such list
+               per risk group, e.g. [[low risk by age], [high risk by age]]
+        number_of_age_groups (int): number of age groups
+
+    Returns:
+        np.ndarray: the parameter with shape [age][risk][vaccine]
+    """
+    shape = (number_of_age_groups, len(RiskGroup), len(VaccineGroup))
+    array = np.asarray(value, dtype=float)
+    if array.ndim == 0:
+        return np.full(shape, float(array))
+    if array.shape == (number_of_age_groups,):
+        return np.broadcast_to(array[:, None, None], shape).copy()
+    if array.shape == (len(RiskGroup), number_of_age_groups):
+        return np.broadcast_to(array.T[:, :, None], shape).copy()
+    raise ValueError(f'expected a scalar, {number_of_age_groups} values by age, or {len(RiskGroup)} lists '
+                     f'by risk of {number_of_age_groups} values by age, got {value}')
+
+
+def compartment_stages(transitions:list) -> dict:
+    """
+    Number of sub-stages of each compartment, from the `stages` of the transitions out of it.
+    Transitions out of the same compartment share its stages, so they must not disagree.
+
+    Returns:
+        dict: {compartment label: stages} for the compartments with more than one stage
+    """
+    stages = {}
+    for transition in transitions:
+        if 'stages' not in transition:
+            continue
+        label = str(transition['from']).strip().upper()
+        number_of_stages = int(transition['stages'])
+        if number_of_stages < 1:
+            raise ValueError(f'stages of the transition from {label} must be at least 1, got {number_of_stages}')
+        if str(transition.get('rate', '')).lower() == INFECTION:
+            raise ValueError(f'the infection transition from {label} cannot have stages')
+        if stages.get(label, number_of_stages) != number_of_stages:
+            raise ValueError(f'transitions from {label} declare {stages[label]} and {number_of_stages} stages')
+        stages[label] = number_of_stages
+    return {label: number_of_stages for label, number_of_stages in stages.items() if number_of_stages > 1}
+
+
+def staged_compartments(compartments:list, transitions:list) -> list:
+    """
+    Compartment labels with the sub-stages of each staged compartment right after it, e.g.
+    [S, E, E_2, E_3, I, R] for an E with 3 stages, see Group.stage_label
+    """
+    stages = compartment_stages(transitions)
+    labels = [str(c).strip().upper() for c in compartments]
+    for label in stages:
+        if label not in labels:
+            raise ValueError(f'compartment "{label}" is not in {labels}')
+    return [stage_label(label, stage) for label in labels for stage in range(1, stages.get(label, 1) + 1)]
+
+
+class TransitionGraph:
+
+    def __init__(self, compartments:list, transitions:list, infectiousness:dict, number_of_age_groups:int):
+        """
+        Compile transitions declared in the input file into arrays. Each entry of transitions is
+        a dictionary with
+            from: source compartment
+            to: target compartment, or a list of targets split by `split`
+            rate / days: rate per day, or mean days before leaving (rate = 1/days); a scalar, a
+                         list by age, or lists by [risk][age]. rate "infection" is the force of
+                         infection, optionally scaled by `susceptibility`
+            split: with a list of targets, the fraction going to each target (scalar or by age)
+            high_risk_multiplier: scales the rate of the high risk groups
+            vaccine_effectiveness: name of a Vaccination attribute by age, e.g.
+                                   "vaccine_effectiveness_hosp", reducing the rate of vaccinated groups
+            stages: Erlang distributed time in the source compartment instead of exponential, by
+                    the linear chain trick: the compartment becomes `stages` sub-stages in a row,
+                    each left at stages times the total exit rate, and the transition leaves the
+                    last one. The mean time and the splits stay the same.
+        Transitions out of the same compartment compete.
+
+        Args:
+            compartments (list): compartment labels, in the order of the compartment data
+            transitions (list): transitions as described above
+            infectiousness (dict): relative infectiousness of each infectious compartment
+            number_of_age_groups (int): number of age groups
+        """
+        self.stages = compartment_stages(transitions)
+        self.compartments = staged_compartments(compartments, transitions)
+        self.index = {label: i for i, label in enumerate(self.compartments)}
+        self.number_of_age_groups = number_of_age_groups
+
+        sources, targets, rates, infection, vaccine_attributes = [], [], [], [], []
+        for transition in transitions:
+            # a staged compartment is left from its last sub-stage
+            label = str(transition['from']).strip().upper()
+            number_of_stages = self.stages.get(label, 1)
+            source = self._compartment_index(stage_label(label, number_of_stages))
+            to = transition['to'] if isinstance(transition['to'], list) else [transition['to']]
+            split = transition.get('split', [1.0] * len(to))
+            if len(split) != len(to):
+                raise ValueError(f'transition from {transition["from"]} has {len(to)} targets and {len(split)} splits')
+            split = [group_array(s, number_of_age_groups) for s in split]
+            if not np.allclose(sum(split), 1.0):
+                raise ValueError(f'split of the transition from {transition["from"]} does not add up to 1')
+
+            if str(transition.get('rate', '')).lower() == INFECTION:
+                rate = group_array(transition.get('susceptibility', 1.0), number_of_age_groups)
+                is_infection = True
+            elif 'rate' in transition:
+                rate = group_array(transition['rate'], number_of_age_groups)
+                is_infection = False
+            elif 'days' in transition:
+                rate = 1.0 / group_array(transition['days'], number_of_age_groups)
+                is_infection = False
+            else:
+                raise ValueError(f'transition from {transition["from"]} needs a rate or days')
+            rate[:, RiskGroup.H.value, :] *= float(transition.get('high_risk_multiplier', 1.0))
+            rate *= number_of_stages
+
+            for target, fraction in zip(to, split):
+                sources.append(source)
+                targets.append(self._compartment_index(target))
+                rates.append(rate * fraction)
+                infection.append(is_infection)
+                vaccine_attributes.append(transition.get('vaccine_effectiveness'))
+
+        # progression through the sub-stages, at the total exit rate of the last one, which
+        # depends on the group and vaccine like the exits do
+        stage_exits = []
+        for label, number_of_stages in self.stages.items():
+            last = self._compartment_index(stage_label(label, number_of_stages))
+            exits = [k for k, source in enumerate(sources) if source == last]
+            for stage in range(1, number_of_stages):
+                sources.append(self._compartment_index(stage_label(label, stage)))
+                targets.append(self._compartment_index(stage_label(label, stage + 1)))
+                rates.append(sum(rates[k] for k in exits))
+                infection.append(False)
+                vaccine_attributes.append(None)
+                stage_exits.append(exits)
+
+        if not any(infection):
+            raise ValueError('transitions need at least one transition with rate "infection"')
+        if np.any(np.array(sources) == np.array(targets)):
+            raise ValueError('a transition cannot go from a compartment to itself')
+
+        self.source    = np.array(sources, dtype=int)                    # [transition]
+        self.target    = np.array(targets, dtype=int)                    # [transition]
+        self.rate      = np.moveaxis(np.array(rates), 0, -1)             # [age][risk][vaccine][transition]
+        self.infection = np.array(infection, dtype=bool)                 # [transition]
+        self.vaccine_attributes = vaccine_attributes
+        # stage progressions and, by [transition][progression], the exits whose rates they add up
+        self.progression = np.arange(len(sources) - len(stage_exits), len(sources))
+        self.progression_exits = np.zeros((len(sources), len(stage_exits)))
+        for i, exits in enumerate(stage_exits):
+            self.progression_exits[exits, i] = 1.0
+
+        # stoichiometry: a flow along a transition leaves its source and enters its target
+        self.stoichiometry = np.zeros((len(self.source), len(self.compartments)))
+        self.stoichiometry[np.arange(len(self.source)), self.source] = -1.0
+        self.stoichiometry[np.arange(len(self.source)), self.target] = 1.0
+
+        # transitions grouped by source compartment, drawn as competing risks
+        self.outflows = [(c, np.flatnonzero(self.source == c)) for c in np.unique(self.source)]
+
+        self.infectious_weights = np.zeros(len(self.compartments))
+        for label, weight in infectiousness.items():
+            label = str(label).strip().upper()
+            for stage in range(1, self.stages.get(label, 1) + 1):
+                self.infectious_weights[self._compartment_index(stage_label(label, stage))] = float(weight)
+        if not self.infectious_weights.any():
+            raise ValueError('infectiousness needs at least one infectious compartment')
+
+        logger.info(f'compiled {len(self.source)} transitions over compartments {self.compartments}')
+        return
+
+
+    def _compartment_index(self, label:str) -> int:
+        label = str(label).strip().upper()
+        if label not in self.index:
+            raise ValueError(f'compartment "{label}" is not in {self.compartments}')
+        return self.index[label]
+
+
+    def infectious_days(self) -> np.ndarray:
+        """
+        Expected infectiousness-weighted days of one infection by age: the time spent in each
+        compartment after the first infection transition, for an unvaccinated low risk person,
+        weighted by the relative infectiousness of the compartment
+
+        Returns:
+            np.ndarray: the weight w of each age group in the next generation matrix
+        """
+        first = np.flatnonzero(self.infection)[0]
+        infection_sources = set(self.source[self.infection].tolist())
+        # compartments passed through after infection, until recovery, death or susceptibility again
+        transient = [c for c in range(len(self.compartments)) if c not in infection_sources]
+        position = {c: i for i, c in enumerate(transient)}
+
+        weights = np.zeros(self.number_of_age_groups)
+        for age in range(self.number_of_age_groups):
+            rates = self.rate[age, RiskGroup.L.value, VaccineGroup.U.value]
+            generator = np.zeros((len(transient), len(transient)))
+            for k in np.flatnonzero(~self.infection):
+                if self.source[k] not in position:
+                    continue
+                i = position[self.source[k]]
+                generator[i, i] += rates[k]
+                if self.target[k] in position:
+                    generator[i, position[self.target[k]]] -= rates[k]
+            entry = np.zeros(len(transient))
+            entry[position[self.target[first]]] = 1.0
+            infectious = self.infectious_weights[transient]
+            # an infectious compartment nobody leaves would be infectious forever
+            stuck = (np.diag(generator) == 0) & (infectious > 0)
+            if stuck.any():
+                raise ValueError(f'infectious compartment {self.compartments[transient[np.flatnonzero(stuck)[0]]]} '
+                                 f'has no transition out of it')
+            reachable = np.diag(generator) > 0
+            days = np.zeros(len(transient))
+            days[reachable] = np.linalg.solve(generator[np.ix_(reachable, reachable)].T, entry[reachable])
+            weights[age] = days @ infectious
+        return weights
+
+
+class TransitionGraphModel(DiseaseModel):
+
+    batched_step = True
+
+    def __init__(self, disease_model:Type[DiseaseModel], stochastic:bool=True):
+        """
+        Compartmental model whose transitions, competing-risk splits, rates and infectiousness
+        are declared in the input file, see TransitionGraph. Every model declared this way runs
+        on the batched network-wide step, deterministic or stochastic.
+        """
+        self.now = disease_model.now
+        self.parameters = disease_model.parameters
+        self.stochastic = stochastic
+        num_age_grps = self.parameters.number_of_age_groups
+
+        self.graph = TransitionGraph(self.parameters.disease_parameters['compartments'],
+                                     self.parameters.disease_parameters['transitions'],
+                                     self.parameters.disease_parameters['infectiousness'],
+                                     num_age_grps)
+
+        # Relative susceptibility required for travel model, make 1's if not specified
+        self.relative_susceptibility = [
+            float(x) for x in self.parameters.disease_parameters.get(
+                "relative_susceptibility", [1.0] * num_age_grps
+            )]
+
+        # `beta` is a required name for _calculate_beta_w_npi
+        # given directly, or estimated from R0 with the next generation matrix
+        if 'beta' in self.parameters.disease_parameters:
+            self.beta = float(self.parameters.disease_parameters['beta'])
+        else:
+            self.R0 = float(self.parameters.disease_parameters['R0'])
+            self.beta = estimate_baseline_beta(self.parameters.np_contact_matrix, self.R0,
+                                               self.graph.infectious_days(), self.relative_susceptibility)
+        logger.info(f'baseline beta is {self.beta}')
+
+        # shorter steps for compartments, or sub-stages, left in less than a day
+        self.steps_per_day = int(self.parameters.disease_parameters.get('steps_per_day', 1))
+        if self.steps_per_day < 1:
+            raise ValueError(f'steps_per_day must be at least 1, got {self.steps_per_day}')
+
+        # this isn't used, bc _calculate_beta_w_npi uses the schedule
+        self.npis_schedule = disease_model.npis_schedule
+
+        logger.info(f'instantiated TransitionGraphModel object, stochastic={self.stochastic}, '
+                    f'steps_per_day={self.steps_per_day}')
+        logger.debug(f'{self.parameters}')
+        return
+
+    def expose_number_of_people(self, node:Type[Node], group:Type[Group], num_to_expose:int, vaccine_model:Type[Vaccination]):
+        # this is a bulk transfer of people to move from S to E by group
+        node.compartments.expose_number_of_people_bulk(group, num_to_expose)
+        return
+
+    def simulate(self, node:Type[Node], time: int, vaccine_model:Type[Vaccination]):
+        """
+        Main simulation logic for a declared transition graph.
+        All groups (age, risk, vaccine) of the node step forward together.
+        """
+        self._simulate_node_batched(node, time, vaccine_model)
+        return
+
+    def activity_compartments(self, network:Type[Network]) -> list:
+        """
+        Sources of the transitions not driven by infection, e.g. R when immunity wanes
+        """
+        spontaneous = ~self.graph.infection & (self.graph.rate > 0).reshape(-1, len(self.graph.source)).any(axis=0)
+        return sorted(set(self.graph.source[spontaneous].tolist()))
+
+    def _advance(self, compartments_today:np.ndarray, beta:np.ndarray, population:np.ndarray,
+                 vaccine_model:Type[Vaccination]) -> np.ndarray:
+        """
+        Step any number of nodes at once, see DiseaseModel.simulate_network
+        """
+        dt = 1.0 / self.steps_per_day
+        compartments = compartments_today
+        for _ in range(self.steps_per_day):
+            rates = self._transition_rates(compartments, beta, population, vaccine_model)
+            if self.stochastic:
+                flows = self._stochastic_flows(compartments, rates, dt)
+            else:
+                flows = self._deterministic_flows(compartments, rates, dt)
+            compartments = compartments + flows @ self.graph.stoichiometry
+        return compartments
+
+    def _transition_rates(self, compartments_today:np.ndarray, beta:np.ndarray, population:np.ndarray,
+                          vaccine_model:Type[Vaccination]) -> np.ndarray:
+        """
+        Rate of every transition by [..., age, risk, vaccine, transition]
+        """
+        graph = self.graph
+        rates = np.broadcast_to(graph.rate, compartments_today.shape[:-1] + graph.rate.shape[-1:]).copy()
+
+        vaccinated = np.arange(compartments_today.shape[-2]) == VaccineGroup.V.value
+        for k, attribute in enumerate(graph.vaccine_attributes):
+            if attribute is not None:
+                effectiveness = np.asarray(getattr(vaccine_model, attribute), dtype=float)[:, None] * vaccinated
+                rates[..., k] *= (1.0 - effectiveness)[:, None, :]
+        if graph.progression.size:
+            rates[..., graph.progression] = rates @ graph.progression_exits
+
+        # force of infection, with VE against infection and relative susceptibility applied
+        force = self._force_of_infection(compartments_today, beta, population, graph.infectious_weights, vaccine_model)
+        rates[..., graph.infection] *= force[..., None]
+        return rates
+
+    def _deterministic_flows(self, compartments_today:np.ndarray, rates:np.ndarray, dt:float=1.0) -> np.ndarray:
+        """
+        Euler flows rate * count * dt; infections use the probability 1 - exp(-rate * dt) as in
+        the deterministic models, and no compartment loses more people than it holds
+        """
+        graph = self.graph
+        counts = compartments_today[..., graph.source]
+        per_capita = np.where(graph.infection, -np.expm1(-rates * dt), rates * dt)
+        flows = per_capita * counts
+        for c, transitions in graph.outflows:
+            leaving = flows[..., transitions].sum(axis=-1)
+            scale = np.divide(compartments_today[..., c], leaving, out=np.ones_like(leaving),
+                              where=leaving > compartments_today[..., c])
+            flows[..., transitions] *= scale[..., None]
+        return flows
+
+    def _stochastic_flows(self, compartments_today:np.ndarray, rates:np.ndarray, dt:float=1.0) -> np.ndarray:
+        """
+        Chain binomial flows: the people of each compartment leave it with probability
+        1 - exp(-total rate * dt) and pick one of its competing transitions in proportion to
+        their rates, one multinomial draw per compartment for every group at once, see ChainBinomial
+        """
+        # ensure integer state for stochastic model
+        return chain_binomial(np.trunc(compartments_today), rates, self.graph.source, self.rng, dt)
@@ -5,12 +5,13 @@ import numpy as np
 from typing import Type
 
 from .TravelModel import TravelModel
+from .TravelAttribution import TravelAttribution
 from models.disease.DiseaseModel import DiseaseModel
 from baseclasses.Group import RiskGroup, VaccineGroup, Compartments, Group
 from baseclasses.ModelParameters import ModelParameters
 from baseclasses.Network import Network
 from baseclasses.Node import Node
-from utils.RNGMath import rand_binomial
+from baseclasses.Writer import Writer
 from models.treatments.Vaccination import Vaccination
 
 logger = logging.getLogger(__name__)
@@ -18,6 +19,8 @@ logger = logging.getLogger(__name__)
 
 class BinomialTravel(TravelModel):
 
+    provides_coupled_force = True
+
     def __init__(self, travel_model:Type[TravelModel]):
         self.parameters = travel_model.parameters
         
@@ -34,15 +37,106 @@ class BinomialTravel(TravelModel):
         if not self.transmit_dict:
             raise ValueError("transmitting_compartments is required but missing or empty")
 
+        # 'vectorized' computes every sink probability at once with matrix products,
+        # 'loop' is the original pairwise sink x source calculation kept as a reference
+        self.engine = str(self.parameters.travel_parameters.get('engine', 'vectorized')).lower()
+        if self.engine not in ('vectorized', 'loop'):
+            raise ValueError(f'travel engine "{self.engine}" not recognized, use "vectorized" or "loop"')
+
+        # Index of active sources: [node][age] traveling and transmitting populations, kept up
+        # to date for the nodes each network-wide disease step advanced, see update_active_sources()
+        self.traveling = None
+        self.transmitting = None
+        self.active_sources = set()
+        self._travel_weights = None
+        self._transmit_weights = None
+
+        # Static age kernels: contact rates with flow_reduction folded in, indexed [source age][sink age];
+        # beta, rho and relative susceptibility are folded in on first use, see _age_kernels()
+        contact        = np.asarray(self.parameters.np_contact_matrix, dtype=float)
+        flow_reduction = np.asarray(self.flow_reduction, dtype=float)
+        self._contact_inward  = contact.T / flow_reduction[None, :]
+        self._contact_outward = contact.T / flow_reduction[:, None]
+        self._age_kernel_cache = (None, None, None)
+
+        # Optional source -> sink record of the daily infection pressure from travel
+        self.attribution = None
+        if str(self.parameters.travel_parameters.get('attribution', 'false')).lower() == 'true':
+            self.attribution = TravelAttribution(self.parameters.number_of_age_groups)
+        self._exposed_sinks = np.array([], dtype=int)
+
         logger.info(f'instantiated a BinomialTravel object: {BinomialTravel}')
         return
 
 
+    def reset_active_sources(self, network:Type[Network]):
+        """
+        Rebuild the active source index from scratch, e.g. at the start of a realization.
+        A source is active if it has a nonzero weighted traveling or transmitting population.
+
+        Args:
+            network (Network): Network object containing list of Nodes
+        """
+        self._travel_weights   = self._compartment_weights(network, self.travel_dict)
+        self._transmit_weights = self._compartment_weights(network, self.transmit_dict)
+        by_age = network.get_compartment_array().sum(axis=(2, 3))  # [node][age][compartment]
+        self.traveling    = by_age @ self._travel_weights
+        self.transmitting = by_age @ self._transmit_weights
+        self.active_sources = set(np.flatnonzero(self.traveling.any(axis=1) | self.transmitting.any(axis=1)).tolist())
+        if self.attribution is not None:
+            self.attribution.reset()
+        logger.debug(f'reset active travel sources: {len(self.active_sources)} of {network.get_number_of_nodes()}')
+        return
+
+
+    def update_active_sources(self, network:Type[Network], node_indices:np.ndarray=None):
+        """
+        Refresh the index entries of the nodes a network-wide disease step advanced, or of every
+        node if node_indices is None. The other nodes did not change, so seeding one node only
+        costs its own rows.
+
+        Args:
+            network (Network): Network object containing list of Nodes
+            node_indices (np.ndarray): indices of the nodes whose compartments changed
+        """
+        if self.traveling is None or self.traveling.shape[0] != network.get_number_of_nodes():
+            self.reset_active_sources(network)
+            return
+        node_indices = np.arange(network.get_number_of_nodes()) if node_indices is None \
+                       else np.asarray(node_indices, dtype=int)
+        if node_indices.size == 0:
+            return
+
+        by_age = network.get_compartment_array(node_indices).sum(axis=(2, 3))  # [node][age][compartment]
+        self.traveling[node_indices]    = by_age @ self._travel_weights
+        self.transmitting[node_indices] = by_age @ self._transmit_weights
+        active = self.traveling[node_indices].any(axis=1) | self.transmitting[node_indices].any(axis=1)
+        self.active_sources.difference_update(node_indices[~active].tolist())
+        self.active_sources.update(node_indices[active].tolist())
+        return
+
+
+    def write_attribution(self, writer:Type[Writer], network:Type[Network], final:bool=False):
+        """
+        Write the buffered source -> sink attribution once the buffer fills up, or at the end
+        of the realization when final is True
+
+        Args:
+            writer (Writer): output writer of this realization
+            network (Network): Network object containing list of Nodes
+            final (bool): write whatever is buffered
+        """
+        if self.attribution is not None and (final or self.attribution.full()):
+            self.attribution.flush(writer, network)
+        return
+
+
     def travel(self, network:Type[Network], disease_model:Type[DiseaseModel], parameters:Type[ModelParameters], time:int,
                vaccine_model:Type[Vaccination]):
         """
         Simulate travel between nodes. "Sink" refers to the Node where people travel to; "Source"
-        refers to the Node where people travel from.
+        refers to the Node where people travel from. Only active sources, and the sinks reachable
+        from them through the flow matrix, are evaluated.
 
         Args:
             network (Network): Network object containing list of Nodes
@@ -53,28 +147,88 @@ class BinomialTravel(TravelModel):
         logging.debug('entered the travel function')
         logging.debug(f'network.nodes len = {len(network.nodes)} first_val = {network.nodes[0].node_id}')
 
+        # Pick up the scheduled flow matrix for today, if flows vary over time
+        network.update_travel_flow(time)
+
+        if self.traveling is None or self.traveling.shape[0] != network.get_number_of_nodes():
+            self.reset_active_sources(network)
+        if not self.active_sources:
+            logging.debug('no active travel sources today')
+            self._clear_travel_exposure(network)
+            return
+
+        terms = self._source_terms(parameters, network, disease_model)
+        if self.attribution is not None:
+            self._record_attribution(network, time, terms)
+
+        if self.engine == 'vectorized':
+            network_probabilities = self._calculate_network_flow_probabilities(parameters, network, disease_model,
+                                                                               terms)
+            self._expose_from_travel(parameters, network, network_probabilities, disease_model, vaccine_model)
+            return
+
+        # Only visit sources with a stored (nonzero) flow to or from the sink
+        kernels = network.get_travel_kernels()
+        flow_by_row, flow_by_column = kernels.flow_by_row, kernels.flow_by_column
+
+        network_probabilities = np.zeros((network.get_number_of_nodes(), parameters.number_of_age_groups))
         for node_sink_id, node_sink in enumerate(network.nodes):
-            probabilities = [0.0] * parameters.number_of_age_groups
+            probabilities = network_probabilities[node_sink_id]   # a view, updated in place
 
-            for node_source_id, node_source in enumerate(network.nodes):
-                if node_sink_id != node_source_id:
+            connected_sources = np.union1d(
+                flow_by_row.indices[flow_by_row.indptr[node_sink_id]:flow_by_row.indptr[node_sink_id+1]],
+                flow_by_column.indices[flow_by_column.indptr[node_sink_id]:flow_by_column.indptr[node_sink_id+1]])
+
+            for node_source_id in connected_sources:
+                node_source_id = int(node_source_id)
+                node_source = network.nodes[node_source_id]
+                if node_sink_id != node_source_id and node_source_id in self.active_sources:
                     self._calculate_flow_probability(parameters, network, node_sink, node_sink_id,
                                                      node_source, node_source_id, probabilities,
                                                      disease_model)
-                    logging.debug(f'probabilities = {probabilities}')
+                    logging.debug('probabilities = %s', probabilities)
 
-            self._expose_from_travel(parameters, node_sink, probabilities, disease_model, vaccine_model)
+        self._expose_from_travel(parameters, network, network_probabilities, disease_model, vaccine_model)
         return
 
 
+    def coupled_force(self, network:Type[Network], time:int, disease_model:Type[DiseaseModel]):
+        """
+        Return today's travel force of infection as a function of the compartments, for disease
+        models that integrate travel in their right-hand side instead of calling travel(). The
+        function maps compartments by [node][age][risk][vaccine][compartment] to the same
+        infection pressure by [sink node][age] as _calculate_network_flow_probabilities, read
+        as a rate per day, with every node a source.
+
+        Args:
+            network (Network): Network object containing list of Nodes and travel kernels
+            time (int): the current day
+            disease_model (DiseaseModel): provides beta and relative susceptibility
+        """
+        network.update_travel_flow(time)
+        if self._travel_weights is None:
+            self.reset_active_sources(network)
+        kernels = network.get_travel_kernels()
+        age_inward, age_outward = self._age_kernels(disease_model)
+        inward  = self._transmit_weights[:, None, None] * age_inward[None, :, :]   # [compartment][source age][sink age]
+        outward = self._travel_weights[:, None, None] * age_outward[None, :, :]
+
+        def force(compartments:np.ndarray) -> np.ndarray:
+            by_age = compartments.sum(axis=(-3, -2))   # [node][age][compartment]
+            return kernels.inward_product(np.einsum('nac,cab->nb', by_age, inward)) \
+                   + kernels.outward_product(np.einsum('nac,cab->nb', by_age, outward))
+        return force
+
+
     def _calculate_flow_probability(self, parameters:Type[ModelParameters], network:Type[Network], node_sink:Type[Node],
                                     node_sink_id:int, node_source:Type[Node], node_source_id:int, probabilities:list,
                                     disease_model:Type[DiseaseModel]):
         """
         Given a pair of nodes, (1) identify whether travel happens between the nodes (based on
-        travel flow data), (2) if so, iterate over all pairs of age groups, (3) calculate number
-        of infectious contacts that happen, (4) add those contacts as a fraction of total
-        population to probabilities[].
+        travel flow data), (2) if so, calculate the number of infectious contacts between every
+        pair of age groups, (3) add those contacts as a fraction of total population to
+        probabilities[]. The age pairs are one product of the source's [age] traveling and
+        transmitting populations with the static age kernels, see __init__.
 
         Args:
             parameters (ModelParameters): run parameters
@@ -83,80 +237,152 @@ class BinomialTravel(TravelModel):
             node_sink_id (int): index for sink Node
             node_source (Node): travel origin
             node_source_id (int): index for source Node
-            probabilities (list): probability of transmission by age
+            probabilities (list): probability of transmission by age, updated in place
         """
-        flow_sink_to_source = network.travel_flow_data[node_sink_id][node_source_id]
-        flow_source_to_sink = network.travel_flow_data[node_source_id][node_sink_id]
+        flow = network.get_travel_kernels().flow_by_row
+        flow_sink_to_source = self._flow_entry(flow, node_sink_id, node_source_id)
+        flow_source_to_sink = self._flow_entry(flow, node_source_id, node_sink_id)
 
         if flow_sink_to_source > 0 or flow_source_to_sink > 0:
 
-            logging.debug(f'flow happening; sink id = {node_sink_id}, source id = {node_source_id}')
-            logging.debug(f'flow sink value = {flow_sink_to_source}, flow source value = {flow_source_to_sink}')
-
-            for ag1 in range(parameters.number_of_age_groups):
-                number_of_infectious_contacts_sink_to_source = 0
-                number_of_infectious_contacts_source_to_sink = 0
-                this_sigma = float(disease_model.relative_susceptibility[ag1])
-                this_beta_baseline = disease_model.beta
-
-                # TODO incorporate PHA bits to modify value of beta
-                # pha_effectiveness = params.pha_effectiveness (list)
-                # pha_halflife = params.pha_halflife (list)
-                # pha_age = float('inf') if time < parameters.pha_day else time - parameters pha_day
-                #if (PHA_effectiveness.size() > a && PHA_halflife.size() > a && PHA_halflife[a] > 0) {
-                #     beta = BETA_BASELINE * (1.0 - PHA_effectiveness[a] * pow(2, -PHA_age/PHA_halflife[a]) );
-                beta = this_beta_baseline
-                #}
-
-                for ag2 in range(parameters.number_of_age_groups):
-                    traveling = node_source.compartments.traveling_population_by_age(ag2, self.travel_dict)
-                    transmitting = node_source.compartments.transmitting_population_by_age(ag2, self.transmit_dict) # asymptomatic, treatable, and infectious
-                    contact_rate = parameters.np_contact_matrix[ag1][ag2] # age group to age group contacts
-                    logging.debug(f'traveling = {traveling}, transmitting = {transmitting}, contact_rate = {contact_rate}')
-
-                    number_of_infectious_contacts_sink_to_source += transmitting * beta * self.rho * contact_rate \
-                                                                    * this_sigma / self.flow_reduction[ag1]
-                    number_of_infectious_contacts_source_to_sink += traveling * beta * self.rho * contact_rate \
-                                                                    * this_sigma / self.flow_reduction[ag2]
-
-
-                probabilities[ag1] += flow_sink_to_source * number_of_infectious_contacts_sink_to_source \
-                                                   / node_source.total_population()
-                probabilities[ag1] += flow_source_to_sink * number_of_infectious_contacts_source_to_sink \
-                                                   / node_sink.total_population()
+            logging.debug('flow happening; sink id = %s, source id = %s', node_sink_id, node_source_id)
+            logging.debug('flow sink value = %s, flow source value = %s', flow_sink_to_source, flow_source_to_sink)
+
+            # TODO incorporate PHA bits to modify value of beta
+            # pha_effectiveness = params.pha_effectiveness (list)
+            # pha_halflife = params.pha_halflife (list)
+            # pha_age = float('inf') if time < parameters.pha_day else time - parameters pha_day
+            #if (PHA_effectiveness.size() > a && PHA_halflife.size() > a && PHA_halflife[a] > 0) {
+            #     beta = BETA_BASELINE * (1.0 - PHA_effectiveness[a] * pow(2, -PHA_age/PHA_halflife[a]) );
+            #}
+            # kernels with scale = beta * rho * relative susceptibility folded in, shared by every pair
+            age_inward, age_outward = self._age_kernels(disease_model)
+
+            # traveling / transmitting population of the source by age, asymptomatic, treatable, and infectious
+            by_age = node_source.compartments.compartment_data.sum(axis=(1, 2))  # [age][compartment]
+            traveling    = by_age @ self._compartment_weights(network, self.travel_dict)
+            transmitting = by_age @ self._compartment_weights(network, self.transmit_dict)
+            logging.debug('traveling = %s, transmitting = %s', traveling, transmitting)
+
+            # contacts of each sink age ag1 with every source age ag2, C[ag1][ag2] / flow_reduction
+            number_of_infectious_contacts_sink_to_source = transmitting @ age_inward
+            number_of_infectious_contacts_source_to_sink = traveling @ age_outward
+
+            probabilities[:] = np.asarray(probabilities, dtype=float) \
+                               + flow_sink_to_source * number_of_infectious_contacts_sink_to_source \
+                                 / node_source.total_population() \
+                               + flow_source_to_sink * number_of_infectious_contacts_source_to_sink \
+                                 / node_sink.total_population()
         return
 
 
-    def _expose_from_travel(self, parameters:Type[ModelParameters], node_sink:Type[Node], 
-                            probabilities:list, disease_model:Type[DiseaseModel],
-                            vaccine_model:Type[Vaccination]):
+    @staticmethod
+    def _flow_entry(flow, row:int, column:int) -> float:
+        """
+        One entry of a CSR flow matrix, found by bisection in its row instead of through the
+        much slower generic sparse indexing
         """
-        For each age group, risk group, and vaccine group in the sink Node, use a binomial function
-        to determine the actual number of exposures in the Susceptible compartments. Expose those
-        people using the Disease Model.
+        if not flow.has_sorted_indices:
+            flow.sort_indices()
+        start, end = flow.indptr[row], flow.indptr[row + 1]
+        position = start + np.searchsorted(flow.indices[start:end], column)
+        if position < end and flow.indices[position] == column:
+            return float(flow.data[position])
+        return 0.0
+
+
+    def _calculate_network_flow_probabilities(self, parameters:Type[ModelParameters], network:Type[Network],
+                                              disease_model:Type[DiseaseModel], terms:tuple=None) -> np.ndarray:
+        """
+        Vectorized equivalent of calling _calculate_flow_probability for every sink/source pair.
+        Both directions of travel are products of the active source columns of the precomputed
+        network travel kernels with the per-source terms of _source_terms(), so the daily cost
+        scales with the flows touching active sources.
 
         Args:
             parameters (ModelParameters): run parameters
-            node_sink (Node): travel destination
-            probabilities (list): probability of transmission by age
-            disease_model (DiseaseModel): Model used for exposing new people following travel
+            network (Network): Network object containing list of nodes and travel kernels
+            disease_model (DiseaseModel): provides beta and relative susceptibility
+            terms (tuple): output of _source_terms(), computed here if not given
+
+        Returns:
+            np.ndarray: probability of transmission with shape [sink node][age]
         """
-        for ag in range(parameters.number_of_age_groups):
-            for rg in range(len(RiskGroup)):
-                for vg in range(len(VaccineGroup)):
-                    prob = ((1-vaccine_model.vaccine_effectiveness[ag]) * probabilities[ag]) \
-                        if vg == VaccineGroup.V.value else probabilities[ag]
-                    
-                    # TODO what is this continuity correction (+ 0.5)?
-                    sink_S = int( node_sink.compartments.compartment_data[ag][rg][vg][Compartments.S.value] + 0.5 )
-                    prob=max(min(prob,1.0), 0.0)
-                    number_of_exposures = rand_binomial(sink_S, prob)
-                    if number_of_exposures > 1:
-                        logging.debug(f'susceptible people in sink = {sink_S}, probability = {prob}, '
-                                      f'number_of_exposures = {number_of_exposures}')
-                        
-                    group = Group(ag, rg, vg)
-                    disease_model.expose_number_of_people(node_sink, group, number_of_exposures, vaccine_model)
-        return
+        if terms is None:
+            terms = self._source_terms(parameters, network, disease_model)
+        sources, inward, outward = terms
+
+        probabilities = np.zeros((network.get_number_of_nodes(), parameters.number_of_age_groups))
+        if sources.size == 0:
+            return probabilities
+
+        kernels = network.get_travel_kernels()
+        probabilities += kernels.inward_columns(sources) @ inward
+        probabilities += kernels.outward_columns(sources) @ outward
+        return probabilities
 
-    
\ No newline at end of file
+
+    def _source_terms(self, parameters:Type[ModelParameters], network:Type[Network],
+                      disease_model:Type[DiseaseModel]) -> tuple:
+        """
+        Per active source, the infection pressure by age of the sink residents per unit of kernel
+
+        Returns:
+            tuple: (sources, inward [source][age], outward [source][age]) where the pressure on sink i
+                   from source j is kernels.inward[i][j] * inward[j] + kernels.outward[i][j] * outward[j]
+        """
+        if self.traveling is None or self.traveling.shape[0] != network.get_number_of_nodes():
+            self.reset_active_sources(network)
+
+        sources = np.array(sorted(self.active_sources), dtype=int)
+        age_inward, age_outward = self._age_kernels(disease_model)
+
+        # Sink residents visiting the source, contacting its transmitting population:
+        #   sum_j flow[i][j] / pop[j] * sum_a2 C[a1][a2] * transmitting[j][a2] * scale[a1] / fr[a1]
+        inward = self.transmitting[sources] @ age_inward
+
+        # Travelers from the source visiting the sink, contacting its residents:
+        #   sum_j flow[j][i] / pop[i] * sum_a2 C[a1][a2] * traveling[j][a2] / fr[a2] * scale[a1]
+        outward = self.traveling[sources] @ age_outward
+
+        return sources, inward, outward
+
+
+    def _age_kernels(self, disease_model:Type[DiseaseModel]) -> tuple:
+        """
+        Return the static age kernels with scale = beta * rho * relative susceptibility folded in,
+        cached until beta or the relative susceptibility change
+        """
+        key = (float(disease_model.beta), tuple(float(x) for x in disease_model.relative_susceptibility))
+        if self._age_kernel_cache[0] != key:
+            scale = key[0] * self.rho * np.asarray(key[1])
+            self._age_kernel_cache = (key, self._contact_inward * scale[None, :],
+                                      self._contact_outward * scale[None, :])
+        return self._age_kernel_cache[1], self._age_kernel_cache[2]
+
+
+    def _record_attribution(self, network:Type[Network], time:int, terms:tuple):
+        """
+        Append today's pressure of every active source on each sink it is connected to
+        """
+        sources, inward, outward = terms
+        if sources.size == 0:
+            return
+        kernels = network.get_travel_kernels()
+
+        into = kernels.inward_columns(sources).tocoo()    # sink residents visiting the source
+        out  = kernels.outward_columns(sources).tocoo()   # source residents visiting the sink
+        sink   = np.concatenate([into.row, out.row])
+        source = np.concatenate([into.col, out.col])
+        pressure = np.concatenate([into.data[:, None] * inward[into.col],
+                                   out.data[:, None] * outward[out.col]])
+
+        # the same pair can appear in both directions
+        number_of_nodes = network.get_number_of_nodes()
+        pair, inverse = np.unique(source * number_of_nodes + sink, return_inverse=True)
+        combined = np.zeros((pair.size, pressure.shape[1]))
+        np.add.at(combined, inverse, pressure)
+        keep = combined.any(axis=1)
+        self.attribution.add(time, sources[pair[keep] // number_of_nodes],
+                             pair[keep] % number_of_nodes, combined[keep])
+        return
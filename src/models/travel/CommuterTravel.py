@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+import logging
+import numpy as np
+from scipy import sparse
+from typing import Type
+
+from .TravelModel import TravelModel
+from models.disease.DiseaseModel import DiseaseModel
+from baseclasses.ModelParameters import ModelParameters
+from baseclasses.Network import Network
+from models.treatments.Vaccination import Vaccination
+
+logger = logging.getLogger(__name__)
+
+
+class CommuterTravel(TravelModel):
+
+    provides_coupled_force = True
+    replaces_local_force = True
+
+    def __init__(self, travel_model:Type[TravelModel]):
+        """
+        Home/work mixing: during the day the fraction flow[i][j] of the residents of node i mixes
+        at node j, and the rest of the row (1 - sum_j flow[i][j]) stays at home. The force of
+        infection at each destination is computed over the daytime population for the whole
+        network with sparse matrix products. Each resident then feels the flow-weighted average
+        of the destinations they visit.
+
+        The mixed force is the whole force of infection, so the disease step uses it in place
+        of its local force, with every integrator of the batched step, see coupled_force and
+        DiseaseModel.couple_travel; there is no separate daily travel step, and no travel
+        exposures are reported by node.
+        """
+        self.parameters = travel_model.parameters
+
+        # Read in transmitting compartments & weights
+        self.transmit_dict = self.parameters.travel_parameters.get('transmitting_compartments', {})
+        if not self.transmit_dict:
+            raise ValueError("transmitting_compartments is required but missing or empty")
+
+        self.contact = np.asarray(self.parameters.np_contact_matrix, dtype=float)
+
+        # weight of each compartment in the transmitting population; the force reads the compartments
+        # it is given, so there is no per-node index to keep up to date
+        self._transmit_weights = None
+        self._commute_cache = (None, None)
+
+        logger.info(f'instantiated a CommuterTravel object: {CommuterTravel}')
+        return
+
+
+    def reset_active_sources(self, network:Type[Network]):
+        """
+        Read the transmitting compartment weights for the compartments of the network
+
+        Args:
+            network (Network): Network object containing list of Nodes
+        """
+        self._transmit_weights = self._compartment_weights(network, self.transmit_dict)
+        return
+
+
+    def travel(self, network:Type[Network], disease_model:Type[DiseaseModel], parameters:Type[ModelParameters], time:int,
+               vaccine_model:Type[Vaccination]):
+        """
+        Home/work mixing is applied by the disease step in place of its local force, never after it
+        """
+        raise RuntimeError('the commuter travel model is applied by the disease step, see DiseaseModel.couple_travel')
+
+
+    def coupled_force(self, network:Type[Network], time:int, disease_model:Type[DiseaseModel]):
+        """
+        Return today's home/work mixing force of infection as a function of the compartments. The
+        function maps compartments by [node][age][risk][vaccine][compartment] to the force of
+        infection by [node][age] on the residents of each node, local mixing included, so the
+        disease step uses it in place of its local force. The transmitting compartments take the
+        place of the infectious weights of the disease model, and the NPIs of each destination
+        apply to the contacts made there.
+
+        Args:
+            network (Network): Network object containing list of Nodes and travel kernels
+            time (int): the current day
+            disease_model (DiseaseModel): provides beta with NPIs and relative susceptibility
+        """
+        network.update_travel_flow(time)
+        if self._transmit_weights is None or len(self._transmit_weights) != network.num_disease_compartments:
+            self.reset_active_sources(network)
+        commute, daytime_population = self._commute_matrix(network)
+        beta = disease_model._calculate_beta_w_npi_network(network.get_number_of_nodes())
+        relative_susceptibility = np.asarray(disease_model.relative_susceptibility, dtype=float)
+
+        def force(compartments:np.ndarray) -> np.ndarray:
+            transmitting = compartments.sum(axis=(-3, -2)) @ self._transmit_weights   # [node][age]
+            return self._mixed_force(commute, daytime_population, transmitting, beta, relative_susceptibility)
+        return force
+
+
+    def _mixed_force(self, commute:sparse.csr_matrix, daytime_population:np.ndarray, transmitting:np.ndarray,
+                     beta, relative_susceptibility:np.ndarray) -> np.ndarray:
+        """
+        Force of infection by [node][age] on the residents of each node, averaged over the
+        destinations they visit
+
+        Args:
+            commute (csr_matrix): row-stochastic commuting matrix, see _commute_matrix
+            daytime_population (np.ndarray): population present at each node during the day
+            transmitting (np.ndarray): transmitting population by [node][age] of residence
+            beta: beta, or beta with NPIs by [node][age] of the contacted group at the destination
+            relative_susceptibility (np.ndarray): relative susceptibility by [age]
+        """
+        # infectious present at each destination during the day, and the force of infection there:
+        #   lambda_day[j][a1] = rs[a1] * sum_a2 C[a1][a2] * beta[j][a2] * (sum_i commute[i][j] * I[i][a2]) / N_day[j]
+        daytime_infectious = commute.T @ transmitting
+        daytime_share = daytime_infectious * np.divide(1.0, daytime_population, out=np.zeros_like(daytime_population),
+                                                       where=daytime_population > 0)[:, None]
+        force_at_destination = ((beta * daytime_share) @ self.contact.T) * relative_susceptibility
+
+        # residents average the destinations they visit
+        return commute @ force_at_destination
+
+
+    def _commute_matrix(self, network:Type[Network]) -> tuple:
+        """
+        Row-stochastic commuting matrix: the off-diagonal flow, with the remainder of each row
+        on the diagonal as the residents staying home. Cached per flow matrix,
+        together with the daytime population of every node.
+        """
+        kernels = network.get_travel_kernels()
+        if self._commute_cache[0] is not kernels:
+            away = kernels.flow_by_row
+            home = np.clip(1.0 - np.asarray(away.sum(axis=1)).ravel(), 0.0, 1.0)
+            commute = (away + sparse.diags(home)).tocsr()
+            # rows whose flow adds up to more than one are rescaled to one
+            row_sum = np.asarray(commute.sum(axis=1)).ravel()
+            commute = (sparse.diags(1.0 / np.maximum(row_sum, 1.0)) @ commute).tocsr()
+            daytime_population = commute.T @ network.get_population_array()
+            self._commute_cache = (kernels, (commute, daytime_population))
+            logger.info(f'built commuting matrix with {commute.nnz} entries')
+        return self._commute_cache[1]
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import logging
+import numpy as np
+from typing import Type
+
+from baseclasses.Network import Network
+
+logger = logging.getLogger(__name__)
+
+
+class TravelAttribution:
+
+    def __init__(self, number_of_age_groups:int, capacity:int=65536):
+        """
+        Preallocated COO buffers of the daily source -> sink infection pressure from travel, by age
+        group of the sink residents. Entries are appended with array copies only and written out in
+        bulk once the buffer is full, or at the end of a realization.
+
+        Args:
+            number_of_age_groups (int): number of age groups
+            capacity (int): number of (day, source, sink) entries held before flushing
+        """
+        self.capacity = int(capacity)
+        self.day      = np.zeros(self.capacity, dtype=np.int32)
+        self.source   = np.zeros(self.capacity, dtype=np.int32)
+        self.sink     = np.zeros(self.capacity, dtype=np.int32)
+        self.pressure = np.zeros((self.capacity, number_of_age_groups))
+        self.size = 0
+        self.pending = []   # full buffers waiting for a writer, see add()
+
+        logger.info(f'instantiated TravelAttribution buffer with capacity {self.capacity}')
+        return
+
+
+    def reset(self):
+        """
+        Drop any buffered entries, e.g. at the start of a realization
+        """
+        self.size = 0
+        self.pending = []
+        return
+
+
+    def add(self, day:int, sources:np.ndarray, sinks:np.ndarray, pressure:np.ndarray):
+        """
+        Append the pressure of one day, one entry per (source, sink) pair
+
+        Args:
+            day (int): simulation day
+            sources (np.ndarray): node index of each source
+            sinks (np.ndarray): node index of each sink
+            pressure (np.ndarray): infection pressure by [entry][age of sink residents]
+        """
+        start = 0
+        while start < len(sources):
+            if self.size == self.capacity:
+                self.pending.append(self._take())
+            count = min(len(sources) - start, self.capacity - self.size)
+            end = self.size + count
+            self.day[self.size:end]      = day
+            self.source[self.size:end]   = sources[start:start+count]
+            self.sink[self.size:end]     = sinks[start:start+count]
+            self.pressure[self.size:end] = pressure[start:start+count]
+            self.size = end
+            start += count
+        return
+
+
+    def full(self) -> bool:
+        return self.size == self.capacity or len(self.pending) > 0
+
+
+    def flush(self, writer, network:Type[Network]):
+        """
+        Write every buffered entry through the Writer and empty the buffer
+        """
+        if self.size > 0:
+            self.pending.append(self._take())
+        for day, source, sink, pressure in self.pending:
+            writer.write_travel_attribution(day, source, sink, pressure, network)
+        self.pending = []
+        return
+
+
+    def _take(self) -> tuple:
+        """
+        Copy out the filled part of the buffer and mark it empty
+        """
+        taken = (self.day[:self.size].copy(), self.source[:self.size].copy(),
+                 self.sink[:self.size].copy(), self.pressure[:self.size].copy())
+        self.size = 0
+        return taken
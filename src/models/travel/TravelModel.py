@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 import logging
+import numpy as np
 from typing import Type
 
+from baseclasses.Group import VaccineGroup, Compartments
 from baseclasses.ModelParameters import ModelParameters
 
 logger = logging.getLogger(__name__)
@@ -9,6 +11,14 @@ logger = logging.getLogger(__name__)
 
 class TravelModel:
 
+    # travel models that can give their force of infection as a function of the compartments,
+    # for disease models integrating travel in their right-hand side, see coupled_force
+    provides_coupled_force = False
+
+    # travel models whose coupled force is the whole force of infection, local mixing included,
+    # which the disease step then uses in place of its own local force
+    replaces_local_force = False
+
     def __init__(self, parameters:Type[ModelParameters]):
         self.travel_model = 'parent'
         self.parameters = parameters
@@ -27,10 +37,102 @@ class TravelModel:
         if self.travel_model == 'binomial':
             from .BinomialTravel import BinomialTravel
             return BinomialTravel(self)
+        elif self.travel_model == 'commuter':
+            from .CommuterTravel import CommuterTravel
+            return CommuterTravel(self)
         else:
             raise Exception(f'Travel model "{self.travel_model}" not recognized')
         return
 
 
+    def reset_active_sources(self, network):
+        pass
+
+
+    def update_active_sources(self, network, node_indices=None):
+        pass
+
+
+    def write_attribution(self, writer, network, final=False):
+        pass
+
+
     def travel(self):
-        pass
\ No newline at end of file
+        pass
+
+
+    def coupled_force(self, network, time, disease_model):
+        """
+        Travel force of infection as a function of the compartments. Implemented by the travel
+        models with provides_coupled_force, the only ones DiseaseModel.couple_travel accepts
+        """
+        pass
+
+
+    ###### Shared helpers of the travel models ######
+    def _clear_travel_exposure(self, network):
+        """
+        Zero the travel exposures reported by the sinks of the previous day
+        """
+        for node_index in self._exposed_sinks:
+            network.nodes[node_index].travel_exposure[:] = 0.0
+        self._exposed_sinks = np.array([], dtype=int)
+        return
+
+
+    def _compartment_weights(self, network, compartment_weights:dict[str, float]) -> np.ndarray:
+        """
+        Convert {compartment_label: weight}, e.g. traveling_compartments, into a length-[compartment]
+        vector ordered like the last axis of compartment_data; sub-stages share the weight of
+        their compartment
+        """
+        weights = np.zeros(network.num_disease_compartments)
+        for label, frac in compartment_weights.items():
+            weights[network.comp_stages[label]] += float(frac)
+        return weights
+
+
+    def _expose_from_travel(self, parameters:Type[ModelParameters], network,
+                            network_probabilities:np.ndarray, disease_model, vaccine_model):
+        """
+        For each age group, risk group, and vaccine group of every sink Node, use a binomial
+        distribution to determine the actual number of exposures in the Susceptible compartments.
+        All sinks are drawn at once from the realization's random number generator, then the
+        Disease Model moves the exposed people from S to E.
+
+        Args:
+            parameters (ModelParameters): run parameters
+            network (Network): Network object containing list of Nodes
+            network_probabilities (np.ndarray): probability of transmission by [sink node][age]
+            disease_model (DiseaseModel): Model used for exposing new people following travel
+            vaccine_model (Vaccination): provides vaccine effectiveness against infection
+        """
+        self._clear_travel_exposure(network)
+        sinks = np.flatnonzero(network_probabilities.any(axis=1))
+        if sinks.size == 0:
+            return
+
+        # probability by [sink][age][risk][vaccine]; the vaccinated group is protected by VE
+        probabilities = np.repeat(network_probabilities[sinks, :, None, None], len(VaccineGroup), axis=3)
+        probabilities[..., VaccineGroup.V.value] *= 1.0 - np.asarray(vaccine_model.vaccine_effectiveness, dtype=float)[:, None]
+        probabilities = np.clip(probabilities, 0.0, 1.0)
+
+        # TODO what is this continuity correction (+ 0.5)?
+        susceptible = np.stack([network.nodes[i].compartments.compartment_data[..., Compartments.S.value]
+                                for i in sinks])
+        susceptible = (susceptible + 0.5).astype(np.int64)
+
+        exposures = disease_model.rng.binomial(susceptible, np.broadcast_to(probabilities, susceptible.shape))
+        logging.debug(f'travel exposures = {int(exposures.sum())} across {sinks.size} sinks')
+
+        disease_model.expose_network(network, sinks, exposures, vaccine_model)
+        network.mark_active(sinks[exposures.reshape(sinks.size, -1).any(axis=1)])
+
+        # people exposed by travel today, by age, reported in the node output
+        for row, node_index in enumerate(sinks):
+            network.nodes[node_index].travel_exposure[:] = exposures[row].sum(axis=(1, 2))
+        self._exposed_sinks = sinks
+        return
+
+
+    
@@ -12,10 +12,11 @@ from secrets import token_bytes
 from numpy.random import SeedSequence, default_rng
 
 from baseclasses.Day import Day
+from baseclasses.Equilibrium import Equilibrium
 from baseclasses.InputProperties import InputProperties
 from baseclasses.ModelParameters import ModelParameters
 from baseclasses.Network import Network
-from baseclasses.TravelFlow import TravelFlow
+from baseclasses.TravelFlow import TravelFlow, TravelFlowSchedule, SyntheticTravelFlow, load_coordinates
 from baseclasses.Writer import Writer
 
 from models.disease.DiseaseModel import DiseaseModel
@@ -43,7 +44,8 @@ def run( simulation_days:Type[Day],
          vaccine_model:Type[Vaccination],
          disease_model: Type[DiseaseModel],
          travel_model:Type[TravelModel],
-         writer:Type[Writer]
+         writer:Type[Writer],
+         equilibrium:Type[Equilibrium]=None
        ):
     """
     Run function for simulating each day
@@ -60,23 +62,30 @@ def run( simulation_days:Type[Day],
     writer.write_csv(0, network) if writer.total_sims > 1 else writer.write_json(0, network)
     simulation_days.snapshot(network)
 
+    # Index the nodes with infectious travelers, and the nodes the disease step has to advance
+    travel_model.reset_active_sources(network)
+    network.reset_activity(disease_model.activity_compartments(network))
+
     # Iterate over each day, each node...
     for day in range(1, simulation_days.day+1):
         # Distribute vaccines from network stockpile to individual nodes and zero-out
         vaccine_model.distribute_vaccines_to_nodes(network, day)
 
-        # Run distributions, treatments, stockpiles, and disease simulation for each node
+        # Run distributions, treatments, and stockpiles for each node
         for node in network.nodes:
             # Distribute current day's vaccines and modify node stockpiles
             vaccine_model.distribute_vaccines_to_population(node, day)
 
             # apply antivirals
 
-            # simulate one step
-            disease_model.simulate(node, day, vaccine_model)
+        # simulate one step for every node, in one pass for the compartmental models
+        stepped = disease_model.simulate_network(network, day, vaccine_model)
+        travel_model.update_active_sources(network, stepped)
 
-        # Run travel model
-        travel_model.travel(network, disease_model, parameters, day, vaccine_model)
+        # Run travel model, unless the disease model integrated it with its step
+        if not disease_model.travel_in_step:
+            travel_model.travel(network, disease_model, parameters, day, vaccine_model)
+        travel_model.write_attribution(writer, network)
 
         # write output
         writer.write_csv(day, network) if writer.total_sims > 1 else writer.write_json(day, network)
@@ -86,14 +95,29 @@ def run( simulation_days:Type[Day],
         compartment_totals = simulation_days.snapshot(network)
         names_to_sum = ('E', *travel_model.transmit_dict.keys())
         total_exposed_plus_inf = sum(
-            compartment_totals[network.comp_index[nm]]
+            compartment_totals[index]
             for nm in names_to_sum
+            for index in network.comp_stages[nm]
         )
         if total_exposed_plus_inf <= tolerance:
             logger.info(f"All exposed and infectious compartments are below "
                         f"{tolerance:.1e} on day {day}, ending simulation early.")
             break
 
+        # Stop, or repeat the last cycle, once infection settles into an endemic equilibrium
+        if equilibrium is not None and equilibrium.update(day, compartment_totals, network):
+            writer.write_equilibrium(equilibrium.record(network.compartment_labels))
+            if equilibrium.action == 'extrapolate':
+                for later_day in range(day + 1, simulation_days.day + 1):
+                    equilibrium.extrapolate(later_day, network)
+                    writer.write_csv(later_day, network) if writer.total_sims > 1 \
+                        else writer.write_json(later_day, network)
+                    simulation_days.snapshot(network)
+            else:
+                logger.info(f"Reached an endemic equilibrium on day {day}, ending simulation early.")
+            break
+
+    travel_model.write_attribution(writer, network, final=True)
     if writer.total_sims == 1:
         simulation_days.plot(writer.output_dir)
     logger.info('completed processes in the run function')
@@ -101,6 +125,13 @@ def run( simulation_days:Type[Day],
     return
 
 
+def _optional(value, cast):
+    """
+    Cast an optional input value, e.g. "0.001" -> 0.001, leaving None as None
+    """
+    return None if value is None else cast(value)
+
+
 def main():
     """
     Main entry point to PandemicExerciseSimulator
@@ -135,17 +166,53 @@ def main():
     # Initialize Network class which will contain a list of Nodes
     # There is one Node for each row in the population data (e.g. one Node
     # per county), and each Node contains Compartment data
-    compartment_labels = parameters.disease_parameters["compartments"]  # e.g., ["S","E","I","R"]
+    # e.g., ["S","E","I","R"], plus the sub-stages a declared transition graph adds
+    compartment_labels = DiseaseModel.compartment_labels(parameters.disease_parameters)
     network = Network(compartment_labels)
-    network.load_population_file(simulation_properties.population_data_file)
+    if simulation_properties.states is not None:
+        # several states composed into one network, see StateNetwork
+        state_network = simulation_properties.state_network()
+        network.load_population_frame(state_network.population_frame())
+    else:
+        network.load_population_file(simulation_properties.population_data_file)
     network.population_to_nodes(parameters.high_risk_ratios)
     logger.debug(f'total population is {network.get_total_population()}')
 
     # Load in travel flow data - an NxN matrix where N is the number of Nodes
-    # in the Network
-    travel_flow = TravelFlow(network.get_number_of_nodes())
-    travel_flow.load_travel_flow_file(simulation_properties.flow_data_file)
-    network.add_travel_flow_data(travel_flow.flow_data)
+    # in the Network, optionally pruned of small entries
+    flow_pruning = simulation_properties.travel_parameters.get('flow_pruning', {})
+    pruning = { 'threshold'     : _optional(flow_pruning.get('threshold'), float),
+                'top_k'         : _optional(flow_pruning.get('top_k'), int),
+                'mass_fraction' : _optional(flow_pruning.get('mass_fraction'), float) }
+    if simulation_properties.states is not None:
+        # block diagonal within-state flows plus cross-state coupling
+        network.add_travel_flow_data(state_network.flow_matrix(**pruning))
+    elif simulation_properties.flow_model is not None:
+        # Gravity / radiation flows from node centroids, computed in blocks as they are needed
+        flow_model = simulation_properties.flow_model
+        provider = SyntheticTravelFlow(network.get_population_array(),
+                                       load_coordinates(flow_model['coordinates'],
+                                                        [node.fips_id for node in network.nodes]),
+                                       model                = flow_model.get('model', 'gravity'),
+                                       travel_fraction      = float(flow_model.get('travel_fraction', 0.1)),
+                                       distance_exponent    = float(flow_model.get('distance_exponent', 2.0)),
+                                       destination_exponent = float(flow_model.get('destination_exponent', 1.0)),
+                                       cutoff_km            = _optional(flow_model.get('cutoff_km'), float),
+                                       min_flow             = float(flow_model.get('min_flow', 0.0)),
+                                       block_size           = int(flow_model.get('block_size', 256)),
+                                       max_blocks           = int(flow_model.get('max_blocks', 32)))
+        network.add_travel_flow_provider(provider)
+    elif len(simulation_properties.flow_schedule) == 1:
+        travel_flow = TravelFlow(network.get_number_of_nodes())
+        travel_flow.load_travel_flow_file(simulation_properties.flow_data_file, **pruning)
+        network.add_travel_flow_data(travel_flow.flow_data)
+    else:
+        # Time-varying flows are cached as binary CSR files and memory-mapped when active
+        travel_flow_schedule = TravelFlowSchedule(network.get_number_of_nodes(),
+                                                  simulation_properties.flow_schedule,
+                                                  os.path.join(output_dir, 'flow_cache'),
+                                                  **pruning)
+        network.add_travel_flow_schedule(travel_flow_schedule, day=0)
 
     # Initialize non-pharmaceutical interventions
     npis = NonPharmaInterventions(simulation_properties.non_pharma_interventions,
@@ -170,11 +237,21 @@ def main():
     # Initialize a travel model - will default to Binomial travel
     travel_parent = TravelModel(parameters)
     travel_model  = travel_parent.get_child(simulation_properties.travel_model)
-
-    # New random seed per realization num
-    base_seed = int.from_bytes(token_bytes(16), "little")  # 128-bit
+    disease_model.couple_travel(travel_model)
+
+    # Optionally detect endemic equilibria, e.g. in multi-year runs with waning immunity
+    equilibrium = None
+    if simulation_properties.equilibrium is not None:
+        equilibrium = Equilibrium(simulation_properties.equilibrium, network.get_total_population())
+
+    # New random seed per realization num, from the input seed if given
+    base_seed = simulation_properties.random_seed
+    if base_seed is None:
+        base_seed = int.from_bytes(token_bytes(16), "little")  # 128-bit
+    logger.info(f'base random seed = {base_seed}')
     parent_seedseq = SeedSequence(base_seed)
-    child_seedseq = parent_seedseq.spawn(realization_number)
+    # one child per realization index so batches of a realization_range get distinct streams
+    child_seedseq = parent_seedseq.spawn(max(realization_indices) + 1)
 
     # Run time output file
     csv_time_path = Path(simulation_properties.output_dir_path) / f"simulation_times_batch-{batch_num}.csv"
@@ -184,11 +261,15 @@ def main():
         simulation_days = Day(args.days)
 
         # Set the random number generator seed for this realization num
-        disease_model.set_seed(child_seedseq[i])
+        disease_model.set_seed(child_seedseq[r])
 
         # Need to pass original network each iteration
         network_copy = copy.deepcopy(network)
 
+        # Forget the equilibrium detection history of the previous realization
+        if equilibrium is not None:
+            equilibrium.reset()
+
         # Initialize output writer
         writer = Writer(output_dir_path   = simulation_properties.output_dir_path,
                         realization_index = r, total_sims = realization_number,
@@ -200,7 +281,8 @@ def main():
              vaccine_model,
              disease_model,
              travel_model,
-             writer
+             writer,
+             equilibrium
            )
         # capture elapsed time
         elapsed = time.perf_counter() - start_time
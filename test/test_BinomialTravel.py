@@ -0,0 +1,263 @@
+import pytest
+import numpy as np
+from types import SimpleNamespace
+
+# needed to set dynamic Compartment Enum while having relative paths in headers
+import sys, importlib
+GroupModule = importlib.import_module("src.baseclasses.Group")
+# ensure any alt path points to the same module
+sys.modules.setdefault("baseclasses.Group", GroupModule)
+
+from src.baseclasses.Network import Network
+from src.baseclasses.Node import Node
+from src.baseclasses.Group import Compartments
+from src.baseclasses.PopulationCompartments import PopulationCompartments
+from src.models.travel.TravelModel import TravelModel
+from src.models.disease.DiseaseModel import DiseaseModel
+
+#////////////////////
+#### Helper Funs ####
+
+COMPARTMENT_LABELS = ["S", "E", "IA", "IP", "IS", "H", "R", "D"]
+
+def make_params(num_age=3, engine="vectorized", seed=0):
+    rng = np.random.default_rng(seed)
+    return SimpleNamespace(
+        number_of_age_groups=num_age,
+        np_contact_matrix=rng.uniform(0.1, 3.0, size=(num_age, num_age)),
+        travel_parameters={
+            "rho": "0.39",
+            "flow_reduction": [str(x) for x in rng.uniform(0.5, 2.0, size=num_age)],
+            "traveling_compartments": {"IA": "0.97", "IP": "0.45"},
+            "transmitting_compartments": {"IA": "0.97", "IP": "0.45", "IS": "1.0"},
+            "engine": engine,
+        },
+    )
+
+def make_network(num_nodes=4, num_age=3, seed=0):
+    rng = np.random.default_rng(seed)
+    net = Network(COMPARTMENT_LABELS)
+    for idx in range(num_nodes):
+        pops = rng.integers(1000, 5000, size=num_age).tolist()
+        pc = PopulationCompartments(age_group_pops=pops, high_risk_ratios=[0.2] * num_age)
+        # move some susceptibles into infectious compartments of random subgroups
+        for comp in ("IA", "IP", "IS"):
+            moved = rng.integers(0, 50, size=pc.compartment_data.shape[:3])
+            moved = np.minimum(moved, pc.compartment_data[..., Compartments.S.value])
+            pc.compartment_data[..., Compartments.S.value] -= moved
+            pc.compartment_data[..., getattr(Compartments, comp).value] += moved
+        net._add_node(Node(idx, idx + 1, idx + 1, pc))
+
+    flow = rng.uniform(0.0, 0.05, size=(num_nodes, num_nodes))
+    flow[rng.uniform(size=flow.shape) < 0.3] = 0.0
+    np.fill_diagonal(flow, 0.6)
+    net.add_travel_flow_data(flow)
+    return net
+
+def loop_probabilities(travel_model, params, network, disease_model):
+    out = []
+    for sink_id, sink in enumerate(network.nodes):
+        probabilities = [0.0] * params.number_of_age_groups
+        for source_id, source in enumerate(network.nodes):
+            if sink_id != source_id:
+                travel_model._calculate_flow_probability(params, network, sink, sink_id,
+                                                         source, source_id, probabilities, disease_model)
+        out.append(probabilities)
+    return np.array(out)
+
+#//////////////
+#### TESTS ####
+
+def test_engine_defaults_to_vectorized_and_rejects_unknown():
+    params = make_params()
+    del params.travel_parameters["engine"]
+    assert TravelModel(params).get_child("binomial").engine == "vectorized"
+
+    params.travel_parameters["engine"] = "warp"
+    with pytest.raises(ValueError):
+        TravelModel(params).get_child("binomial")
+
+def test_vectorized_probabilities_match_pairwise_loop():
+    params = make_params(num_age=3)
+    network = make_network(num_nodes=5, num_age=3)
+    disease_model = SimpleNamespace(beta=0.05, relative_susceptibility=[1.0, 0.8, 1.2])
+    travel_model = TravelModel(params).get_child("binomial")
+
+    expected = loop_probabilities(travel_model, params, network, disease_model)
+    got = travel_model._calculate_network_flow_probabilities(params, network, disease_model)
+
+    assert got.shape == (5, 3)
+    assert np.any(expected > 0)
+    np.testing.assert_allclose(got, expected, rtol=1e-12, atol=1e-15)
+
+def test_coupled_force_matches_network_probabilities():
+    params = make_params(num_age=3)
+    network = make_network(num_nodes=5, num_age=3)
+    disease_model = SimpleNamespace(beta=0.05, relative_susceptibility=[1.0, 0.8, 1.2])
+    travel_model = TravelModel(params).get_child("binomial")
+
+    travel_model.reset_active_sources(network)
+    expected = travel_model._calculate_network_flow_probabilities(params, network, disease_model)
+    force = travel_model.coupled_force(network, 1, disease_model)
+    np.testing.assert_allclose(force(network.get_compartment_array()), expected, rtol=1e-12, atol=1e-15)
+
+    # the force follows the compartments it is given, not those of the network
+    assert not force(np.zeros_like(network.get_compartment_array())).any()
+
+def test_no_infectious_gives_zero_probabilities():
+    params = make_params(num_age=2)
+    network = make_network(num_nodes=3, num_age=2)
+    for node in network.nodes:
+        data = node.compartments.compartment_data
+        data[..., Compartments.S.value] += data[..., 1:].sum(axis=-1)
+        data[..., 1:] = 0.0
+    disease_model = SimpleNamespace(beta=0.05, relative_susceptibility=[1.0, 1.0])
+    travel_model = TravelModel(params).get_child("binomial")
+
+    got = travel_model._calculate_network_flow_probabilities(params, network, disease_model)
+    assert np.all(got == 0.0)
+
+def test_loop_engine_visits_only_stored_flows_and_matches_dense():
+    params = make_params(num_age=2, engine="loop")
+    network = make_network(num_nodes=4, num_age=2, seed=3)
+    disease_model = SimpleNamespace(beta=0.05, relative_susceptibility=[1.0, 1.0])
+    travel_model = TravelModel(params).get_child("binomial")
+
+    # prune one direction of one pair; the other direction must still count
+    flow = network.travel_flow_data.toarray()
+    flow[0, 1], flow[1, 0] = 0.0, 0.03
+    network.add_travel_flow_data(flow)
+
+    # capture the probabilities the loop engine hands to the exposure step
+    captured = []
+    travel_model._expose_from_travel = lambda p, net, probs, dm, vm: captured.append(probs.copy())
+    travel_model.travel(network, disease_model, params, 1, vaccine_model=None)
+
+    expected = travel_model._calculate_network_flow_probabilities(params, network, disease_model)
+    np.testing.assert_allclose(captured[0], expected, rtol=1e-12, atol=1e-15)
+
+def test_active_sources_follow_disease_step():
+    params = make_params(num_age=2)
+    network = make_network(num_nodes=5, num_age=2, seed=1)
+    disease_model = SimpleNamespace(beta=0.05, relative_susceptibility=[1.0, 1.0])
+    travel_model = TravelModel(params).get_child("binomial")
+
+    # clear every node except node 2
+    for node in network.nodes:
+        if node.node_index == 2:
+            continue
+        data = node.compartments.compartment_data
+        data[..., Compartments.S.value] += data[..., 1:].sum(axis=-1)
+        data[..., 1:] = 0.0
+    travel_model.reset_active_sources(network)
+    assert travel_model.active_sources == {2}
+
+    got = travel_model._calculate_network_flow_probabilities(params, network, disease_model)
+    np.testing.assert_allclose(got, loop_probabilities(travel_model, params, network, disease_model),
+                               rtol=1e-12, atol=1e-15)
+
+    # infection spreads to node 0, node 2 recovers
+    data = network.nodes[0].compartments.compartment_data
+    data[0, 0, 0, Compartments.IS.value] += 5
+    data[0, 0, 0, Compartments.S.value] -= 5
+    data = network.nodes[2].compartments.compartment_data
+    data[..., Compartments.R.value] += data[..., 1:6].sum(axis=-1)
+    data[..., 1:6] = 0.0
+    travel_model.update_active_sources(network, np.array([0, 2]))
+    assert travel_model.active_sources == {0}
+
+    # only the rows of the nodes the disease step advanced are read again
+    stale = travel_model.transmitting[1].copy()
+    network.nodes[1].compartments.compartment_data[..., Compartments.IS.value] += 7
+    travel_model.update_active_sources(network, np.array([], dtype=int))
+    np.testing.assert_array_equal(travel_model.transmitting[1], stale)
+    travel_model.update_active_sources(network, np.array([1]))
+    assert travel_model.active_sources == {0, 1}
+    network.nodes[1].compartments.compartment_data[..., Compartments.IS.value] -= 7
+    travel_model.update_active_sources(network, np.array([1]))
+
+    got = travel_model._calculate_network_flow_probabilities(params, network, disease_model)
+    np.testing.assert_allclose(got, loop_probabilities(travel_model, params, network, disease_model),
+                               rtol=1e-12, atol=1e-15)
+
+def test_travel_exposures_are_batched_and_seeded():
+    params = make_params(num_age=2)
+    vaccine_model = SimpleNamespace(vaccine_effectiveness=[1.0, 1.0])
+
+    def run_once(seed):
+        network = make_network(num_nodes=4, num_age=2, seed=2)
+        disease_model = DiseaseModel.__new__(DiseaseModel)
+        disease_model.beta, disease_model.relative_susceptibility = 0.5, [1.0, 1.0]
+        disease_model.set_seed(np.random.SeedSequence(seed))
+        travel_model = TravelModel(params).get_child("binomial")
+        before = network.get_compartment_array()
+        travel_model.travel(network, disease_model, params, 1, vaccine_model)
+        return before, network.get_compartment_array()
+
+    before, after = run_once(7)
+    S, E = Compartments.S.value, Compartments.E.value
+    exposed = before[..., S] - after[..., S]
+    assert exposed.sum() > 0
+    np.testing.assert_array_equal(after[..., E] - before[..., E], exposed)
+    # fully effective vaccine: nobody in the vaccinated group is exposed
+    assert np.all(exposed[..., 1] == 0)
+
+    np.testing.assert_array_equal(run_once(7)[1], after)
+    assert not np.array_equal(run_once(8)[1], after)
+
+def test_attribution_sums_to_sink_pressure_and_flushes_in_bulk(tmp_path):
+    from src.baseclasses.Writer import Writer, read_travel_attribution
+
+    params = make_params(num_age=2)
+    params.travel_parameters["attribution"] = "true"
+    network = make_network(num_nodes=5, num_age=2, seed=4)
+    disease_model = DiseaseModel.__new__(DiseaseModel)
+    disease_model.beta, disease_model.relative_susceptibility = 0.05, [1.0, 1.0]
+    disease_model.set_seed(np.random.SeedSequence(0))
+    vaccine_model = SimpleNamespace(vaccine_effectiveness=[0.0, 0.0])
+    travel_model = TravelModel(params).get_child("binomial")
+    travel_model.attribution.__init__(2, capacity=7)   # force several flushes
+
+    expected = travel_model._calculate_network_flow_probabilities(params, network, disease_model)
+    before = network.get_compartment_array()
+    travel_model.travel(network, disease_model, params, 3, vaccine_model)
+    exposed = before[..., Compartments.S.value] - network.get_compartment_array()[..., Compartments.S.value]
+    np.testing.assert_array_equal([node.travel_exposure for node in network.nodes], exposed.sum(axis=(2, 3)))
+
+    writer = Writer(output_dir_path=str(tmp_path), realization_index=0, total_sims=2)
+    travel_model.write_attribution(writer, network, final=True)
+    table = read_travel_attribution(tmp_path / "travel_attribution_batch-0.npy")
+    assert (table["day"] == 3).all()
+    assert not (table["source_fips"] == table["sink_fips"]).any()
+
+    got = np.zeros_like(expected)
+    fips_to_index = {node.fips_id: node.node_index for node in network.nodes}
+    for row in table.itertuples():
+        got[fips_to_index[row.sink_fips]] += [row.pressure_age0, row.pressure_age1]
+    np.testing.assert_allclose(got, expected, rtol=1e-12)
+
+def test_vectorized_probabilities_with_synthetic_flow_provider():
+    from src.baseclasses.TravelFlow import SyntheticTravelFlow
+    params = make_params(num_age=2)
+    network = make_network(num_nodes=7, num_age=2, seed=6)
+    rng = np.random.default_rng(6)
+    provider = SyntheticTravelFlow(network.get_population_array(),
+                                   np.column_stack([rng.uniform(29, 33, 7), rng.uniform(-100, -95, 7)]),
+                                   block_size=2, max_blocks=1)
+    disease_model = SimpleNamespace(beta=0.05, relative_susceptibility=[1.0, 0.9])
+    travel_model = TravelModel(params).get_child("binomial")
+
+    network.add_travel_flow_data(provider.to_csr())
+    expected = travel_model._calculate_network_flow_probabilities(params, network, disease_model)
+    network.add_travel_flow_provider(provider)
+    got = travel_model._calculate_network_flow_probabilities(params, network, disease_model)
+    assert network.travel_flow_data is None
+    np.testing.assert_allclose(got, expected, rtol=1e-12)
+
+def test_compartment_weights_cover_sub_stages():
+    params = make_params()
+    travel_model = TravelModel(params).get_child("binomial")
+    net = Network(["S", "E", "IA", "IP", "IP_2", "IP_3", "IS", "R"])
+    assert net.comp_stages["IP"] == [3, 4, 5] and net.comp_stages["IS"] == [6]
+    np.testing.assert_allclose(travel_model._compartment_weights(net, params.travel_parameters["traveling_compartments"]),
+                               [0, 0, 0.97, 0.45, 0.45, 0.45, 0, 0])
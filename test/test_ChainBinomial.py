@@ -0,0 +1,44 @@
+import pytest
+import numpy as np
+
+from src.models.disease.ChainBinomial import chain_binomial, exit_channels
+
+#////////////////////
+#### Helper Funs ####
+
+# A => B at rate 0.6 and A => C at rate 1.4 per person, competing; B => C at rate 0.3
+SOURCE = np.array([0, 0, 1])
+RATES = np.array([0.6, 1.4, 0.3])
+
+#//////////////
+#### TESTS ####
+
+def test_exit_channels_group_channels_by_source():
+    grouped = exit_channels(np.array([0, 1, 1, 3, 4, 4, 5, 5, 2]))
+    assert [c for c, _ in grouped] == [0, 1, 3, 4, 5, 2]
+    np.testing.assert_array_equal(grouped[1][1], [1, 2])
+    np.testing.assert_array_equal(grouped[-1][1], [8])
+
+def test_competing_exits_follow_exact_probabilities():
+    rng = np.random.default_rng(4)
+    counts = np.tile([[200.0, 50.0, 0.0]], (5000, 1))   # 5000 independent groups
+    firings = chain_binomial(counts, np.broadcast_to(RATES, (5000, 3)), SOURCE, rng)
+
+    # never more exits than people, and whole people only
+    assert np.all(firings[:, :2].sum(axis=1) <= 200) and np.all(firings[:, 2] <= 50)
+    assert np.all(firings == np.round(firings))
+    # leave A with probability 1 - exp(-2), split 0.3 / 0.7; leave B with probability 1 - exp(-0.3)
+    leave = -np.expm1(-2.0)
+    np.testing.assert_allclose(firings.mean(axis=0), [200 * leave * 0.3, 200 * leave * 0.7, 50 * -np.expm1(-0.3)],
+                               rtol=0.01)
+    # the two exits of A are one multinomial draw, so they are negatively correlated
+    covariance = np.cov(firings[:, 0], firings[:, 1])[0, 1]
+    assert covariance == pytest.approx(-200 * (leave * 0.3) * (leave * 0.7), rel=0.1)
+
+def test_groups_without_rates_or_people_stay():
+    rng = np.random.default_rng(5)
+    counts = np.array([[0.0, 10.0, 0.0], [30.0, 0.0, 0.0]])
+    rates = np.array([[0.6, 1.4, 0.3], [0.0, 0.0, 0.3]])
+    firings = chain_binomial(counts, rates, SOURCE, rng)
+    assert np.all(firings[0, :2] == 0)
+    assert np.all(firings[1] == 0)
@@ -0,0 +1,180 @@
+import pytest
+import numpy as np
+from types import SimpleNamespace
+
+# needed to set dynamic Compartment Enum while having relative paths in headers
+import sys, importlib
+GroupModule = importlib.import_module("src.baseclasses.Group")
+# ensure any alt path points to the same module
+sys.modules.setdefault("baseclasses.Group", GroupModule)
+
+from src.baseclasses.Network import Network
+from src.baseclasses.Node import Node
+from src.baseclasses.Group import Compartments
+from src.baseclasses.PopulationCompartments import PopulationCompartments
+from src.models.travel.TravelModel import TravelModel
+from src.models.disease.DiseaseModel import DiseaseModel
+from src.models.disease.DeterministicSEIRS import DeterministicSEIRS
+from src.models.treatments.NonPharmaInterventions import NonPharmaInterventions
+
+#////////////////////
+#### Helper Funs ####
+
+COMPARTMENT_LABELS = ["S", "E", "IA", "IP", "IS", "H", "R", "D"]
+
+def make_params(num_age=2):
+    return SimpleNamespace(
+        number_of_age_groups=num_age,
+        np_contact_matrix=np.array([[2.0, 0.5], [0.5, 1.0]])[:num_age, :num_age],
+        travel_parameters={"transmitting_compartments": {"IA": "0.5", "IP": "0.5", "IS": "1.0"}},
+    )
+
+def make_network(flow, infectious):
+    net = Network(COMPARTMENT_LABELS)
+    for idx, infected in enumerate(infectious):
+        pc = PopulationCompartments(age_group_pops=[1000, 3000], high_risk_ratios=[0.0, 0.0])
+        pc.compartment_data[0, 0, 0, Compartments.S.value] -= infected
+        pc.compartment_data[0, 0, 0, Compartments.IS.value] += infected
+        net._add_node(Node(idx, idx + 1, idx + 1, pc))
+    net.add_travel_flow_data(np.asarray(flow, dtype=float))
+    return net
+
+def make_disease_model(beta=0.3, seed=0):
+    disease_model = DiseaseModel.__new__(DiseaseModel)
+    disease_model.beta, disease_model.relative_susceptibility = beta, [1.0, 1.0]
+    disease_model.parameters = SimpleNamespace(np_contact_matrix=make_params().np_contact_matrix)
+    disease_model._calculate_beta_w_npi_network = lambda number_of_nodes: np.full((number_of_nodes, 2), beta)
+    disease_model.set_seed(np.random.SeedSequence(seed))
+    return disease_model
+
+def make_seirs_run(flow, infectious):
+    params = SimpleNamespace(
+        number_of_age_groups=1,
+        np_contact_matrix=np.eye(1),
+        disease_parameters={"R0": "2.0", "latent_period_days": "3.0", "infectious_period_days": "4.0",
+                            "immune_period_days": "0", "relative_susceptibility": ["1.0"]},
+        travel_parameters={"transmitting_compartments": {"I": "1.0"}},
+    )
+    network = Network(["S", "E", "I", "R"])
+    for idx, infected in enumerate(infectious):
+        pc = PopulationCompartments(age_group_pops=[10000], high_risk_ratios=[0.0])
+        pc.compartment_data[0, 0, 0, :] = [10000.0 - infected, 0.0, infected, 0.0]
+        network._add_node(Node(idx, idx + 1, idx + 1, pc))
+    network.add_travel_flow_data(np.asarray(flow, dtype=float))
+    model = DeterministicSEIRS(DiseaseModel(params, NonPharmaInterventions([], 5, len(infectious), 1), 0))
+    return network, model, TravelModel(params).get_child("commuter")
+
+#//////////////
+#### TESTS ####
+
+def test_commuter_force_matches_explicit_mixing():
+    flow = [[0.7, 0.2, 0.0], [0.1, 0.8, 0.1], [0.0, 0.3, 0.6]]
+    network = make_network(flow, infectious=[0, 40, 5])
+    travel_model = TravelModel(make_params()).get_child("commuter")
+    disease_model = make_disease_model()
+
+    got = travel_model.coupled_force(network, 1, disease_model)(network.get_compartment_array())
+
+    # explicit per-destination mixing; row 2 leaves 0.1 at home on top of the 0.6 diagonal
+    commute = np.array([[0.8, 0.2, 0.0], [0.1, 0.8, 0.1], [0.0, 0.3, 0.7]])
+    population = np.full(3, 4000.0)
+    infectious = np.zeros((3, 2))
+    infectious[:, 0] = [0, 40, 5]
+    expected = np.zeros((3, 2))
+    for i in range(3):
+        for j in range(3):
+            share = (commute[:, j] @ infectious) / (commute[:, j] @ population)
+            expected[i] += commute[i, j] * 0.3 * (make_params().np_contact_matrix @ share)
+    np.testing.assert_allclose(got, expected, rtol=1e-12)
+    # node 0 has no local cases but commutes into node 1
+    assert got[0, 0] > 0.0
+
+def test_commuter_force_applies_destination_npis_and_can_fall_below_local_force():
+    # node 0 residents spend half the day at node 1, which has no cases
+    flow = [[0.5, 0.5], [0.0, 1.0]]
+    network = make_network(flow, infectious=[400, 0])
+    travel_model = TravelModel(make_params()).get_child("commuter")
+    assert travel_model.provides_coupled_force and travel_model.replaces_local_force
+    npi_beta = np.array([[0.3, 0.3], [0.15, 0.15]])   # NPIs halve beta at node 1
+    disease_model = make_disease_model()
+    disease_model._calculate_beta_w_npi_network = lambda number_of_nodes: npi_beta
+
+    got = travel_model.coupled_force(network, 1, disease_model)(network.get_compartment_array())
+
+    contact = make_params().np_contact_matrix
+    commute = np.array(flow)
+    population = np.full(2, 4000.0)
+    infectious = np.array([[400.0, 0.0], [0.0, 0.0]])
+    expected = np.zeros((2, 2))
+    for i in range(2):
+        for j in range(2):
+            share = (commute[:, j] @ infectious) / (commute[:, j] @ population)
+            expected[i] += commute[i, j] * (contact @ (npi_beta[j] * share))
+    np.testing.assert_allclose(got, expected, rtol=1e-12)
+
+    # away from home node 0 residents feel less than the local force; nothing clips it back up
+    local_force = contact @ (npi_beta[0] * infectious[0] / population[0])
+    assert np.all(got[0] < local_force)
+
+def test_force_of_infection_is_replaced_by_commuter_force():
+    flow = [[0.5, 0.5], [0.0, 1.0]]
+    network = make_network(flow, infectious=[400, 0])
+    travel_model = TravelModel(make_params()).get_child("commuter")
+    disease_model = make_disease_model()
+    disease_model.travel_model = travel_model
+    vaccine_model = SimpleNamespace(vaccine_effectiveness=[0.5, 0.5])
+    compartments = network.get_compartment_array()
+    weights = travel_model._compartment_weights(network, travel_model.transmit_dict)
+    beta = np.full((2, 2), 0.3)
+    population = network.get_population_array()
+    local = disease_model._force_of_infection(compartments, beta, population, weights, vaccine_model)
+
+    disease_model._travel_force = travel_model.coupled_force(network, 1, disease_model)
+    got = disease_model._force_of_infection(compartments, beta, population, weights, vaccine_model)
+    mixed = disease_model._travel_force(compartments)
+    np.testing.assert_allclose(got[..., 0, 0], mixed)
+    np.testing.assert_allclose(got[..., 0, 1], mixed * 0.5)
+    assert np.all(got[0] < local[0])
+    # the right-hand side does not add it a second time
+    np.testing.assert_allclose(disease_model._ode_transmission_rate(compartments, beta, population, weights,
+                                                                    vaccine_model), got)
+
+def test_disease_step_mixes_without_commuting_like_the_local_step():
+    network, model, travel_model = make_seirs_run([[1.0, 0.0], [0.0, 1.0]], infectious=[200.0, 0.0])
+    reference, local_model, _ = make_seirs_run([[1.0, 0.0], [0.0, 1.0]], infectious=[200.0, 0.0])
+    model.couple_travel(travel_model)
+    assert model.travel_in_step
+    vaccine_model = SimpleNamespace(vaccine_effectiveness=[0.0])
+    for day in (1, 2, 3):
+        model.simulate_network(network, day, vaccine_model)
+        local_model.simulate_network(reference, day, vaccine_model)
+    np.testing.assert_allclose(network.get_compartment_array(), reference.get_compartment_array(), rtol=1e-12)
+
+def test_disease_step_with_commuting_moves_infection_out_of_the_home_node():
+    network, model, travel_model = make_seirs_run([[0.5, 0.5], [0.0, 1.0]], infectious=[200.0, 0.0])
+    reference, local_model, _ = make_seirs_run([[0.5, 0.5], [0.0, 1.0]], infectious=[200.0, 0.0])
+    model.couple_travel(travel_model)
+    vaccine_model = SimpleNamespace(vaccine_effectiveness=[0.0])
+    model.simulate_network(network, 1, vaccine_model)
+    local_model.simulate_network(reference, 1, vaccine_model)
+
+    E = Compartments.E.value
+    exposed, exposed_local = network.get_compartment_array()[..., E], reference.get_compartment_array()[..., E]
+    # the commuters' home node gets fewer infections than with the local force alone, the destination more
+    assert exposed[0].sum() < exposed_local[0].sum()
+    assert exposed[1].sum() > 0.0 and exposed_local[1].sum() == 0.0
+    np.testing.assert_allclose(network.get_compartment_array().sum(axis=-1), reference.get_compartment_array().sum(axis=-1))
+
+def test_commuter_is_rejected_where_the_step_cannot_take_it():
+    travel_model = TravelModel(make_params()).get_child("commuter")
+    node_by_node = DiseaseModel.__new__(DiseaseModel)
+    with pytest.raises(ValueError):
+        node_by_node.couple_travel(travel_model)
+
+    exact = DiseaseModel.__new__(DiseaseModel)
+    exact.batched_step, exact.integrator, exact.ssa_population_below = True, "ssa", 0.0
+    with pytest.raises(ValueError):
+        exact.couple_travel(travel_model)
+
+    with pytest.raises(RuntimeError):
+        travel_model.travel(None, None, None, 1, None)
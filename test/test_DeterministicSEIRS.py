@@ -161,3 +161,96 @@ def test_simulate_waning_and_transmission_both_apply_in_S_equation():
     # Expected: S should go DOWN overall (transmission dominates) but not by more than S
     assert S_after < S_before, "S should decrease when transmission is present"
     assert S_after >= 0.0, "S must not go negative (guarded by min(trans_prob*S, S))"
+
+#//////////////////////////////////////////
+#### Tests: network-wide batched step ####
+
+def test_simulate_network_matches_node_by_node():
+    """One pass over the stacked [node][age][risk][vaccine][compartment] array equals stepping each node."""
+    import copy
+    params = make_params(num_age=2, R0=2.5, immune_period_days=200)
+    params.np_contact_matrix = np.array([[2.0, 0.5], [0.7, 1.5]])
+
+    net = Network(["S", "E", "I", "R"])
+    for idx, (pop, infected) in enumerate([(1000, 10.0), (5000, 0.0), (300, 30.0)]):
+        pc = PopulationCompartments(age_group_pops=[pop, 2 * pop], high_risk_ratios=[0.2, 0.4])
+        pc.compartment_data[1, 0, 0, :] = [2 * pop * 0.8 - infected - 50, 5.0, infected, 45.0]
+        pc.compartment_data[0, 1, 1, :] = pc.compartment_data[0, 1, 0, :] / 4   # some vaccinated
+        pc.compartment_data[0, 1, 0, :] *= 0.75
+        net._add_node(Node(node_index=idx, node_id=idx + 1, fips_id=idx + 1, compartments=pc))
+
+    npi = NonPharmaInterventions([{"day": "0", "duration": "5", "location": "3", "effectiveness": ["0.5", "0.2"]}],
+                                 4, 3, 2)
+    npi.pre_process(net)
+    model = DeterministicSEIRS(DiseaseModel(params, npi, 0))
+    vax = DummyVax([0.6, 0.3])
+
+    expected = copy.deepcopy(net)
+    for day in (1, 2):
+        for node in expected.nodes:
+            model.simulate(node, day, vax)
+        model.simulate_network(net, day, vax)
+
+    np.testing.assert_allclose(net.get_compartment_array(), expected.get_compartment_array(), rtol=1e-12)
+
+
+def test_rk_integrators_converge_to_the_fine_solution():
+    """RK4 and RK45 stay close to a fine-step solution where one Euler step per day does not."""
+    def run(**ode):
+        params = make_params(num_age=2, R0=3.0, latent_period_days=0.7, infectious_period_days=2.0)
+        params.np_contact_matrix = np.array([[2.0, 0.5], [0.7, 1.5]])
+        params.disease_parameters.update(ode)
+        net = Network(["S", "E", "I", "R"])
+        pc = PopulationCompartments(age_group_pops=[40000, 60000], high_risk_ratios=[0.0, 0.0])
+        pc.compartment_data[1, 0, 0, :] = [59900.0, 0.0, 100.0, 0.0]
+        net._add_node(Node(node_index=0, node_id=1, fips_id=1, compartments=pc))
+        npi = NonPharmaInterventions([], 30, 1, 2)
+        model = DeterministicSEIRS(DiseaseModel(params, npi, 0))
+        infectious = []
+        for day in range(1, 31):
+            model.simulate_network(net, day, DummyVax([0.0, 0.0]))
+            infectious.append(net.get_compartment_array()[..., 2].sum())
+        assert net.get_compartment_array().sum() == pytest.approx(100000.0)
+        return np.array(infectious)
+
+    reference = run(ode_integrator="rk4", ode_steps_per_day=64)
+    error = lambda infectious: np.abs(infectious - reference).max() / reference.max()
+    assert error(run(ode_integrator="rk45", ode_rtol=1e-6)) < 1e-3
+    assert error(run(ode_integrator="rk4")) < 1e-2
+    assert error(run()) > 10 * error(run(ode_integrator="rk4"))
+
+    with pytest.raises(ValueError):
+        run(ode_integrator="rk9")
+
+
+def test_simulate_network_skips_quiescent_nodes_until_woken():
+    """Only nodes with people in E / I, or in R when immunity wanes, are advanced."""
+    def build(immune_period_days):
+        net = Network(["S", "E", "I", "R"])
+        for idx, (infected, recovered) in enumerate([(10.0, 0.0), (0.0, 0.0), (0.0, 50.0)]):
+            pc = PopulationCompartments(age_group_pops=[1000], high_risk_ratios=[0.0])
+            pc.compartment_data[0, 0, 0, :] = [1000.0 - infected - recovered, 0.0, infected, recovered]
+            net._add_node(Node(node_index=idx, node_id=idx + 1, fips_id=idx + 1, compartments=pc))
+        params = make_params(immune_period_days=immune_period_days)
+        model = DeterministicSEIRS(DiseaseModel(params, NonPharmaInterventions([], 5, 3, 1), 0))
+        net.reset_activity(model.activity_compartments(net))
+        return net, model
+
+    net, model = build(immune_period_days=0)
+    assert net.get_active_node_indices().tolist() == [0]
+    quiescent = net.get_compartment_array()[1:].copy()
+    assert model.simulate_network(net, 1, DummyVax([0.0])).tolist() == [0]
+    np.testing.assert_array_equal(net.get_compartment_array()[1:], quiescent)
+
+    # travel exposures wake a node
+    net.nodes[1].compartments.compartment_data[0, 0, 0, :2] += [-3.0, 3.0]
+    net.mark_active([1])
+    assert model.simulate_network(net, 2, DummyVax([0.0])).tolist() == [0, 1]
+    assert net.get_active_node_indices().tolist() == [0, 1]
+    assert net.nodes[1].compartments.compartment_data[0, 0, 0, 2] > 0.0
+
+    # with waning, recovered people keep a node active
+    net, model = build(immune_period_days=100)
+    assert net.get_active_node_indices().tolist() == [0, 2]
+    model.simulate_network(net, 1, DummyVax([0.0]))
+    assert net.nodes[2].compartments.compartment_data[0, 0, 0, 3] < 50.0
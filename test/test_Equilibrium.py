@@ -0,0 +1,81 @@
+import pytest
+import numpy as np
+
+from src.baseclasses.Equilibrium import Equilibrium
+
+#////////////////////
+#### Helper Funs ####
+
+class FakeNetwork:
+    # holds one state, the totals of the day, like Network.get/set_compartment_array
+    def __init__(self):
+        self.state = None
+    def get_compartment_array(self):
+        return np.array(self.state)
+    def set_compartment_array(self, state):
+        self.state = np.array(state)
+
+def feed(equilibrium, series, network):
+    for day, totals in enumerate(series, start=1):
+        network.state = totals
+        if equilibrium.update(day, totals, network):
+            return day
+    return None
+
+#//////////////
+#### TESTS ####
+
+def test_damped_oscillation_is_detected_once_it_settles():
+    days = np.arange(1, 2001)
+    infected = 1000 + 800 * np.exp(-days / 60.0) * np.cos(2 * np.pi * days / 90.0)
+    series = np.stack([9000 - infected, infected], axis=1)
+    equilibrium = Equilibrium({"window_days": "30", "tolerance": "1e-4"}, total_population=10000)
+    day = feed(equilibrium, series, FakeNetwork())
+    assert day is not None
+    assert equilibrium.period == 1
+    # the last 30 days moved by at most 1 person
+    window = series[day - 30:day]
+    assert (window.max(axis=0) - window.min(axis=0)).max() <= 1.0
+    assert np.ptp(series[day - 31:day, 1]) > 1.0
+    record = equilibrium.record(["S", "I"])
+    assert record["kind"] == "steady" and record["day"] == day and record["I"] == pytest.approx(series[day - 1, 1])
+
+def test_cycle_is_detected_and_extrapolated():
+    days = np.arange(1, 400)
+    infected = 1000 + 300 * np.sin(2 * np.pi * days / 7.0)
+    series = np.stack([9000 - infected, infected], axis=1)
+    network = FakeNetwork()
+
+    steady_only = Equilibrium({"window_days": "21"}, total_population=10000)
+    assert feed(steady_only, series, network) is None
+
+    equilibrium = Equilibrium({"window_days": "21", "max_period_days": "10", "action": "extrapolate"},
+                              total_population=10000)
+    day = feed(equilibrium, series, network)
+    assert day == 28 and equilibrium.period == 7
+    for later in (day + 1, day + 5, day + 100):
+        equilibrium.extrapolate(later, network)
+        np.testing.assert_allclose(network.state, series[later - 1], atol=1e-6)
+
+    equilibrium.reset()
+    assert equilibrium.day is None and len(equilibrium.totals) == 0
+
+def test_trends_are_not_cycles():
+    # 5% growth a day, within the tolerance of 100 people of the day 2 days before until I = 1000
+    infected = 206 * 1.05 ** (np.arange(1, 301) - 62.0)
+    growth = np.stack([1e6 - infected, infected], axis=1)
+    equilibrium = Equilibrium({"max_period_days": "7"}, total_population=1e6)
+    assert feed(equilibrium, growth, FakeNetwork()) is None
+
+    # a linear trend of 0.4 people a day moves 0.8 in 2 days, under the tolerance of 1
+    infected = 1000 + 0.4 * np.arange(1, 401)
+    trend = np.stack([9000 - infected, infected], axis=1)
+    equilibrium = Equilibrium({"window_days": "21", "max_period_days": "10"}, total_population=10000)
+    assert feed(equilibrium, trend, FakeNetwork()) is None
+
+
+def test_bad_parameters_are_rejected():
+    with pytest.raises(ValueError):
+        Equilibrium({"action": "rewind"}, total_population=10)
+    with pytest.raises(ValueError):
+        Equilibrium({"window_days": "1"}, total_population=10)
@@ -0,0 +1,19 @@
+import pytest
+
+from src.baseclasses.Event import Event, EventType
+from src.baseclasses.Group import Group
+
+#//////////////
+#### TESTS ####
+
+def test_events_at_the_same_time_order_by_creation():
+    group = Group(0, 0, 0)
+    first  = Event(0.0, 1.5, EventType.CONTACT, group, group)
+    second = Event(0.0, 1.5, EventType.CONTACT, group, group)
+    later  = Event(0.0, 2.0, EventType.CONTACT, group, group)
+
+    assert first < second and second > first
+    assert not (second < first) and not (first > second)
+    assert first < later and later > first
+    assert second.compare_event_time(first) and not first.compare_event_time(second)
+    assert sorted([later, second, first]) == [first, second, later]
@@ -0,0 +1,151 @@
+import pytest
+import numpy as np
+from types import SimpleNamespace
+
+# needed to set dynamic Compartment Enum while having relative paths in headers
+import sys, importlib
+GroupModule = importlib.import_module("src.baseclasses.Group")
+# ensure any alt path points to the same module
+sys.modules.setdefault("baseclasses.Group", GroupModule)
+
+from src.baseclasses.Network import Network
+from src.baseclasses.Node import Node
+from src.baseclasses.Group import Group, Compartments
+from src.baseclasses.PopulationCompartments import PopulationCompartments
+from src.models.disease.DiseaseModel import DiseaseModel
+
+#////////////////////
+#### Helper Funs ####
+
+VACCINE = SimpleNamespace(vaccine_effectiveness=[0.0, 0.0])
+
+def make_parent(disease_parameters):
+    parent = DiseaseModel.__new__(DiseaseModel)
+    parent.disease_model, parent.now = 'parent', 1
+    parent.parameters = SimpleNamespace(number_of_age_groups=2,
+                                        np_contact_matrix=np.array([[2.0, 1.0], [1.0, 2.0]]),
+                                        disease_parameters=disease_parameters)
+    parent.npis_schedule = [[[]] * 3] * 3
+    parent._rng = None
+    return parent
+
+def make_seirs_hybrid(**thresholds):
+    parent = make_parent({"compartments": ["S", "E", "I", "R"], "R0": "2.0", "latent_period_days": "3.0",
+                          "infectious_period_days": "4.0", "immune_period_days": "0",
+                          "relative_susceptibility": ["1.0", "1.0"], **thresholds})
+    model = parent.get_child('seirs-hybrid')
+    model.set_seed(np.random.SeedSequence(5))
+    return model
+
+def make_network(labels, infected):
+    network = Network(labels)
+    for index, count in enumerate(infected):
+        pc = PopulationCompartments(age_group_pops=[50000, 50000], high_risk_ratios=[0.0, 0.0])
+        pc.compartment_data[:, 0, 0, Compartments.S.value] -= count / 2
+        pc.compartment_data[:, 0, 0, Compartments.I.value] += count / 2
+        network._add_node(Node(index, index, index, pc))
+    return network
+
+#//////////////
+#### TESTS ####
+
+def test_modes_switch_with_hysteresis():
+    model = make_seirs_hybrid(hybrid_deterministic_above="1000", hybrid_stochastic_below="100")
+    network = make_network(["S", "E", "I", "R"], [2000])
+    node = network.nodes[0]
+    data = node.compartments.compartment_data
+
+    model._update_mode(node, VACCINE)
+    assert node.stochastic is False
+
+    # between the thresholds the node keeps its mode
+    data[:, 0, 0, Compartments.S.value] += data[:, 0, 0, Compartments.I.value] - 250.4
+    data[:, 0, 0, Compartments.I.value] = 250.4
+    model._update_mode(node, VACCINE)
+    assert node.stochastic is False
+
+    data[:, 0, 0, Compartments.S.value] += data[:, 0, 0, Compartments.I.value] - 20.4
+    data[:, 0, 0, Compartments.I.value] = 20.4
+    total = data.sum()
+    model._update_mode(node, VACCINE)
+    assert node.stochastic is True
+    # handed over with whole people and the same population
+    assert np.array_equal(data[..., 1:], np.round(data[..., 1:]))
+    assert data.sum() == pytest.approx(total)
+    assert (data >= 0).all()
+
+
+def test_rounding_keeps_susceptibles_non_negative_wherever_s_is():
+    model = make_seirs_hybrid()
+    # S is not the first compartment, and almost no susceptibles are left
+    network = make_network(["E", "S", "I", "R"], [0])
+    data = network.nodes[0].compartments.compartment_data
+    S, E, I, R = (Compartments.S.value, Compartments.E.value, Compartments.I.value, Compartments.R.value)
+    assert S == 1
+    data[..., :] = 0.0
+    data[:, 0, 0, S] = 1e-9
+    data[:, 0, 0, E] = 3.7
+    data[:, 0, 0, I] = 2.6
+    data[:, 0, 0, R] = 93.7
+    total = data.sum(axis=-1)
+
+    for _ in range(20):
+        before = data.copy()
+        model._round_compartments(network.nodes[0])
+        assert (data[..., S] >= 0).all()
+        others = [E, I, R]
+        assert np.array_equal(data[..., others], np.round(data[..., others]))
+        np.testing.assert_allclose(data.sum(axis=-1), total)
+        data[...] = before
+
+
+def test_network_steps_each_node_with_its_model():
+    model = make_seirs_hybrid()
+    network = make_network(["S", "E", "I", "R"], [5000, 10])
+    reference = make_network(["S", "E", "I", "R"], [5000, 10])
+    before = network.get_compartment_array()
+
+    model.simulate_network(network, 1, VACCINE)
+    assert [node.stochastic for node in network.nodes] == [False, True]
+
+    # the large node follows the deterministic model exactly, the small one stays integer
+    deterministic = model.deterministic_model
+    deterministic._simulate_node_batched(reference.nodes[0], 1, VACCINE)
+    assert np.allclose(network.nodes[0].compartments.compartment_data,
+                       reference.nodes[0].compartments.compartment_data)
+    small = network.nodes[1].compartments.compartment_data
+    assert np.array_equal(small, np.round(small))
+    assert np.allclose(network.get_compartment_array().sum(axis=-1), before.sum(axis=-1))
+
+
+def test_thresholds_must_leave_a_gap():
+    with pytest.raises(ValueError):
+        make_seirs_hybrid(hybrid_deterministic_above="50", hybrid_stochastic_below="100")
+
+
+def test_seatird_events_are_rebuilt_on_switch():
+    parent = make_parent({"compartments": ["S", "E", "A", "T", "I", "R", "D"], "R0": "3", "beta_scale": "14",
+                          "tau": "7", "kappa": "2", "gamma": "14", "chi": "3", "nu": ["0.002", "0.002"],
+                          "sigma": ["1", "1"], "hybrid_deterministic_above": "40", "hybrid_stochastic_below": "20"})
+    model = parent.get_child('seatird-hybrid')
+    model.set_seed(np.random.SeedSequence(5))
+    network = make_network(["S", "E", "A", "T", "I", "R", "D"], [0])
+    node = network.nodes[0]
+    model._group_cache_per_node(network)
+    data = node.compartments.compartment_data
+    for compartment, count in ((Compartments.E.value, 3), (Compartments.A.value, 2), (Compartments.T.value, 4.6)):
+        data[0, 0, 0, Compartments.S.value] -= count
+        data[0, 0, 0, compartment] += count
+    node.stochastic = False
+    node.events = ['stale']
+
+    model.now = 2
+    model._update_mode(node, VACCINE)
+    assert node.stochastic is True
+    # every E, A and T person got a schedule from now on, and no stale events are left
+    assert 'stale' not in node.events
+    assert all(event.time >= 2 for event in node.events)
+    transitions = [e for e in node.events if isinstance(e.event_type, str)]
+    people = data[0, 0, 0, [Compartments.E.value, Compartments.A.value, Compartments.T.value]].sum()
+    exits = [e for e in transitions if e.event_type in ('AtoR', 'AtoD', 'TtoR', 'TtoD', 'ItoR', 'ItoD')]
+    assert len(exits) == people
@@ -14,3 +14,49 @@ with open(FILENAME, 'r') as f:
 # We'll need new tests since there are many different types of inputs
 def test_fileinputs():
     pass
+
+def write_input(tmp_path, flow):
+    for name in ("pop.csv", "contact.csv", "hrr.csv", "Q1.csv", "Q2.csv"):
+        (tmp_path / name).write_text("0\n")
+    data = {
+        "output_dir_path": str(tmp_path),
+        "number_of_realizations": "1",
+        "data": {
+            "population": str(tmp_path / "pop.csv"),
+            "contact": str(tmp_path / "contact.csv"),
+            "flow": flow,
+            "high_risk_ratios": str(tmp_path / "hrr.csv"),
+        },
+        "disease_model": {"identity": "seirs-stochastic", "parameters": {}},
+        "travel_model": {"identity": "binomial", "parameters": {}},
+        "initial_infected": [],
+    }
+    path = tmp_path / "INPUT.json"
+    path.write_text(json.dumps(data))
+    return str(path)
+
+def test_single_flow_file_is_a_one_entry_schedule(tmp_path):
+    ip = InputProperties(write_input(tmp_path, str(tmp_path / "Q1.csv")))
+    assert ip.flow_schedule == [(0, str(tmp_path / "Q1.csv"))]
+    assert ip.flow_data_file == str(tmp_path / "Q1.csv")
+
+def test_flow_schedule_sorted_by_start_day(tmp_path):
+    flow = [{"start_day": "90", "file": str(tmp_path / "Q2.csv")},
+            {"start_day": "0", "file": str(tmp_path / "Q1.csv")}]
+    ip = InputProperties(write_input(tmp_path, flow))
+    assert ip.flow_schedule == [(0, str(tmp_path / "Q1.csv")), (90, str(tmp_path / "Q2.csv"))]
+
+def test_flow_schedule_rejects_duplicate_days(tmp_path):
+    flow = [{"start_day": "0", "file": str(tmp_path / "Q1.csv")},
+            {"start_day": "0", "file": str(tmp_path / "Q2.csv")}]
+    with pytest.raises(ValueError):
+        InputProperties(write_input(tmp_path, flow))
+
+def test_flow_model_replaces_flow_files(tmp_path):
+    flow = {"model": "radiation", "coordinates": str(tmp_path / "centroids.csv")}
+    ip = InputProperties(write_input(tmp_path, flow))
+    assert ip.flow_model["model"] == "radiation"
+    assert ip.flow_schedule == [] and ip.flow_data_file is None
+
+    with pytest.raises(ValueError):
+        InputProperties(write_input(tmp_path, {"model": "gravity"}))
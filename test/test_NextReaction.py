@@ -0,0 +1,144 @@
+import pytest
+import numpy as np
+from types import SimpleNamespace
+
+# needed to set dynamic Compartment Enum while having relative paths in headers
+import sys, importlib
+GroupModule = importlib.import_module("src.baseclasses.Group")
+# ensure any alt path points to the same module
+sys.modules.setdefault("baseclasses.Group", GroupModule)
+
+from src.baseclasses.Network import Network
+from src.models.disease.DiseaseModel import DiseaseModel
+from src.models.disease.NextReaction import IndexedPriorityQueue, next_reaction
+
+#////////////////////
+#### Helper Funs ####
+
+VACCINE = SimpleNamespace(vaccine_effectiveness=[0.3, 0.6])
+
+def make_seirs(integrator, **extra):
+    Network(["S", "E", "I", "R"])  # sets the Compartments enum
+    parent = DiseaseModel.__new__(DiseaseModel)
+    parent.disease_model, parent.now, parent._rng = 'parent', 1, None
+    parent.parameters = SimpleNamespace(
+        number_of_age_groups=2, np_contact_matrix=np.array([[2.0, 0.5], [0.7, 1.5]]),
+        disease_parameters={"R0": "2.5", "latent_period_days": "0.7", "infectious_period_days": "2.0",
+                            "immune_period_days": "0", "relative_susceptibility": ["1.0", "0.8"],
+                            "integrator": integrator, **extra})
+    parent.npis_schedule = [[[]] * 4] * 2
+    model = parent.get_child('seirs-stochastic')
+    model.set_seed(np.random.SeedSequence(11))
+    return model
+
+def make_compartments(population, infectious):
+    compartments = np.zeros((2, 2, 2, 4))
+    compartments[:, 0, 0, 0] = population / 2 - infectious
+    compartments[:, 0, 0, 2] = infectious
+    compartments[1, 1, 1, 0] = population / 10
+    return compartments
+
+#//////////////
+#### TESTS ####
+
+def test_indexed_priority_queue_tracks_the_minimum():
+    rng = np.random.default_rng(0)
+    times = rng.exponential(size=50)
+    queue = IndexedPriorityQueue(times.tolist())
+    for _ in range(500):
+        reaction = int(rng.integers(50))
+        times[reaction] = np.inf if rng.random() < 0.1 else rng.exponential()
+        queue.update(reaction, float(times[reaction]))
+        top, time = queue.top()
+        assert time == times.min() and times[top] == time
+
+
+def test_force_of_infection_matrix_is_linear_form_of_force_of_infection():
+    model = make_seirs('ssa')
+    compartments = np.stack([make_compartments(1000.0, 30.0), make_compartments(5000.0, 7.0)])
+    beta = np.array([[0.3, 0.2], [0.25, 0.25]])
+    population = compartments.sum(axis=(1, 2, 3, 4))
+    weights = np.array([0.0, 0.0, 1.0, 0.0])
+
+    expected = model._force_of_infection(compartments, beta, population, weights, VACCINE)[:, :, 0, :]
+    infectious_by_age = compartments.sum(axis=(2, 3)) @ weights
+    matrix = model._force_of_infection_matrix(beta, population, VACCINE)
+    np.testing.assert_allclose(np.einsum('navb,nb->nav', matrix, infectious_by_age), expected, rtol=1e-12)
+
+
+def test_nodes_under_the_same_npis_share_one_kernel():
+    model = make_seirs('ssa')
+    model.npis_schedule = [[[0.0, 0.0], [0.5, 0.0], [0.0, 0.0]]] * 2
+    beta = model._beta_by_day(1, 3)
+    population = np.array([1000.0, 2000.0, 4000.0])
+    matrix = model._force_of_infection_matrix(beta, population, VACCINE)
+
+    # two NPI states for three nodes, and the nodes without NPIs differ only by population
+    assert len(model._kernel_memo()) == 2
+    np.testing.assert_allclose(matrix[0] * 1000.0, matrix[2] * 4000.0, rtol=1e-12)
+    direct = model.parameters.np_contact_matrix * beta[1][None, :] * np.array([1.0, 0.8])[:, None] / 2000.0
+    np.testing.assert_allclose(matrix[1, :, 0, :], direct, rtol=1e-12)
+    np.testing.assert_allclose(matrix[1, :, 1, :], direct * (1.0 - np.array([0.3, 0.6]))[:, None], rtol=1e-12)
+
+    # a new schedule drops the memo
+    model.npis_schedule = [[[0.2, 0.2]] * 3] * 2
+    model._force_of_infection_matrix(model._beta_by_day(1, 3), population, VACCINE)
+    assert len(model._kernel_memo()) == 1
+
+
+def test_models_without_channels_reject_exact_integrators():
+    model = make_seirs('ssa')
+    model.provides_ssa_channels = False
+    with pytest.raises(ValueError):
+        model._read_integrator()
+    model.parameters.disease_parameters.update(integrator="daily", ssa_population_below="100")
+    with pytest.raises(ValueError):
+        model._read_integrator()
+    model.parameters.disease_parameters["ssa_population_below"] = "0"
+    model._read_integrator()
+
+
+def test_linear_decay_matches_exponential_mean():
+    rng = np.random.default_rng(3)
+    counts = np.zeros((1, 1, 1, 2))
+    counts[..., 0] = 100
+    rates = np.array([0.7])
+    after = [next_reaction(counts, rates, np.array([0]), np.array([1]), np.array([False]), np.zeros((1, 1, 1)),
+                           np.zeros(2), rng)[0][0, 0, 0, 0] for _ in range(400)]
+    # binomial(100, exp(-0.7)) has sd 4.8, so the mean of 400 runs is within 0.24 * 4
+    assert np.mean(after) == pytest.approx(100 * np.exp(-0.7), abs=1.0)
+
+
+def test_ssa_mean_follows_the_ode_in_a_large_node():
+    model = make_seirs('ssa')
+    compartments = np.repeat(make_compartments(20000.0, 400.0)[None], 200, axis=0)
+    population = compartments.sum(axis=(1, 2, 3, 4))
+    beta = np.full((200, 2), model.beta)
+    tomorrow = model._advance(compartments, beta, population, VACCINE)
+
+    assert np.array_equal(tomorrow, np.round(tomorrow))
+    np.testing.assert_allclose(tomorrow.sum(axis=-1), compartments.sum(axis=-1))
+
+    # deterministic reference with small RK4 steps and the same rates
+    from src.models.disease.ODEIntegration import rk4
+    from src.models.disease.DeterministicSEIRS import SEIRS_model
+    weights = np.array([0.0, 0.0, 1.0, 0.0])
+    expected = rk4(lambda y: SEIRS_model(y, model._force_of_infection(y, beta[:1], population[:1], weights, VACCINE),
+                                         model.sigma, model.gamma, model.omega), compartments[:1], steps=64)[0]
+    mean = tomorrow.mean(axis=0)
+    for compartment in range(1, 4):
+        assert mean[..., compartment].sum() == pytest.approx(expected[..., compartment].sum(), rel=0.03)
+
+
+def test_small_nodes_run_exactly_and_large_nodes_leap():
+    model = make_seirs('daily', ssa_population_below="2000")
+    compartments = np.stack([make_compartments(1000.0, 20.0), make_compartments(100000.0, 500.0)])
+    population = compartments.sum(axis=(1, 2, 3, 4))
+    exact = model._exact_nodes(population)
+    assert exact.tolist() == [True, False]
+
+    tomorrow = model._advance(compartments, np.full((2, 2), model.beta), population, VACCINE)
+    np.testing.assert_allclose(tomorrow.sum(axis=-1), compartments.sum(axis=-1))
+    assert (tomorrow >= 0).all()
+    with pytest.raises(ValueError):
+        make_seirs('exact')
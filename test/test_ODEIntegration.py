@@ -0,0 +1,31 @@
+import pytest
+import numpy as np
+
+from src.models.disease.ODEIntegration import rk4, rk45
+
+#//////////////
+#### TESTS ####
+
+def test_rk4_and_rk45_match_exponential_decay():
+    rates = np.array([[0.1, 1.4], [3.0, 0.7]])
+    y0 = np.array([[100.0, 50.0], [20.0, 1.0]])
+    exact = y0 * np.exp(-rates)
+
+    np.testing.assert_allclose(rk4(lambda y: -rates * y, y0, steps=32), exact, rtol=1e-5)
+    y, h, steps = rk45(lambda y: -rates * y, y0, rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(y, exact, rtol=1e-7)
+    assert steps > 1 and 0 < h <= 5.0
+
+
+def test_rk45_reuses_its_step_and_ends_on_the_day():
+    rate = 0.5
+    y, h, steps = rk45(lambda y: -rate * y, np.array([10.0]), rtol=1e-6, atol=1e-6)
+    # a smooth slow decay needs only a few steps the next day, starting from the returned step
+    y2, h2, steps2 = rk45(lambda y: -rate * y, y, rtol=1e-6, atol=1e-6, h=h)
+    assert y2[0] == pytest.approx(10.0 * np.exp(-2 * rate), rel=1e-6)
+    assert steps2 <= steps
+
+
+def test_rk45_gives_up_after_max_steps():
+    with pytest.raises(RuntimeError):
+        rk45(lambda y: -1e6 * y, np.array([1.0]), rtol=1e-12, atol=1e-12, max_steps=5)
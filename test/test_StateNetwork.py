@@ -0,0 +1,56 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+from src.baseclasses.StateNetwork import StateNetwork
+
+#////////////////////
+#### Helper Funs ####
+
+def write_state(root, state, fips, flow):
+    folder = root / state
+    folder.mkdir()
+    pd.DataFrame({"fips": fips, "0-4": 100, "5-17": 200}).to_csv(
+        folder / f"county_pop_by_age_{state}_2019-2023ACS.csv", index=False)
+    pd.DataFrame({"fips": fips, "0-4": 0.1, "5-17": 0.2}).to_csv(
+        folder / f"county_{state}_high-risk-ratios-flu-only.csv", index=False)
+    np.savetxt(folder / f"{state}_Q4-2019_mobility-matrix.csv", flow, delimiter=",")
+
+def write_long(path, rows):
+    pd.DataFrame(rows, columns=["geoid_o", "geoid_d", "quarter", "mean_max_norm_prop_flow"]).to_csv(path, index=False)
+
+@pytest.fixture
+def two_states(tmp_path):
+    write_state(tmp_path, "Alpha", [1001, 1003], [[0.9, 0.1], [0.2, 0.8]])
+    write_state(tmp_path, "Beta", [2001, 2003, 2005], np.eye(3) * 0.7)
+    # within-state rows are ignored, cross-state rows of other quarters too
+    write_long(tmp_path / "Alpha" / "Alpha_quarterly-2019_mobility.csv",
+               [(1001, 1003, 4, 0.1), (1003, 2001, 4, 0.03), (1003, 2001, 1, 0.5)])
+    write_long(tmp_path / "national.csv", [(1003, 2001, 4, 0.03), (2005, 1001, 4, 0.02), (2005, 9999, 4, 0.4)])
+    return tmp_path
+
+#//////////////
+#### TESTS ####
+
+def test_population_and_high_risk_ratios_follow_state_order(two_states):
+    loader = StateNetwork(str(two_states), ["Beta", "Alpha"])
+    assert loader.population_frame()["fips"].tolist() == [2001, 2003, 2005, 1001, 1003]
+    lines = loader.high_risk_ratio_lines()
+    assert lines[0] == "fips,0-4,5-17"
+    assert [line.split(",")[0] for line in lines[1:]] == ["2001", "2003", "2005", "1001", "1003"]
+
+def test_flow_is_block_diagonal_plus_cross_state_coupling(two_states):
+    loader = StateNetwork(str(two_states), ["Alpha", "Beta"], coupling_files=[str(two_states / "national.csv")])
+    flow = loader.flow_matrix().toarray()
+    expected = np.zeros((5, 5))
+    expected[:2, :2] = [[0.9, 0.1], [0.2, 0.8]]
+    expected[2:, 2:] = np.eye(3) * 0.7
+    expected[1, 2] = 0.03   # listed in two files, counted once
+    expected[4, 0] = 0.02
+    np.testing.assert_allclose(flow, expected)
+
+def test_missing_state_files_are_reported(two_states):
+    with pytest.raises(FileNotFoundError):
+        StateNetwork(str(two_states), ["Alpha", "Gamma"])
+    with pytest.raises(ValueError):
+        StateNetwork(str(two_states), ["Alpha", "Alpha"])
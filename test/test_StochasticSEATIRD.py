@@ -0,0 +1,98 @@
+import pytest
+import numpy as np
+from types import SimpleNamespace
+
+# needed to set dynamic Compartment Enum while having relative paths in headers
+import sys, importlib
+GroupModule = importlib.import_module("src.baseclasses.Group")
+# ensure any alt path points to the same module
+sys.modules.setdefault("baseclasses.Group", GroupModule)
+
+from src.baseclasses.Network import Network
+from src.baseclasses.Node import Node
+from src.baseclasses.Group import Group
+from src.baseclasses.PopulationCompartments import PopulationCompartments
+from src.models.disease.DiseaseModel import DiseaseModel
+from src.models.disease.StochasticSEATIRD import Schedule
+from src.utils.RNGMath import rand_exp_min1
+
+#////////////////////
+#### Helper Funs ####
+
+LABELS = ["S", "E", "A", "T", "I", "R", "D"]
+VACCINE = SimpleNamespace(vaccine_effectiveness=[0.3, 1.0, 0.6])
+
+def make_model():
+    parent = DiseaseModel.__new__(DiseaseModel)
+    parent.now = 0
+    parent.parameters = SimpleNamespace(
+        number_of_age_groups=3,
+        np_contact_matrix=np.array([[20.0, 10.0, 5.0], [10.0, 30.0, 0.0], [5.0, 8.0, 15.0]]),
+        disease_parameters={"compartments": LABELS, "R0": "3", "beta_scale": "14", "tau": "7", "kappa": "2",
+                            "gamma": "14", "chi": "3", "nu": ["0.002"] * 3, "sigma": ["1", "0.8", "1.2"]})
+    parent.npis_schedule = [[[0.5, 0.0, 0.2]]]
+    return parent.get_child("seatird-stochastic")
+
+def make_node():
+    Network(LABELS)  # sets the Compartments enum
+    pc = PopulationCompartments(age_group_pops=[1000, 2000, 500], high_risk_ratios=[0.1, 0.0, 0.3])
+    pc.compartment_data[:, 0, 1, :] = pc.compartment_data[:, 0, 0, :] / 4   # some vaccinated
+    pc.compartment_data[:, 0, 0, :] -= pc.compartment_data[:, 0, 1, :]
+    node = Node(0, 1, 1, pc)
+    node.group_cache = pc.compartment_data.sum(axis=-1) / node.total_population()
+    return node
+
+#//////////////
+#### TESTS ####
+
+def test_contact_events_match_group_by_group_rates():
+    model = make_model()
+    node = make_node()
+    group = Group(0, 0, 0)
+    np.random.seed(5)    # the SEATIRD model draws from the global generator
+    schedule = Schedule(model, 0.0, group)
+
+    np.random.seed(11)
+    model._initialize_contact_events(node, group, schedule, node.group_cache, VACCINE)
+    got = [(e.time, e.destination.age, e.destination.risk, e.destination.vaccine) for e in sorted(node.events)]
+
+    # the same draws, with the transmission rate of each contacted group computed on its own
+    np.random.seed(11)
+    beta = [model.beta * (1.0 - npi) for npi in [0.5, 0.0, 0.2]]
+    expected = []
+    for ag, rg, vg in np.ndindex(node.group_cache.shape):
+        ve = VACCINE.vaccine_effectiveness[ag] if vg == 1 else 0.0
+        rate = (1.0 - ve) * beta[ag] * model.parameters.np_contact_matrix[0][ag] \
+               * model.relative_susceptibility[ag] * node.group_cache[ag][rg][vg]
+        if rate <= 0.0:
+            continue
+        Tc = rand_exp_min1(rate) + schedule.Ta()
+        while Tc < schedule.Trd_ati():
+            expected.append((Tc, ag, rg, vg))
+            Tc = rand_exp_min1(rate) + Tc
+
+    expected.sort(key=lambda event: event[0])
+    assert len(got) > 0
+    assert [destination for _, *destination in got] == [destination for _, *destination in expected]
+    assert [time for time, *_ in got] == pytest.approx([time for time, *_ in expected])
+    # empty groups and fully protected groups get no contacts
+    assert not any(age == 1 and vaccine == 1 for _, age, _, vaccine in got)
+    assert not any(age == 1 and risk == 1 for _, age, risk, _ in got)
+
+def test_event_queue_drains_in_time_order_until_the_end_of_the_day():
+    model = make_model()
+    node = make_node()
+    group = Group(0, 0, 0)
+    node.compartments.compartment_data[0, 0, 0, 0] -= 4
+    node.compartments.compartment_data[0, 0, 0, 1] += 4
+    for time, event_type in ((0.7, 'EtoA'), (0.2, 'EtoA'), (1.5, 'EtoA'), (0.2, 'AtoR'), (0.9, 'EtoA')):
+        node.add_transition_event(0.0, time, event_type, group)
+
+    # earliest first, and events at the same time in the order they were added
+    assert [(e.time, e.event_type) for e in sorted(node.events)] == \
+           [(0.2, 'EtoA'), (0.2, 'AtoR'), (0.7, 'EtoA'), (0.9, 'EtoA'), (1.5, 'EtoA')]
+
+    model.simulate(node, 0, VACCINE)
+    assert [e.time for e in node.events] == [1.5]
+    assert node.compartments.compartment_data[0, 0, 0, 1:3].tolist() == [1, 2]   # E, A
+    assert node.compartments.compartment_data[0, 0, 0, 5] == 1                    # R
@@ -0,0 +1,192 @@
+import pytest
+import numpy as np
+from types import SimpleNamespace
+
+# needed to set dynamic Compartment Enum while having relative paths in headers
+import sys, importlib
+GroupModule = importlib.import_module("src.baseclasses.Group")
+# ensure any alt path points to the same module
+sys.modules.setdefault("baseclasses.Group", GroupModule)
+
+from src.baseclasses.Network import Network
+from src.baseclasses.Node import Node
+from src.baseclasses.Group import Compartments
+from src.baseclasses.PopulationCompartments import PopulationCompartments
+from src.models.disease.DiseaseModel import DiseaseModel
+from src.models.disease.StochasticSEIHRD import StochasticSEIHRD, SEIHRD_model, SEIHRD_model_vectorized
+
+#////////////////////
+#### Helper Funs ####
+
+COMPARTMENT_LABELS = ["S", "E", "IA", "IP", "IS", "H", "R", "D"]
+
+def make_params():
+    return SimpleNamespace(
+        number_of_age_groups=2,
+        np_contact_matrix=np.array([[3.0, 1.0], [0.8, 2.0]]),
+        disease_parameters={
+            "R0": "2.2", "E_to_IPandIA_days": "0.7", "IP_to_IS_days": "0.9", "IS_to_H_days": "3.74",
+            "H_to_D_days": "5.9", "H_to_R_days": ["4.7", "6.55"], "IS_to_R_days": "2.0", "IA_to_R_days": "2.3",
+            "prop_E_to_IA": ["0.25", "0.3"], "prop_IS_to_H_lowrisk": ["0.0132", "0.0802"],
+            "prop_H_to_D": ["0.00697", "0.0909"], "highrisk_hosp_multiplier": "3.0",
+            "rel_inf_IP_to_IS": "0.45", "rel_inf_IA_to_IS": "0.97", "relative_susceptibility": ["0.8", "1.0"],
+        },
+    )
+
+def make_model(npi=()):
+    parent = DiseaseModel.__new__(DiseaseModel)
+    parent.now, parent.parameters = 1, make_params()
+    parent.npis_schedule = [[list(npi)]]
+    model = StochasticSEIHRD(parent)
+    model.set_seed(np.random.SeedSequence(3))
+    return model
+
+def make_node():
+    Network(COMPARTMENT_LABELS)  # sets the Compartments enum
+    pc = PopulationCompartments(age_group_pops=[40000, 60000], high_risk_ratios=[0.1, 0.3])
+    data = pc.compartment_data
+    for (age, risk), (ia, ip, is_, h) in {(0, 0): (30, 20, 50, 4), (1, 1): (10, 40, 25, 9)}.items():
+        data[age, risk, 0, Compartments.S.value] -= ia + ip + is_ + h
+        data[age, risk, 0, [2, 3, 4, 5]] += [ia, ip, is_, h]
+    # a vaccinated stratum
+    data[1, 0, 1, :] = data[1, 0, 0, :] / 2
+    data[1, 0, 0, :] -= data[1, 0, 1, :]
+    return Node(0, 1, 1, pc)
+
+VACCINE = SimpleNamespace(vaccine_effectiveness=[0.4, 0.6], vaccine_effectiveness_hosp=[0.5, 0.7])
+
+#//////////////
+#### TESTS ####
+
+def test_group_rates_match_per_group_loop():
+    model = make_model(npi=[0.5, 0.0])
+    node = make_node()
+    data = node.compartments.compartment_data
+    beta = np.asarray(model._calculate_beta_w_npi(0, 1))
+    assert np.allclose(beta, [model.beta * 0.5, model.beta])
+
+    rates = [np.broadcast_to(r, data.shape[:3]) for r in model._group_rates(data, beta, node.total_population(), VACCINE)]
+
+    # the force of infection summed contacted group by contacted group, as in the scalar model
+    for age, risk, vaccine in np.ndindex(data.shape[:3]):
+        expected = 0.0
+        for age2, risk2, vaccine2 in np.ndindex(data.shape[:3]):
+            S, E, IA, IP, IS, H, R, D = data[age2, risk2, vaccine2]
+            infectious = model.rel_inf_IP_to_IS * IP + model.rel_inf_IA_to_IS * IA + IS
+            expected += beta[age2] * model.parameters.np_contact_matrix[age][age2] * infectious / node.total_population()
+        ve_inf = VACCINE.vaccine_effectiveness[age] if vaccine == 1 else 0.0
+        ve_hosp = VACCINE.vaccine_effectiveness_hosp[age] if vaccine == 1 else 0.0
+        expected *= (1.0 - ve_inf) * model.relative_susceptibility[age]
+        assert np.isclose(rates[0][age, risk, vaccine], expected, rtol=1e-12)
+        assert np.isclose(rates[4][age, risk, vaccine],
+                          model.prop_IS_to_H[risk][age] * model.IS_to_H_rate * (1 - ve_hosp))
+        assert np.isclose(rates[7][age, risk, vaccine],
+                          (1 - model.prop_H_to_D[age]) * model.H_to_R_rates[age])
+
+def test_vectorized_draws_match_scalar_model():
+    y = np.array([[5000.0, 300.0, 80.0, 60.0, 120.0, 40.0, 10.0, 0.0],
+                  [200.0, 3.0, 0.0, 1.0, 2.0, 1.0, 0.0, 0.0]])
+    rates = (np.array([0.05, 0.2]), 1 / 0.7, np.array([0.25, 0.3]), 1 / 0.9,
+             np.array([0.01, 0.2]), np.array([0.45, 0.3]), 0.02, 0.15, 1 / 2.3)
+    draws = 4000
+    rng = np.random.default_rng(11)
+    vectorized = np.array([SEIHRD_model_vectorized(y, *rates, rng=rng) for _ in range(draws)])
+    scalar = np.array([[SEIHRD_model(y[g], *[np.broadcast_to(r, 2)[g] for r in rates], rng=rng) for g in range(2)]
+                       for _ in range(draws)])
+
+    # people are only moved, never created, and compartments stay non-negative
+    assert np.all(vectorized.sum(axis=-1) == 0)
+    assert np.all(y + vectorized >= 0)
+    standard_error = np.sqrt((vectorized.var(axis=0) + scalar.var(axis=0)) / draws) + 1e-9
+    assert np.all(np.abs(vectorized.mean(axis=0) - scalar.mean(axis=0)) < 5 * standard_error)
+
+def test_simulate_steps_every_group_in_place():
+    model = make_model()
+    node = make_node()
+    data = node.compartments.compartment_data
+    before = data.copy()
+    model.simulate(node, 1, VACCINE)
+    assert node.compartments.compartment_data is data
+    assert np.isclose(data.sum(), before.sum())
+    assert data[..., Compartments.S.value].sum() < before[..., Compartments.S.value].sum()
+    assert np.all(data >= 0)
+
+def test_tau_leap_integrator_steps_every_group():
+    model = make_model()
+    model.integrator = "tau-leap"
+    node = make_node()
+    data = node.compartments.compartment_data
+    before = data.copy()
+    for _ in range(3):
+        model.simulate(node, 1, VACCINE)
+    assert np.isclose(data.sum(), before.sum())
+    assert np.all(data >= 0)
+    assert data[..., Compartments.R.value].sum() > before[..., Compartments.R.value].sum()
+
+def test_chain_binomial_integrator_splits_exposed_at_random():
+    model = make_model()
+    model.integrator = "chain-binomial"
+    node = make_node()
+    data = node.compartments.compartment_data
+    before = data.copy()
+    model.simulate(node, 1, VACCINE)
+    assert np.isclose(data.sum(), before.sum())
+    assert np.all(data >= 0) and np.all(data == np.round(data))
+
+    # 2000 nodes of 7 exposed people: E => IA and E => IP compete, so the asymptomatic share of
+    # those leaving E is random with mean prop_E_to_IA, where floor() rounded it down in every node
+    counts = np.zeros((2000, 2, 2, 2, 8))
+    counts[..., Compartments.E.value] = 7
+    beta = np.tile(np.asarray(model._calculate_beta_w_npi(0, 1)), (2000, 1))
+    after = model._advance(counts, beta, np.full(2000, 112.0), VACCINE)
+    assert np.allclose(after.sum(axis=-1), 7)
+    to_IA = after[..., Compartments.IA.value]
+    to_IP = after[..., Compartments.IP.value]
+    assert to_IA[:, 0].std() > 0
+    np.testing.assert_allclose(to_IA.sum(axis=(0, 2, 3)) / (to_IA + to_IP).sum(axis=(0, 2, 3)),
+                               model.prop_E_to_IA, rtol=0.05)
+    with pytest.raises(ValueError):
+        model.parameters.disease_parameters["integrator"] = "multinomial"
+        model._read_integrator()
+
+def test_beta_by_day_compiles_the_npi_schedule():
+    model = make_model()
+    # a schedule array by [day][node][age], as NonPharmaInterventions.pre_process fills it
+    schedule = np.zeros((4, 3, 2))
+    schedule[1:3, 1] = [0.5, 0.25]
+    model.npis_schedule = schedule
+    day = model._beta_by_day(1, 3)
+    assert day.shape == (3, 2)
+    assert np.allclose(day[1], [model.beta * 0.5, model.beta * 0.75])
+    assert np.allclose(np.delete(day, 1, axis=0), model.beta)
+    assert model._beta_by_day(1, 3) is day
+    assert np.allclose(model._beta_by_day(0, 3), model.beta)
+
+    # an equal schedule in a new object is read again, whatever its id
+    model.npis_schedule = schedule.copy()
+    model.npis_schedule[1, 1] = 0.0
+    assert np.allclose(model._beta_by_day(1, 3), model.beta)
+
+    for day in range(1, 5):
+        model.now = day
+        network_beta = model._calculate_beta_w_npi_network(3)
+        for node_index in range(3):
+            assert np.array_equal(model._calculate_beta_w_npi(node_index, node_index), network_beta[node_index])
+
+    # list schedules keep the baseline for nodes without one value per age group
+    model.npis_schedule = [[[], [0.5, 0.0], [0.1]]]
+    model.now = 1
+    assert np.allclose(model._calculate_beta_w_npi_network(3), [[model.beta] * 2, [model.beta * 0.5, model.beta],
+                                                                [model.beta] * 2])
+
+def test_rate_tables_are_compiled_once_per_vaccine_effectiveness():
+    model = make_model()
+    data = make_node().compartments.compartment_data
+    beta = np.asarray(model._calculate_beta_w_npi(0, 1))
+    first = model._group_rates(data, beta, data.sum(), VACCINE)
+    second = model._group_rates(data, beta, data.sum(), VACCINE)
+    assert all(a is b for a, b in zip(first[4:8], second[4:8]))
+    no_vaccine = SimpleNamespace(vaccine_effectiveness=[0.0, 0.0], vaccine_effectiveness_hosp=[0.0, 0.0])
+    IS_to_H_rate = model._group_rates(data, beta, data.sum(), no_vaccine)[4]
+    assert np.allclose(IS_to_H_rate[..., 1], IS_to_H_rate[..., 0])
+    assert np.all(first[4][..., 1] < IS_to_H_rate[..., 1])
@@ -0,0 +1,50 @@
+import pytest
+import numpy as np
+
+from src.models.disease.TauLeaping import adaptive_tau_leap, cap_firings, select_tau
+
+#////////////////////
+#### Helper Funs ####
+
+# A => B at rate k per person
+DECAY_STOICHIOMETRY = np.array([[-1.0, 1.0]])
+DECAY_SOURCE = np.array([0])
+DECAY_ORDER = np.array([1, 1])
+
+def decay(rate):
+    return lambda counts: rate * counts[..., :1]
+
+#//////////////
+#### TESTS ####
+
+def test_select_tau_for_linear_decay():
+    counts = np.array([[1000.0, 0.0], [20.0, 0.0]])
+    tau = select_tau(counts, decay(0.5)(counts), DECAY_STOICHIOMETRY, DECAY_ORDER, epsilon=0.03)
+    # mean bound eps*x/(k*x), variance bound max(eps*x, 1)^2/(k*x)
+    np.testing.assert_allclose(tau, [min(0.03 / 0.5, 30.0**2 / 500), 1.0 / 10])
+
+def test_tau_leap_matches_exact_decay_where_daily_leap_is_biased():
+    rng = np.random.default_rng(1)
+    counts = np.tile([[50.0, 0.0]], (4000, 1))   # 4000 independent nodes
+    after, substeps = adaptive_tau_leap(counts, decay(0.8), DECAY_STOICHIOMETRY, DECAY_SOURCE, DECAY_ORDER, rng)
+
+    assert np.all(after >= 0) and np.allclose(after.sum(axis=1), 50.0)
+    # exact survivors are binomial(50, exp(-0.8)); one capped Poisson leap gives 50 * (1 - 0.8) on average
+    exact = 50 * np.exp(-0.8)
+    assert abs(after[:, 0].mean() - exact) < 0.5
+    assert abs(after[:, 0].var() - 50 * np.exp(-0.8) * (1 - np.exp(-0.8))) < 2.0
+    assert substeps.min() > 1
+
+def test_quiet_nodes_take_one_step():
+    rng = np.random.default_rng(2)
+    counts = np.array([[0.0, 30.0], [1e6, 0.0]])
+    after, substeps = adaptive_tau_leap(counts, decay(0.01), DECAY_STOICHIOMETRY, DECAY_SOURCE, DECAY_ORDER, rng,
+                                        max_substeps=8)
+    assert substeps[0] == 1
+    np.testing.assert_allclose(after[0], [0.0, 30.0])
+    assert 1 <= substeps[1] <= 8
+
+def test_cap_firings_serves_channels_in_order():
+    firings = np.array([[4.0, 5.0, 1.0]])
+    counts = np.array([[6.0, 2.0]])
+    np.testing.assert_allclose(cap_firings(firings, counts, np.array([0, 0, 1])), [[4.0, 2.0, 1.0]])
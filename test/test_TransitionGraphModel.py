@@ -0,0 +1,180 @@
+import pytest
+import numpy as np
+from types import SimpleNamespace
+
+# needed to set dynamic Compartment Enum while having relative paths in headers
+import sys, importlib
+GroupModule = importlib.import_module("src.baseclasses.Group")
+# ensure any alt path points to the same module
+sys.modules.setdefault("baseclasses.Group", GroupModule)
+
+from src.baseclasses.Network import Network
+from src.baseclasses.Node import Node
+from src.baseclasses.PopulationCompartments import PopulationCompartments
+from src.models.treatments.NonPharmaInterventions import NonPharmaInterventions
+from src.models.disease.DiseaseModel import DiseaseModel
+from src.models.disease.TransitionGraphModel import TransitionGraph, group_array
+
+#////////////////////
+#### Helper Funs ####
+
+SEIRS_TRANSITIONS = [
+    {"from": "S", "to": "E", "rate": "infection"},
+    {"from": "E", "to": "I", "days": "3.0"},
+    {"from": "I", "to": "R", "days": "4.0"},
+    {"from": "R", "to": "S", "days": "200"},
+]
+
+def make_params(disease_parameters, num_age=2):
+    return SimpleNamespace(
+        number_of_age_groups=num_age,
+        np_contact_matrix=np.array([[2.0, 0.5], [0.7, 1.5]]),
+        disease_parameters=disease_parameters,
+    )
+
+def make_network(labels, seeded):
+    net = Network(labels)
+    for idx, infected in enumerate(seeded):
+        pc = PopulationCompartments(age_group_pops=[1000, 3000], high_risk_ratios=[0.2, 0.4])
+        pc.compartment_data[1, 0, 0, 0] -= infected
+        pc.compartment_data[1, 0, 0, 2] += infected
+        pc.compartment_data[0, 1, 1, :] = pc.compartment_data[0, 1, 0, :] / 2   # some vaccinated
+        pc.compartment_data[0, 1, 0, :] /= 2
+        net._add_node(Node(idx, idx + 1, idx + 1, pc))
+    return net
+
+def make_model(identity, params, nodes=2):
+    npi = NonPharmaInterventions([], 3, nodes, params.number_of_age_groups)
+    parent = DiseaseModel(params, npi, 0)
+    model = parent.get_child(identity)
+    if hasattr(model, "set_seed"):
+        model.set_seed(np.random.SeedSequence(7))
+    return model
+
+VACCINE = SimpleNamespace(vaccine_effectiveness=[0.6, 0.3], vaccine_effectiveness_hosp=[0.5, 0.5])
+
+#//////////////
+#### TESTS ####
+
+def test_deterministic_graph_reproduces_seirs_model():
+    seirs = make_model("seirs-deterministic", make_params(
+        {"R0": "2.5", "latent_period_days": "3.0", "infectious_period_days": "4.0", "immune_period_days": "200"}))
+    graph = make_model("graph-deterministic", make_params(
+        {"compartments": ["S", "E", "I", "R"], "R0": "2.5",
+         "transitions": SEIRS_TRANSITIONS, "infectiousness": {"I": "1.0"}}))
+    assert np.isclose(graph.beta, seirs.beta)
+
+    expected = make_network(["S", "E", "I", "R"], seeded=[10.0, 0.0])
+    got = make_network(["S", "E", "I", "R"], seeded=[10.0, 0.0])
+    for day in (1, 2, 3):
+        seirs.simulate_network(expected, day, VACCINE)
+        graph.simulate_network(got, day, VACCINE)
+    np.testing.assert_allclose(got.get_compartment_array(), expected.get_compartment_array(), rtol=1e-12)
+
+    # the declared R => S transition keeps nodes with recovered people active, as in the SEIRS model
+    assert graph.activity_compartments(got) == seirs.activity_compartments(got) == [1, 2, 3]
+
+def test_infectious_days_with_splits_and_competing_risks():
+    transitions = [
+        {"from": "S", "to": "E", "rate": "infection"},
+        {"from": "E", "to": ["IA", "IP"], "rate": "0.5", "split": [["0.25", "0.4"], ["0.75", "0.6"]]},
+        {"from": "IA", "to": "R", "days": "2.0"},
+        {"from": "IP", "to": "IS", "days": "1.0"},
+        {"from": "IS", "to": "H", "rate": "0.1", "high_risk_multiplier": "3"},
+        {"from": "IS", "to": "R", "rate": "0.4"},
+        {"from": "H", "to": "R", "rate": "0.2"},
+    ]
+    graph = TransitionGraph(["S", "E", "IA", "IP", "IS", "H", "R"], transitions,
+                            {"IA": "0.5", "IP": "0.8", "IS": "1.0"}, 2)
+    prop_asymptomatic = np.array([0.25, 0.4])
+    expected = prop_asymptomatic * 0.5 * 2.0 + (1 - prop_asymptomatic) * (0.8 * 1.0 + 1.0 / 0.5)
+    np.testing.assert_allclose(graph.infectious_days(), expected)
+    # the high risk multiplier only touches the IS -> H rate of high risk groups
+    assert np.allclose(graph.rate[:, 1, :, 5], 0.3) and np.allclose(graph.rate[:, 0, :, 5], 0.1)
+
+def test_stochastic_graph_conserves_people_and_matches_expected_flows():
+    params = make_params({"compartments": ["S", "E", "I", "R", "V"], "beta": "0.3",
+                          "transitions": [
+                              {"from": "S", "to": "E", "rate": "infection"},
+                              {"from": "S", "to": "V", "rate": "0.05"},
+                              {"from": "V", "to": "E", "rate": "infection", "susceptibility": "0.2"},
+                              {"from": "V", "to": "S", "days": "90"},
+                              {"from": "E", "to": "I", "days": "3.0"},
+                              {"from": "I", "to": "R", "days": "4.0"}],
+                          "infectiousness": {"I": "1.0"}})
+    model = make_model("graph-stochastic", params)
+    net = make_network(["S", "E", "I", "R", "V"], seeded=[500.0, 50.0])
+    state = net.get_compartment_array()
+    beta = model._calculate_beta_w_npi_network(2)
+    population = net.get_population_array()
+    rates = model._transition_rates(state, beta, population, VACCINE)
+
+    draws = np.array([model._stochastic_flows(state, rates) for _ in range(2000)])
+    after = state + draws @ model.graph.stoichiometry
+    assert np.allclose(after.sum(axis=-1), state.sum(axis=-1))
+    assert np.all(after >= 0)
+
+    # S leaves by infection or vaccination, competing; I leaves to R alone
+    counts = np.trunc(state)
+    total = rates[..., 0] + rates[..., 1]
+    expected_infections = counts[..., 0] * -np.expm1(-total) * rates[..., 0] / total
+    np.testing.assert_allclose(draws[..., 0].mean(axis=0), expected_infections, rtol=0.1, atol=0.5)
+    np.testing.assert_allclose(draws[..., 5].mean(axis=0), counts[..., 2] * -np.expm1(-0.25), rtol=0.1, atol=0.5)
+
+def test_graph_rejects_unknown_compartments_and_bad_splits():
+    with pytest.raises(ValueError, match="ICU"):
+        TransitionGraph(["S", "E", "I", "R"], [{"from": "S", "to": "E", "rate": "infection"},
+                                               {"from": "I", "to": "ICU", "rate": "0.1"}], {"I": 1}, 2)
+    with pytest.raises(ValueError, match="add up to 1"):
+        TransitionGraph(["S", "E", "I", "R"], [{"from": "S", "to": "E", "rate": "infection"},
+                                               {"from": "E", "to": ["I", "R"], "rate": "0.1", "split": [0.5, 0.6]}],
+                        {"I": 1}, 2)
+    assert group_array([[1, 2], [3, 4]], 2)[1, 1, 0] == 4
+
+def test_stages_give_erlang_durations_with_the_same_mean_and_splits():
+    transitions = [
+        {"from": "S", "to": "E", "rate": "infection"},
+        {"from": "E", "to": "I", "days": "3.0", "stages": "3"},
+        {"from": "I", "to": "H", "rate": "0.05", "vaccine_effectiveness": "vaccine_effectiveness_hosp", "stages": "2"},
+        {"from": "I", "to": "R", "rate": "0.2"},
+        {"from": "H", "to": "R", "days": "5.0"},
+    ]
+    labels = DiseaseModel.compartment_labels({"compartments": ["S", "E", "I", "H", "R"], "transitions": transitions})
+    assert labels == ["S", "E", "E_2", "E_3", "I", "I_2", "H", "R"]
+    graph = TransitionGraph(["S", "E", "I", "H", "R"], transitions, {"I": "1.0"}, 2)
+    assert graph.compartments == labels
+    np.testing.assert_allclose(graph.infectious_weights, [0, 0, 0, 0, 1, 1, 0, 0])
+    # each of the two I stages is left at twice the total exit rate, so infectiousness lasts 1 / 0.25 days
+    np.testing.assert_allclose(graph.infectious_days(), 1 / 0.25)
+
+    # the deterministic graph, in short steps, empties E like an Erlang(3) of mean 3 days: P(T > t) =
+    # exp(-t) (1 + t + t^2 / 2) at one stage a day; an exponential would leave exp(-1) at day 3
+    model = make_model("graph-deterministic", make_params(
+        {"compartments": ["S", "E", "I", "H", "R"], "beta": "0.0", "transitions": transitions,
+         "infectiousness": {"I": "1.0"}, "steps_per_day": "256"}), nodes=1)
+    net = Network(labels)
+    pc = PopulationCompartments(age_group_pops=[1000, 3000], high_risk_ratios=[0.0, 0.0])
+    pc.compartment_data[..., 1] = pc.compartment_data[..., 0]
+    pc.compartment_data[..., 0] = 0.0
+    net._add_node(Node(0, 1, 1, pc))
+    for day in (1, 2, 3):
+        model.simulate_network(net, day, VACCINE)
+    in_E = net.get_compartment_array()[..., 1:4].sum() / 4000
+    assert in_E == pytest.approx(np.exp(-3.0) * (1 + 3 + 4.5), abs=2e-3)
+
+    # vaccinated people leave I for H at a lower rate, and move through the stages of I at the lower total
+    rates = model._transition_rates(net.get_compartment_array(), np.zeros((1, 2)), np.array([4000.0]), VACCINE)
+    progression_of_I = graph.progression[-1]
+    np.testing.assert_allclose(rates[0, :, :, 1, progression_of_I], 2 * (0.05 * 0.5 + 0.2))
+    np.testing.assert_allclose(rates[0, :, :, 0, progression_of_I], 2 * 0.25)
+
+def test_stages_of_competing_transitions_must_agree():
+    with pytest.raises(ValueError):
+        TransitionGraph(["S", "E", "I", "R"], [{"from": "S", "to": "E", "rate": "infection"},
+                                               {"from": "E", "to": "I", "days": "3", "stages": "3"},
+                                               {"from": "E", "to": "R", "days": "9", "stages": "2"},
+                                               {"from": "I", "to": "R", "days": "4"}], {"I": "1"}, 2)
+    with pytest.raises(ValueError):
+        TransitionGraph(["S", "E", "I", "R"], [{"from": "S", "to": "E", "rate": "infection", "stages": "2"},
+                                               {"from": "E", "to": "I", "days": "3"},
+                                               {"from": "I", "to": "R", "days": "4"}], {"I": "1"}, 2)
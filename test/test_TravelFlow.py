@@ -1,9 +1,170 @@
+import copy
 import pytest
+import numpy as np
+from scipy import sparse
 
-from src.baseclasses.TravelFlow import TravelFlow
+from src.baseclasses.Network import Network
+from src.baseclasses.TravelFlow import TravelFlow, TravelFlowSchedule, TravelKernels, SyntheticTravelFlow, prune_flow
 
+#////////////////////
+#### Helper Funs ####
 
-def test_TravelFlow():
-    pass
+FLOW = np.array([
+    [0.60, 0.20, 0.10, 0.05],
+    [0.01, 0.70, 0.00, 0.02],
+    [0.30, 0.04, 0.50, 0.06],
+    [0.00, 0.00, 0.00, 0.90],
+])
 
+def off_diagonal_mass(m):
+    m = np.asarray(m)
+    return m.sum() - np.trace(m)
 
+@pytest.fixture
+def flow_file(tmp_path):
+    path = tmp_path / "flow.csv"
+    np.savetxt(path, FLOW, delimiter=",")
+    return str(path)
+
+#//////////////
+#### TESTS ####
+
+def test_load_without_pruning_matches_dense(flow_file):
+    tf = TravelFlow(4)
+    tf.load_travel_flow_file(flow_file, chunk_size=3)  # two chunks
+    assert sparse.isspmatrix_csr(tf.flow_data)
+    np.testing.assert_allclose(tf.flow_data.toarray(), FLOW)
+    assert tf.flow_data.nnz == np.count_nonzero(FLOW)
+    assert tf.discarded_mass == 0.0
+    assert np.isclose(tf.total_mass, off_diagonal_mass(FLOW))
+
+def test_threshold_keeps_diagonal_and_reports_mass(flow_file):
+    tf = TravelFlow(4)
+    tf.load_travel_flow_file(flow_file, threshold=0.05)
+    expected = np.where(FLOW >= 0.05, FLOW, 0.0)
+    np.testing.assert_allclose(tf.flow_data.toarray(), expected)
+    assert np.isclose(tf.discarded_mass, 0.01 + 0.02 + 0.04)
+
+def test_top_k_per_row():
+    block, total, discarded = prune_flow(sparse.csr_matrix(FLOW), top_k=1)
+    expected = np.diag(np.diag(FLOW))
+    expected[0, 1] = 0.20
+    expected[1, 3] = 0.02
+    expected[2, 0] = 0.30
+    np.testing.assert_allclose(block.toarray(), expected)
+    assert np.isclose(total - discarded, block.toarray().sum() - np.trace(FLOW))
+
+def test_mass_fraction_per_row():
+    # row 0 off-diagonal mass is 0.35; 0.20 + 0.10 = 0.30 >= 0.8 * 0.35
+    block, _, discarded = prune_flow(sparse.csr_matrix(FLOW), mass_fraction=0.8)
+    pruned = block.toarray()
+    np.testing.assert_allclose(pruned[0], [0.60, 0.20, 0.10, 0.0])
+    np.testing.assert_allclose(pruned[2], [0.30, 0.0, 0.50, 0.06])
+    np.testing.assert_allclose(pruned[1], FLOW[1])
+    assert np.isclose(discarded, 0.05 + 0.04)
+
+def test_prune_block_offset_finds_diagonal():
+    # rows 2 and 3 only; the diagonal of global row 2 is column 2
+    block, _, _ = prune_flow(sparse.csr_matrix(FLOW[2:]), first_row=2, top_k=0)
+    np.testing.assert_allclose(block.toarray(), [[0.0, 0.0, 0.50, 0.0], [0.0, 0.0, 0.0, 0.90]])
+
+def test_schedule_switches_lazily_and_reuses_cache(tmp_path):
+    files = []
+    for quarter in range(3):
+        path = tmp_path / f"Q{quarter+1}.csv"
+        np.savetxt(path, FLOW * (quarter + 1), delimiter=",")
+        files.append(str(path))
+    cache_dir = str(tmp_path / "cache")
+    schedule = TravelFlowSchedule(4, [(90, files[1]), (0, files[0]), (181, files[2])], cache_dir)
+
+    assert [schedule.index_for_day(d) for d in (0, 89, 90, 180, 181, 400)] == [0, 0, 1, 1, 2, 2]
+    q2 = schedule.flow_for_day(100)
+    np.testing.assert_allclose(q2.toarray(), FLOW * 2)
+    assert isinstance(np.load(schedule.cache_paths[1] + "/data.npy", mmap_mode="r"), np.memmap)
+
+    # a second schedule over the same files reads the cache instead of the csv
+    for f in files:
+        open(f, "a").close()
+    again = TravelFlowSchedule(4, [(0, files[0])], cache_dir)
+    assert again.cache_paths[0] == schedule.cache_paths[0]
+
+def test_network_picks_up_scheduled_flow_on_switch_day(tmp_path):
+    q1, q2 = str(tmp_path / "Q1.csv"), str(tmp_path / "Q2.csv")
+    np.savetxt(q1, FLOW, delimiter=",")
+    np.savetxt(q2, FLOW.T, delimiter=",")
+    network = Network(["S", "E", "I", "R"])
+    network.add_travel_flow_schedule(TravelFlowSchedule(4, [(0, q1), (10, q2)], str(tmp_path / "cache")))
+
+    np.testing.assert_allclose(network.travel_flow_data.toarray(), FLOW)
+    assert network.update_travel_flow(9) is False
+    assert network.update_travel_flow(10) is True
+    np.testing.assert_allclose(network.travel_flow_data.toarray(), FLOW.T)
+    assert network.update_travel_flow(11) is False
+
+def test_schedule_releases_kernels_of_previous_matrix(tmp_path):
+    q1, q2 = str(tmp_path / "Q1.csv"), str(tmp_path / "Q2.csv")
+    np.savetxt(q1, FLOW, delimiter=",")
+    np.savetxt(q2, FLOW * 2, delimiter=",")
+    schedule = TravelFlowSchedule(4, [(0, q1), (10, q2)], str(tmp_path / "cache"))
+    population = np.array([100.0, 200.0, 50.0, 50.0])
+
+    first = schedule.kernels_for_day(0, population)
+    assert schedule.kernels_for_day(5, population) is first
+    second = schedule.kernels_for_day(10, population)
+    assert second is not first
+    assert list(schedule._kernels) == [1]
+    np.testing.assert_allclose(second.flow_by_row.toarray(), (FLOW - np.diag(np.diag(FLOW))) * 2)
+
+def test_kernels_fold_in_population_and_are_shared_by_copies():
+    population = np.array([100.0, 200.0, 0.0, 50.0])
+    kernels = TravelKernels(sparse.csr_matrix(FLOW), population)
+    off_diagonal = FLOW - np.diag(np.diag(FLOW))
+    inverse = np.array([0.01, 0.005, 0.0, 0.02])
+
+    np.testing.assert_allclose(kernels.inward.toarray(), off_diagonal * inverse[None, :])
+    np.testing.assert_allclose(kernels.outward.toarray(), off_diagonal.T * inverse[:, None])
+    assert sparse.isspmatrix_csc(kernels.inward) and sparse.isspmatrix_csc(kernels.outward)
+    sources = np.array([0, 3])
+    np.testing.assert_allclose(kernels.inward_columns(sources).toarray(), kernels.inward.toarray()[:, sources])
+    np.testing.assert_allclose(kernels.outward_columns(sources).toarray(), kernels.outward.toarray()[:, sources])
+    terms = np.arange(8.0).reshape(4, 2)
+    np.testing.assert_allclose(kernels.inward_product(terms), kernels.inward.toarray() @ terms)
+    np.testing.assert_allclose(kernels.outward_product(terms), kernels.outward.toarray() @ terms)
+    assert copy.deepcopy(kernels) is kernels
+
+def make_synthetic(model, **kwargs):
+    rng = np.random.default_rng(5)
+    population = rng.integers(1000, 100000, size=11).astype(float)
+    coordinates = np.column_stack([rng.uniform(29, 33, 11), rng.uniform(-100, -95, 11)])
+    return SyntheticTravelFlow(population, coordinates, model=model, travel_fraction=0.2,
+                               block_size=3, max_blocks=2, **kwargs)
+
+@pytest.mark.parametrize("model", ["gravity", "radiation"])
+def test_synthetic_rows_and_columns_agree_with_lru_bound(model):
+    provider = make_synthetic(model)
+    full = provider.to_csr().toarray()
+    assert np.allclose(np.diag(full), 0.0)
+    np.testing.assert_allclose(full.sum(axis=1), 0.2)
+
+    picks = np.array([9, 0, 4, 10])
+    np.testing.assert_allclose(provider.rows(picks).toarray(), full[picks])
+    np.testing.assert_allclose(provider.columns(picks).toarray(), full[:, picks])
+    assert len(provider._row_blocks) <= 2 and len(provider._column_blocks) <= 2
+
+def test_radiation_intervening_population():
+    # four nodes on the equator, 0 is the origin; 1 is closest, 3 furthest
+    population = np.array([100.0, 10.0, 20.0, 40.0])
+    coordinates = np.array([[0.0, 0.0], [0.0, 0.1], [0.0, 0.2], [0.0, 0.3]])
+    provider = SyntheticTravelFlow(population, coordinates, model="radiation", travel_fraction=1.0)
+    m, n = 100.0, population[1:]
+    s = np.array([0.0, 10.0, 30.0])
+    weight = m * n / ((m + s) * (m + n + s))
+    np.testing.assert_allclose(provider.rows(np.array([0])).toarray()[0, 1:], weight / weight.sum())
+
+def test_gravity_cutoff_and_min_flow():
+    provider = make_synthetic("gravity", cutoff_km=150.0, min_flow=1e-3)
+    full = provider.to_csr()
+    distance = provider._distances(np.arange(11))
+    rows, cols = full.nonzero()
+    assert np.all(distance[rows, cols] <= 150.0)
+    assert full.data.min() >= 1e-3